@@ -0,0 +1,52 @@
+"""Microbenchmark comparing the old regex request parsing to hhttpp.parsing.RequestParser
+
+Run from the project root with:
+```
+python -m benchmarks.parsing_benchmark
+```
+"""
+import re
+import timeit
+
+from hhttpp.classes import parse_headers, parse_content
+from hhttpp.parsing import RequestParser
+
+# A typical request from a browser
+RAW_REQUEST = (
+    b"GET /posts/pelicans-in-calgary.html HTTP/1.1\r\n"
+    b"Host: localhost:8338\r\n"
+    b"User-Agent: Mozilla/5.0 (X11; Linux x86_64; rv:120.0) Gecko/20100101 Firefox/120.0\r\n"
+    b"Accept: text/html,application/xhtml+xml,application/xml;q=0.9,image/avif,image/webp,*/*;q=0.8\r\n"
+    b"Accept-Language: en-CA,en-US;q=0.7,en;q=0.3\r\n"
+    b"Accept-Encoding: gzip, deflate, br\r\n"
+    b"Connection: keep-alive\r\n"
+    b"Referer: http://localhost:8338/posts\r\n"
+    b"Upgrade-Insecure-Requests: 1\r\n"
+    b"Sec-Fetch-Dest: document\r\n"
+    b"Sec-Fetch-Mode: navigate\r\n"
+    b"Sec-Fetch-Site: same-origin\r\n\r\n"
+)
+
+def regex_parse(raw_request:bytes):
+    # How requests were parsed before RequestParser, three regex passes over the decoded text
+    input_text = raw_request.decode()
+    first_line = re.match(r"([A-z]{3,6}) (\/.*) HTTP\/(\d\.\d)", input_text, re.MULTILINE)
+    return first_line.group(1), first_line.group(2), parse_headers(input_text), parse_content(input_text)
+
+def incremental_parse(raw_request:bytes):
+    parser = RequestParser()
+    parser.feed(raw_request)
+    return parser.method, parser.slug, parser.headers, parser.body
+
+def chunked_incremental_parse(raw_request:bytes):
+    # The same request arriving in 64 byte reads
+    parser = RequestParser()
+    for start in range(0, len(raw_request), 64):
+        parser.feed(raw_request[start:start + 64])
+    return parser.method, parser.slug, parser.headers, parser.body
+
+if __name__ == "__main__":
+    iterations = 20_000
+    for function in (regex_parse, incremental_parse, chunked_incremental_parse):
+        seconds = min(timeit.repeat(lambda: function(RAW_REQUEST), number=iterations, repeat=5))
+        print(f"{function.__name__:>26}: {seconds / iterations * 1_000_000:7.2f}µs per request")
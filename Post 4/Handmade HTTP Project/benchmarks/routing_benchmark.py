@@ -0,0 +1,84 @@
+"""Benchmark comparing the old glob based URL table to hhttpp.routing.RouteIndex on a large tree
+
+Makes a temporary tree of empty files (100,000 by default) then times building each table, and
+looking up file URL's, .html aliases, directory indexes and misses.
+
+Run from the project root with:
+```
+python -m benchmarks.routing_benchmark [FILE_COUNT]
+```
+"""
+import os
+import sys
+import glob
+import time
+import random
+import timeit
+import tempfile
+
+from hhttpp.routing import RouteIndex
+
+FILES_PER_DIRECTORY = 100
+
+def make_tree(root:str, file_count:int):
+    # Spreads files over directories 2 levels deep, with a mix of pages and assets
+    for number in range(file_count):
+        directory = os.path.join(root, f"section{number // 10_000}", f"folder{number // FILES_PER_DIRECTORY}")
+        if number % FILES_PER_DIRECTORY == 0:
+            os.makedirs(directory, exist_ok=True)
+        name = "index.html" if number % FILES_PER_DIRECTORY == 0 else f"page{number}.html" if number % 2 else f"asset{number}.css"
+        open(os.path.join(directory, name), "w").close()
+
+def legacy_urls(proxy_directory:str) -> dict:
+    # How Server.__post_init__ built it's URL table before RouteIndex
+    proxy_dir = os.path.abspath(proxy_directory)
+    file_list = [f"{os.path.join(proxy_dir, file)}" for file in glob.iglob(os.path.join(proxy_dir, '**',"*.*"), recursive=True)]
+    urls = dict()
+    for file in file_list:
+        base_url = file.replace(proxy_dir, "")
+        file = os.path.relpath(file)
+        if "index.html" in file:
+            urls["/"] = file
+            urls["/index.html"] = file
+            continue
+        if file.endswith(".html"):
+            url = base_url.replace("\\","/").replace(r"//","/").replace(".html","")
+            if not url.startswith("/"):
+                url = "/" + url
+            urls[url] = file
+        url = base_url.replace("\\","/").replace(r"//","/")
+        if not url.startswith("/"):
+            url = "/" + url
+        urls[url] = file
+    return urls
+
+def time_build(function, *args) -> float:
+    started = time.perf_counter()
+    function(*args)
+    return time.perf_counter() - started
+
+if __name__ == "__main__":
+    file_count = int(sys.argv[1]) if len(sys.argv) > 1 else 100_000
+    with tempfile.TemporaryDirectory() as root:
+        print(f"Making {file_count:,} files...")
+        make_tree(root, file_count)
+
+        print(f"{'legacy glob table':>26}: {time_build(legacy_urls, root):7.2f}s to build")
+        print(f"{'RouteIndex.scan()':>26}: {time_build(RouteIndex.scan, root, []):7.2f}s to build")
+
+        routes = RouteIndex.scan(root)
+        urls = list(routes.files)
+        random.seed(0)
+        samples = {
+            "file URL": random.sample(urls, 1000),
+            ".html alias": [url[:-5] for url in random.sample([url for url in urls if url.endswith(".html") and not url.endswith("index.html")], 1000)],
+            "directory index": [url[:-len("index.html")] for url in urls if url.endswith("index.html")][:1000],
+            "miss": [f"/section0/folder{number}/missing{number}" for number in range(1000)],
+        }
+        for name, slugs in samples.items():
+            lookup = routes.lookup
+            seconds = min(timeit.repeat(lambda: [lookup(slug) for slug in slugs], number=20, repeat=5))
+            print(f"{name:>26}: {seconds / (20 * len(slugs)) * 1_000_000:7.2f}µs per lookup")
+        dictionary = dict(routes.files)
+        seconds = min(timeit.repeat(lambda: [dictionary.get(slug) for slug in samples["file URL"]], number=20, repeat=5))
+        print(f"{'plain dict (baseline)':>26}: {seconds / (20 * 1000) * 1_000_000:7.2f}µs per lookup")
@@ -0,0 +1,454 @@
+"""This module houses the load generator used by "hhttpp bench" to measure how fast a Server responds
+
+A benchmark starts a Server in it's own process (so the clients and the server don't share a GIL),
+or targets one that's already running, then has a number of clients send GET requests for URL's
+picked at random from a weighted mix as fast as they're answered. Each client is a thread with a
+blocking socket that either keeps it's connection open between requests (keep-alive) or opens a
+new one for every request. The latency of a request is measured from just before it's sent (or
+it's connection is opened, when it needs a new one) until the last byte of the response is read.
+
+Classes
+-------
+BenchResult:
+    Used to represent the outcome of a benchmark, with the latency of every request
+
+References
+----------
+- HTTP/1.1 message framing: https://www.rfc-editor.org/rfc/rfc9112#section-6
+- Latency percentiles: https://en.wikipedia.org/wiki/Percentile#The_nearest-rank_method
+
+Examples
+--------
+Benchmarking the asyncio engine with a response cache, on every file in example_site
+```
+from hhttpp.bench import url_mix, bench_server
+
+mix = url_mix("example_site")
+result = bench_server({"proxy_directory": "example_site", "response_cache_max_bytes": 16 * 1024 * 1024}, mix, engine="asyncio", clients=32, duration=10)
+print(result.summary())
+result.to_dict() # The same numbers, ready for json.dumps()
+```
+
+Benchmarking a server that's already running on port 8338, with the homepage requested 5 times as often as the FAQ
+```
+from hhttpp.bench import parse_url_mix, run_clients
+
+result = run_clients("127.0.0.1", 8338, parse_url_mix("/:5,/faq"), clients=8, requests=10_000, keep_alive=False)
+result.latency(0.99) # The 99th percentile latency in seconds
+```
+"""
+from __future__ import annotations
+import os
+import sys
+import time
+import math
+import random
+import socket
+import asyncio
+import itertools
+import threading
+import multiprocessing
+from dataclasses import dataclass, field
+from typing import Any, Union, Dict, List, Tuple
+
+from .routing import scan_files
+
+PERCENTILES = (0.5, 0.9, 0.99, 0.999) # The latency percentiles reported
+
+@dataclass
+class BenchResult:
+    # Used to represent the outcome of a benchmark, with the latency of every request
+    target: str # The host:port that was benchmarked
+    clients: int # The number of concurrent clients
+    keep_alive: bool # Whether clients kept their connections open between requests
+    duration: float # Seconds from the first request being sent until the last client finished
+    requests: int = 0 # The number of responses read
+    errors: int = 0 # The number of requests that failed without a response (i.e. refused or reset connections, timeouts)
+    bytes_received: int = 0 # The bytes read for every response, including their headers
+    statuses: Dict[int, int] = field(default_factory=lambda:dict()) # The number of responses with each status code
+    latencies: List[float] = field(default_factory=lambda:list(), repr=False) # The seconds every response took, sorted
+    settings: Dict[str, Any] = field(default_factory=lambda:dict()) # How the server was set up (if it was started for the benchmark), to tell runs apart
+
+    def requests_per_second(self) -> float:
+        """Gets the number of responses read per second"""
+        return self.requests / self.duration if self.duration > 0 else 0.0
+
+    def megabytes_per_second(self) -> float:
+        """Gets the megabytes (MiB) of responses read per second"""
+        return self.bytes_received / (1024 * 1024) / self.duration if self.duration > 0 else 0.0
+
+    def error_responses(self) -> int:
+        """Gets the number of responses with a 4xx or 5xx status code"""
+        return sum(count for status, count in self.statuses.items() if status >= 400)
+
+    def latency(self, fraction:float) -> float:
+        """Gets the latency (in seconds) that fraction (0-1) of requests were at least as fast as, with the nearest-rank method"""
+        if not self.latencies:
+            return 0.0
+        rank = max(1, math.ceil(fraction * len(self.latencies)))
+        return self.latencies[min(rank, len(self.latencies)) - 1]
+
+    def to_dict(self) -> Dict[str, Any]:
+        """Gets the result as a dict that can be written as JSON, with latencies in milliseconds"""
+        latency_ms = {"mean": round(sum(self.latencies) / len(self.latencies) * 1000, 3) if self.latencies else 0.0}
+        for fraction in PERCENTILES:
+            latency_ms[percentile_name(fraction)] = round(self.latency(fraction) * 1000, 3)
+        latency_ms["max"] = round(self.latencies[-1] * 1000, 3) if self.latencies else 0.0
+        return {
+            "target": self.target,
+            "clients": self.clients,
+            "keep_alive": self.keep_alive,
+            "duration": round(self.duration, 3),
+            "requests": self.requests,
+            "requests_per_second": round(self.requests_per_second(), 1),
+            "megabytes_per_second": round(self.megabytes_per_second(), 3),
+            "bytes_received": self.bytes_received,
+            "latency_ms": latency_ms,
+            "errors": self.errors,
+            "error_responses": self.error_responses(),
+            "statuses": {str(status): count for status, count in sorted(self.statuses.items())},
+            "settings": self.settings,
+        }
+
+    def summary(self) -> str:
+        """Gets the result as lines of text for a terminal"""
+        latencies = "  ".join(f"{percentile_name(fraction)} {self.latency(fraction) * 1000:.3f}ms" for fraction in PERCENTILES)
+        statuses = ", ".join(f"{status}: {count}" for status, count in sorted(self.statuses.items())) or "none"
+        return "\n".join([
+            f"{self.requests} requests to {self.target} in {self.duration:.2f}s from {self.clients} {'keep-alive' if self.keep_alive else 'non keep-alive'} clients",
+            f"Requests/sec: {self.requests_per_second():.1f}",
+            f"Throughput:   {self.megabytes_per_second():.3f} MB/s",
+            f"Latency:      {latencies}  max {self.latencies[-1] * 1000 if self.latencies else 0:.3f}ms",
+            f"Statuses:     {statuses}",
+            f"Errors:       {self.errors} failed requests, {self.error_responses()} 4xx/5xx responses",
+        ])
+
+def percentile_name(fraction:float) -> str:
+    """Gets the name of a percentile (i.e. 0.999 is "p999") from the digits after the decimal point"""
+    digits = f"{fraction:.6f}".rstrip("0").partition(".")[2]
+    return f"p{digits:0<2}"
+
+def parse_url_mix(text:str) -> List[Tuple[str, float]]:
+    """Reads a URL mix from comma separated URL's, each with an optional weight after a colon (i.e. "/:5,/faq,/img/logo.png:0.5")
+
+    Raises
+    ------
+    ValueError
+        If there are no URL's, a URL doesn't start with "/", or a weight isn't a positive number
+    """
+    mix = []
+    for item in text.split(","):
+        item = item.strip()
+        if not item:
+            continue
+        url, _, weight = item.rpartition(":") if ":" in item else (item, "", "1")
+        if not url.startswith("/"):
+            raise ValueError(f"URL {url} in the URL mix must start with /")
+        try:
+            weight = float(weight)
+        except ValueError:
+            raise ValueError(f"Weight {weight} for {url} in the URL mix is not a number")
+        if not weight > 0:
+            raise ValueError(f"Weight {weight} for {url} in the URL mix must be more than 0")
+        mix.append((url, weight))
+    if not mix:
+        raise ValueError("The URL mix has no URL's")
+    return mix
+
+def url_mix(directory:str = ".", bundle:Union[None, str] = None) -> List[Tuple[str, float]]:
+    """Makes a URL mix with every file a Server would serve (found the same way as RouteIndex.scan(), or from a bundle) weighted equally
+
+    Raises
+    ------
+    ValueError
+        If there are no files to request
+    """
+    if bundle:
+        from .bundle import Bundle
+        urls = Bundle.open(bundle).urls
+    else:
+        urls = [url for url, _ in scan_files(os.path.abspath(directory))]
+    mix = [(url, 1.0) for url in sorted(urls) if not any(character.isspace() for character in url)] # Whitespace can't be sent in a request line
+    if not mix:
+        raise ValueError(f"There are no files in {bundle or directory} to request")
+    return mix
+
+def read_response(stream) -> Tuple[int, int, bool]:
+    """Reads one response from a file object made with socket.makefile("rb")
+
+    Returns
+    -------
+    Tuple[int, int, bool]
+        The status code, the bytes read (headers and body), and whether the server is closing the connection
+
+    Raises
+    ------
+    ValueError
+        If the connection closed before the whole response was read, or the response is malformed
+    """
+    status_line = stream.readline()
+    if not status_line.startswith(b"HTTP/"):
+        raise ValueError("Connection closed without a response" if not status_line else f"Malformed status line {status_line!r}")
+    status = int(status_line[9:12])
+    size = len(status_line)
+    content_length, chunked, close = None, False, status_line.startswith(b"HTTP/1.0")
+    while True:
+        line = stream.readline()
+        size += len(line)
+        if not line.endswith(b"\n"):
+            raise ValueError("Connection closed in the middle of the headers")
+        if line in (b"\r\n", b"\n"):
+            break
+        header, _, value = line.partition(b":")
+        header, value = header.strip().lower(), value.strip().lower()
+        if header == b"content-length":
+            content_length = int(value)
+        elif header == b"transfer-encoding":
+            chunked = value.endswith(b"chunked")
+        elif header == b"connection":
+            close = value == b"close"
+
+    if chunked:
+        while True:
+            line = stream.readline()
+            chunk_size = int(line.split(b";")[0], 16)
+            body = stream.read(chunk_size + 2) # The chunk and the CRLF after it (the last chunk has no data, just the CRLF)
+            size += len(line) + len(body)
+            if len(body) < chunk_size + 2:
+                raise ValueError("Connection closed in the middle of a chunk")
+            if chunk_size == 0:
+                break
+    elif content_length is not None:
+        body = stream.read(content_length)
+        size += len(body)
+        if len(body) < content_length:
+            raise ValueError("Connection closed in the middle of the body")
+    elif status >= 200 and status not in (204, 304):
+        size += len(stream.read()) # No length, so the body ends when the connection does
+        close = True
+    return status, size, close
+
+@dataclass
+class _ClientStats:
+    # Used to keep what each client measured apart, so clients never wait on each other to record a request
+    latencies: List[float] = field(default_factory=lambda:list())
+    statuses: Dict[int, int] = field(default_factory=lambda:dict())
+    bytes_received: int = 0
+    errors: int = 0
+
+def _run_client(host:str, port:int, payloads:List[bytes], weights:List[float], keep_alive:bool, timeout:float, stop_at:float, budget, seed:int, stats:_ClientStats):
+    # Runs in each client thread, sending requests until stop_at or the shared budget of requests runs out
+    picker = random.Random(seed)
+    picks = []
+    connection, stream = None, None
+    perf_counter = time.perf_counter
+    try:
+        while perf_counter() < stop_at and (budget is None or next(budget) > 0):
+            if not picks: # Picking in batches keeps random.choices() out of the timed part of most requests
+                picks = picker.choices(payloads, weights, k=256)
+            payload = picks.pop()
+            started = perf_counter()
+            try:
+                if connection is None:
+                    connection = socket.create_connection((host, port), timeout=timeout)
+                    connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+                    stream = connection.makefile("rb")
+                connection.sendall(payload)
+                status, size, close = read_response(stream)
+            except (OSError, ValueError):
+                stats.errors += 1
+                close = True
+            else:
+                stats.latencies.append(perf_counter() - started)
+                stats.statuses[status] = stats.statuses.get(status, 0) + 1
+                stats.bytes_received += size
+            if (close or not keep_alive) and connection is not None:
+                stream.close()
+                connection.close()
+                connection, stream = None, None
+    finally:
+        if connection is not None:
+            stream.close()
+            connection.close()
+
+def _countdown(requests:int):
+    # Counts down from requests, next() is atomic on itertools objects so clients can share it without a lock
+    return itertools.chain(range(requests, 0, -1), itertools.repeat(0))
+
+def run_clients(host:str, port:int, mix:List[Tuple[str, float]], clients:int = 16, duration:float = 10.0, requests:Union[None, int] = None, keep_alive:bool = True, accept_gzip:bool = False, timeout:float = 10.0, warmup:float = 0.0, seed:Union[None, int] = None) -> BenchResult:
+    """Sends requests for the URL's in a mix to a server from concurrent clients, and measures how quickly they're answered
+
+    Parameters
+    ----------
+    host : str
+        The host the server is listening on (i.e. "127.0.0.1")
+
+    port : int
+        The port the server is listening on
+
+    mix : List[Tuple[str, float]]
+        The URL's to request and their weights, URL's are picked at random in proportion to their weight (see parse_url_mix() and url_mix())
+
+    clients : int, optional
+        The number of clients sending requests at the same time, by default 16
+
+    duration : float, optional
+        Seconds to send requests for, by default 10.0
+
+    requests : Union[None, int], optional
+        The number of requests to send between all the clients instead of stopping after duration, by default None
+
+    keep_alive : bool, optional
+        Whether clients keep their connection open between requests, or open a new one for every request, by default True
+
+    accept_gzip : bool, optional
+        Whether requests say they accept gzip, so servers that compress send compressed responses, by default False
+
+    timeout : float, optional
+        Seconds to wait for a connection or response before counting the request as an error, by default 10.0
+
+    warmup : float, optional
+        Seconds to send requests for (without measuring them) before the benchmark starts, to fill caches, by default 0.0
+
+    seed : Union[None, int], optional
+        Seeds the URL's each client picks so runs request the same URL's in the same order, by default None
+
+    Returns
+    -------
+    BenchResult
+        The number of requests, their latencies, statuses, bytes and errors
+
+    Raises
+    ------
+    ValueError
+        If there are no clients, or the mix is empty
+    """
+    if clients < 1:
+        raise ValueError(f"Need at least 1 client, got {clients}")
+    if not mix:
+        raise ValueError("The URL mix has no URL's")
+    if warmup > 0:
+        run_clients(host, port, mix, clients, duration=warmup, keep_alive=keep_alive, accept_gzip=accept_gzip, timeout=timeout, seed=seed)
+
+    headers = f"Host: {host}:{port}\r\n"
+    if accept_gzip:
+        headers += "Accept-Encoding: gzip\r\n"
+    if not keep_alive:
+        headers += "Connection: close\r\n"
+    payloads = [f"GET {url} HTTP/1.1\r\n{headers}\r\n".encode("utf-8", "surrogateescape") for url, _ in mix]
+    weights = [weight for _, weight in mix]
+    seeds = random.Random(seed)
+    budget = _countdown(requests) if requests is not None else None
+    stop_at = math.inf if requests is not None else time.perf_counter() + duration
+    stats = [_ClientStats() for _ in range(clients)]
+    threads = [
+        threading.Thread(target=_run_client, args=(host, port, payloads, weights, keep_alive, timeout, stop_at, budget, seeds.getrandbits(64), client_stats), name=f"hhttpp-bench-{number}", daemon=True)
+        for number, client_stats in enumerate(stats)
+    ]
+
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+
+    result = BenchResult(target=f"{host}:{port}", clients=clients, keep_alive=keep_alive, duration=elapsed)
+    for client_stats in stats:
+        result.requests += len(client_stats.latencies)
+        result.errors += client_stats.errors
+        result.bytes_received += client_stats.bytes_received
+        result.latencies.extend(client_stats.latencies)
+        for status, count in client_stats.statuses.items():
+            result.statuses[status] = result.statuses.get(status, 0) + count
+    result.latencies.sort()
+    return result
+
+def _serve(settings:Dict[str, Any], port:int, engine:str, workers:int, quiet:bool):
+    # Runs in the server process started by start_server_process()
+    from .classes import Server # Imported here since it's only needed in the server process
+    if quiet:
+        sys.stdout = open(os.devnull, "w")
+    server = Server(port=port, **settings)
+    if workers > 1:
+        server.start_workers(workers, engine)
+    elif engine == "asyncio":
+        asyncio.run(server.serve_async())
+    else:
+        server.start_server()
+
+def start_server_process(settings:Dict[str, Any], engine:str = "sockets", workers:int = 1, host:str = "127.0.0.1", timeout:float = 30.0, quiet:bool = True) -> Tuple[multiprocessing.Process, int]:
+    """Starts a Server in a new process on a free port, and waits until it accepts connections
+
+    Parameters
+    ----------
+    settings : Dict[str, Any]
+        The arguments to make the Server with (i.e. {"proxy_directory": "example_site", "threads": 8}), except port
+
+    engine : str, optional
+        The engine to serve with, either "sockets" or "asyncio", by default "sockets"
+
+    workers : int, optional
+        The number of worker processes to serve with (see Server.start_workers()), by default 1
+
+    host : str, optional
+        The host the server listens on, by default "127.0.0.1"
+
+    timeout : float, optional
+        Seconds to wait for the server to start (indexing a big folder can take a while), by default 30.0
+
+    quiet : bool, optional
+        Whether to hide what the server prints, by default True
+
+    Returns
+    -------
+    Tuple[multiprocessing.Process, int]
+        The server process (stop it with stop_server_process()) and the port it's listening on
+
+    Raises
+    ------
+    ValueError
+        If the engine isn't valid, or the server exits or doesn't start listening in time
+    """
+    if engine not in ("sockets", "asyncio"):
+        raise ValueError(f"Engine {engine} is not valid, use sockets or asyncio")
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as port_finder: # The port is released for the server to bind straight away
+        port_finder.bind((host, 0))
+        port = port_finder.getsockname()[1]
+    process = multiprocessing.Process(target=_serve, args=({"host": host, **settings}, port, engine, workers, quiet), name="hhttpp-bench-server", daemon=True)
+    process.start()
+    give_up_at = time.monotonic() + timeout
+    while True:
+        try:
+            socket.create_connection((host, port), timeout=1).close()
+            return process, port
+        except OSError:
+            if not process.is_alive() or time.monotonic() > give_up_at:
+                stop_server_process(process)
+                raise ValueError(f"Server did not start listening on port {port}" + (f" (it exited with code {process.exitcode})" if process.exitcode is not None else ""))
+            time.sleep(0.05)
+
+def stop_server_process(process:multiprocessing.Process, timeout:float = 5.0):
+    """Stops a server started by start_server_process(), killing it if it doesn't exit within timeout seconds"""
+    if process.is_alive():
+        process.terminate() # SIGTERM, which Server.start_workers() passes on to it's workers
+        process.join(timeout)
+    if process.is_alive():
+        process.kill()
+        process.join()
+
+def bench_server(settings:Dict[str, Any], mix:List[Tuple[str, float]], engine:str = "sockets", workers:int = 1, **client_options) -> BenchResult:
+    """Starts a Server in a new process with settings (see start_server_process()), benchmarks it with run_clients(), then stops it
+
+    Notes
+    -----
+    - client_options are passed on to run_clients() (i.e. clients, duration, requests, keep_alive)
+    - The settings, engine and workers are kept in the result's settings, so results can be compared
+    """
+    process, port = start_server_process(settings, engine, workers)
+    try:
+        result = run_clients("127.0.0.1", port, mix, **client_options)
+    finally:
+        stop_server_process(process)
+    result.settings = {"engine": engine, "workers": workers, **settings}
+    return result
@@ -0,0 +1,239 @@
+"""This module houses the bundles used by the Server to serve a whole site from one file
+
+A bundle packs every file in a folder (and gzipped copies of the compressible ones) into one file,
+along with an index of where each one starts. The Server memory maps the bundle and sends each file
+as a memoryview slice of the map, so there's no open() or stat() per request, and deploying a new
+version of a site is a single atomic rename of the bundle file.
+
+The file is laid out as (all integers are little endian)
+- A header: b"HHBN", the version (uint16), the number of files (uint32) and MIME types (uint16),
+  then where the index starts and it's size (uint64's)
+- The content of every file, and it's gzipped copy if it has one
+- The index: the strings (UTF-8 encoded and separated by NUL's) with the URL, ETag and Last-Modified
+  of every file then the MIME types, then arrays of int64's with the offset and size of every file,
+  the offset and size of it's gzipped copy (-1 for none) and it's modified time (seconds), then an array
+  of uint16's with the index of every file's MIME type, and a byte per MIME type that's 1 if it's binary
+
+Classes
+-------
+Bundle:
+    Used to serve the files in a bundle straight from a memory map of it
+
+References
+----------
+- mmap: https://docs.python.org/3/library/mmap.html
+- memoryview: https://docs.python.org/3/library/stdtypes.html#memoryview
+
+Examples
+--------
+Bundling a folder, then serving it
+```
+from hhttpp import Server
+from hhttpp.bundle import build_bundle
+
+build_bundle("example_site", "site.hhb")
+
+Server(bundle="site.hhb").start_server()
+```
+"""
+from __future__ import annotations
+import os
+import mmap
+import struct
+import hashlib
+import tempfile
+from array import array
+from email.utils import formatdate
+from dataclasses import dataclass, field
+from typing import Union, Dict, List, Tuple
+
+from .routing import scan_files
+from .compression import COMPRESSIBLE_TYPES, compress_stream, read_file_pieces
+from .manifest import join_strings, split_strings, int_array, int_array_bytes
+
+MAGIC = b"HHBN"
+VERSION = 1
+HEADER = struct.Struct("<4sHIHQQ") # Magic, version, files, MIME types, index offset, index size
+
+@dataclass
+class Bundle:
+    # Used to serve the files in a bundle straight from a memory map of it
+    path: str # The bundle file
+    urls: List[str] # The URL of every file
+    offsets: array # Where every file starts in the bundle
+    sizes: array # The size of every file
+    gzip_offsets: array # Where the gzipped copy of every file starts, -1 if it doesn't have one
+    gzip_sizes: array # The size of the gzipped copy of every file, -1 if it doesn't have one
+    modified: array # The modified time (whole seconds) of every file when it was bundled
+    etags: List[str] # The (strong) ETag of every file
+    last_modified: List[str] # The Last-Modified header of every file
+    mime_types: List[Tuple[str, bool]] # Every distinct (MIME type, is binary)
+    mime_indexes: array # The index in mime_types of every file's type
+    view: Union[None, memoryview] = None # The memory map of the bundle, files are slices of it
+    index: Dict[str, int] = field(default_factory=lambda:dict()) # The position of every file in the columns by it's URL
+
+    def __post_init__(self):
+        if not self.index:
+            self.index = dict(zip(self.urls, range(len(self.urls))))
+
+    def __len__(self) -> int:
+        return len(self.urls)
+
+    def content(self, index:int, gzipped:bool = False) -> memoryview:
+        """Gets the content of a file (or it's gzipped copy) as a slice of the memory map, without copying it"""
+        if gzipped:
+            return self.view[self.gzip_offsets[index]:self.gzip_offsets[index] + self.gzip_sizes[index]]
+        return self.view[self.offsets[index]:self.offsets[index] + self.sizes[index]]
+
+    @classmethod
+    def open(cls, path:str) -> Bundle:
+        """Memory maps a bundle made with build_bundle()
+
+        Raises
+        ------
+        ValueError
+            If the file isn't a bundle, is from another version, or is cut off
+        """
+        with open(path, "rb") as bundle_file:
+            try:
+                mapped = mmap.mmap(bundle_file.fileno(), 0, access=mmap.ACCESS_READ)
+            except ValueError: # Empty files can't be mapped
+                raise ValueError(f"{path} is not a bundle")
+        # The map stays open after the file is closed, and is kept until the process exits since responses being sent can hold slices of it
+        if len(mapped) < HEADER.size:
+            raise ValueError(f"{path} is not a bundle")
+        magic, version, file_count, mime_count, index_offset, index_size = HEADER.unpack_from(mapped)
+        if magic != MAGIC or version != VERSION:
+            raise ValueError(f"{path} is not a version {VERSION} bundle")
+        if index_offset + index_size != len(mapped):
+            raise ValueError(f"{path} is cut off")
+        columns_size = 8 * 5 * file_count + 2 * file_count + mime_count
+        if index_size < columns_size:
+            raise ValueError(f"{path} has a broken index")
+
+        index = mapped[index_offset:]
+        strings_end = len(index) - columns_size
+        strings = split_strings(index[:strings_end]) if strings_end else [] # No strings (an empty folder) isn't one empty string
+        if len(strings) != 3 * file_count + mime_count:
+            raise ValueError(f"{path} has a broken index")
+        columns = []
+        offset = strings_end
+        for typecode, size in (("q", 8), ("q", 8), ("q", 8), ("q", 8), ("q", 8), ("H", 2)):
+            columns.append(int_array(typecode, index[offset:offset + size * file_count]))
+            offset += size * file_count
+        offsets, sizes, gzip_offsets, gzip_sizes, modified, mime_indexes = columns
+        for starts, lengths in ((offsets, sizes), (gzip_offsets, gzip_sizes)):
+            if any(length >= 0 and (start < HEADER.size or start + length > index_offset) for start, length in zip(starts, lengths)):
+                raise ValueError(f"{path} has a file outside of it's content")
+        if any(mime_index >= mime_count for mime_index in mime_indexes):
+            raise ValueError(f"{path} has a file with an unknown MIME type")
+
+        return cls(
+            path=path,
+            urls=strings[:file_count],
+            offsets=offsets,
+            sizes=sizes,
+            gzip_offsets=gzip_offsets,
+            gzip_sizes=gzip_sizes,
+            modified=modified,
+            etags=strings[file_count:2 * file_count],
+            last_modified=strings[2 * file_count:3 * file_count],
+            mime_types=[(name, bool(is_binary)) for name, is_binary in zip(strings[3 * file_count:], index[offset:])],
+            mime_indexes=mime_indexes,
+            view=memoryview(mapped),
+        )
+
+def build_bundle(directory:str, path:str, gzip:bool = True, compress_types:Tuple[str, ...] = COMPRESSIBLE_TYPES, compress_min_size:int = 1024, level:int = 9) -> int:
+    """Packs every file in a directory (found the same way as RouteIndex.scan()) into a bundle
+
+    Notes
+    -----
+    - Files are copied in pieces, so they're never held in memory as a whole
+    - Gzipped copies are only kept when they're smaller than the file
+    - The bundle is written to a temporary file and moved into place, so a server starting up never sees it half written
+
+    Parameters
+    ----------
+    directory : str
+        The folder to bundle
+
+    path : str
+        The bundle file to write (i.e. "site.hhb")
+
+    gzip : bool, optional
+        Whether to add gzipped copies of compressible files, by default True
+
+    compress_types : Tuple[str, ...], optional
+        The MIME types to add gzipped copies of, by default COMPRESSIBLE_TYPES
+
+    compress_min_size : int, optional
+        Files smaller than this (in bytes) are not worth compressing, by default 1024
+
+    level : int, optional
+        The zlib level to compress with, since it's only done once this defaults to the smallest output, by default 9
+
+    Returns
+    -------
+    int
+        The number of files bundled
+    """
+    from .classes import MIMEType # Imported here since classes imports this module
+
+    directory = os.path.abspath(directory)
+    urls, etags, last_modified, mime_types = [], [], [], []
+    offsets, sizes, gzip_offsets, gzip_sizes, modified, mime_indexes = array("q"), array("q"), array("q"), array("q"), array("q"), array("H")
+    mime_lookup = dict()
+
+    temporary_file = tempfile.NamedTemporaryFile("wb", dir=os.path.dirname(os.path.abspath(path)), suffix=".tmp", delete=False)
+    try:
+        with temporary_file:
+            temporary_file.write(b"\0" * HEADER.size) # Filled in once the index is written
+            for url, file_path in sorted(scan_files(directory)):
+                if file_path in (temporary_file.name, os.path.abspath(path)):
+                    continue # Bundling into the folder being bundled
+                stat = os.stat(file_path)
+                digest = hashlib.blake2b(digest_size=16)
+                offsets.append(temporary_file.tell())
+                for piece in read_file_pieces(file_path, stat.st_size):
+                    digest.update(piece)
+                    temporary_file.write(piece)
+                sizes.append(temporary_file.tell() - offsets[-1])
+
+                mime = MIMEType.generate_MIME_type_from_path(file_path)
+                gzip_offset, gzip_size = -1, -1
+                if gzip and mime.type in compress_types and sizes[-1] >= compress_min_size:
+                    gzip_offset = temporary_file.tell()
+                    for piece in compress_stream(read_file_pieces(file_path, sizes[-1]), "gzip", level):
+                        temporary_file.write(piece)
+                    gzip_size = temporary_file.tell() - gzip_offset
+                    if gzip_size >= sizes[-1]: # Not worth sending, so it's written over by the next file
+                        temporary_file.seek(gzip_offset)
+                        temporary_file.truncate()
+                        gzip_offset, gzip_size = -1, -1
+                gzip_offsets.append(gzip_offset)
+                gzip_sizes.append(gzip_size)
+
+                key = (mime.type, mime.is_binary)
+                if key not in mime_lookup:
+                    mime_lookup[key] = len(mime_types)
+                    mime_types.append(key)
+                mime_indexes.append(mime_lookup[key])
+                urls.append(url)
+                etags.append(f'"{digest.hexdigest()}"')
+                modified.append(int(stat.st_mtime))
+                last_modified.append(formatdate(modified[-1], usegmt=True))
+
+            index_offset = temporary_file.tell()
+            temporary_file.write(join_strings([*urls, *etags, *last_modified, *(mime_type for mime_type, _ in mime_types)]))
+            for column in (offsets, sizes, gzip_offsets, gzip_sizes, modified, mime_indexes):
+                temporary_file.write(int_array_bytes(column))
+            temporary_file.write(bytes(1 if is_binary else 0 for _, is_binary in mime_types))
+            index_size = temporary_file.tell() - index_offset
+            temporary_file.seek(0)
+            temporary_file.write(HEADER.pack(MAGIC, VERSION, len(urls), len(mime_types), index_offset, index_size))
+        os.chmod(temporary_file.name, 0o644) # Temporary files are only readable by their owner, but the server might run as another user
+        os.replace(temporary_file.name, path)
+    except BaseException:
+        os.remove(temporary_file.name)
+        raise
+    return len(urls)
@@ -0,0 +1,315 @@
+"""This module houses the caches used by the Server to avoid repeated work on hot files
+
+Classes
+-------
+FileCache:
+    Used as the base for LRU caches of values made from files, that are dropped when the file changes
+
+ContentCache:
+    Used to keep the content of small, frequently requested files in memory
+
+PreparedResponse:
+    Used to represent a response that is already serialized to bytes, ready to send
+
+ResponseCache:
+    Used to keep PreparedResponse's for URL's so they're sent without being rebuilt
+
+ValidatorCache:
+    Used to keep the ETag and Last-Modified validators of files, so they're only computed when a file changes
+
+References
+----------
+- LRU caching: https://en.wikipedia.org/wiki/Cache_replacement_policies#Least_recently_used_(LRU)
+- os.stat() results: https://docs.python.org/3/library/os.html#os.stat_result
+- ETags and Last-Modified: https://developer.mozilla.org/en-US/docs/Web/HTTP/Conditional_requests
+
+Examples
+--------
+Caching up to 16MB of files, with no file over 1MB
+```
+from hhttpp.caching import ContentCache
+
+cache = ContentCache(max_bytes=16 * 1024 * 1024, max_entry_size=1024 * 1024)
+
+content = cache.read("index.html") # Read from disk, and stored
+content = cache.read("index.html") # Served from memory
+
+print(cache.stats()) # {'hits': 1, 'misses': 1, 'evictions': 0, 'entries': 1, 'bytes': 1097}
+```
+"""
+from __future__ import annotations
+import os
+import time
+import hashlib
+import threading
+from functools import partial
+from collections import OrderedDict
+from email.utils import formatdate
+from dataclasses import dataclass, field
+from typing import Any, Union, Dict, Tuple, Iterable, AsyncIterable
+
+def file_signature(path:str) -> Union[None, Tuple[int, int]]:
+    """Gets the (modified time in ns, size) of a file, which changes whenever the file is edited
+
+    Parameters
+    ----------
+    path : str
+        The path to the file
+
+    Returns
+    -------
+    Union[None, Tuple[int, int]]
+        The signature of the file, or None if it doesn't exist
+    """
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    return (stat.st_mtime_ns, stat.st_size)
+
+@dataclass
+class FileCache:
+    # Used as the base for LRU caches of values made from files, that are dropped when the file changes
+    max_bytes: int = 16 * 1024 * 1024 # The total size of all cached values (in bytes)
+    max_entry_size: int = 256 * 1024 # Values larger than this (in bytes) are never cached
+    check_interval: float = 1.0 # Seconds between checking a cached file on disk for changes
+    hits: int = 0 # Number of lookups served from memory
+    misses: int = 0 # Number of lookups that were not cached
+    evictions: int = 0 # Number of entries removed to make space
+    size: int = 0 # The number of bytes currently cached
+    entries: Dict[str, list] = field(default_factory=OrderedDict) # key: [value, size, source path, signature, last checked]
+
+    def __post_init__(self):
+        self.entries = OrderedDict(self.entries)
+        self._lock = threading.Lock()
+
+    def _remove(self, key:str):
+        # Removes a key from the cache, must hold self._lock
+        entry = self.entries.pop(key)
+        self.size -= entry[1]
+
+    def get(self, key:str) -> Any:
+        """Gets a cached value, if the file it was made from has not changed
+
+        Notes
+        -----
+        - Files are checked for changes (by mtime and size) at most every self.check_interval seconds
+
+        Parameters
+        ----------
+        key : str
+            The key the value was stored with
+
+        Returns
+        -------
+        Any
+            The value, or None if it's not cached (or out of date)
+        """
+        with self._lock:
+            entry = self.entries.get(key)
+            if entry is not None:
+                now = time.monotonic()
+                if now - entry[4] >= self.check_interval:
+                    if file_signature(entry[2]) != entry[3]:
+                        self._remove(key)
+                        entry = None
+                    else:
+                        entry[4] = now
+            if entry is None:
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def put(self, key:str, value:Any, size:int, source_path:str, signature:Union[None, Tuple[int, int]]) -> bool:
+        """Stores a value, evicting the least recently used values if the cache is over self.max_bytes
+
+        Parameters
+        ----------
+        key : str
+            The key to store the value under
+
+        value : Any
+            The value to store
+
+        size : int
+            The number of bytes the value takes up
+
+        source_path : str
+            The file the value was made from
+
+        signature : Union[None, Tuple[int, int]]
+            The file_signature() of source_path when the value was made
+
+        Returns
+        -------
+        bool
+            True if the value was stored, False if it was too big (or the file no longer exists)
+        """
+        if signature is None or size > self.max_entry_size or size > self.max_bytes:
+            return False
+        with self._lock:
+            if key in self.entries:
+                self._remove(key)
+            self.entries[key] = [value, size, source_path, signature, time.monotonic()]
+            self.size += size
+            while self.size > self.max_bytes:
+                self._remove(next(iter(self.entries)))
+                self.evictions += 1
+        return True
+
+    def invalidate(self, key:Union[None, str] = None):
+        """Removes a key from the cache, or everything if no key is given
+
+        Parameters
+        ----------
+        key : Union[None, str], optional
+            The key to remove, by default None
+        """
+        with self._lock:
+            if key is None:
+                self.entries.clear()
+                self.size = 0
+            elif key in self.entries:
+                self._remove(key)
+
+    def stats(self) -> Dict[str, int]:
+        """Returns the hit, miss and eviction counters, as well as the number of entries and bytes cached"""
+        with self._lock:
+            return {"hits": self.hits, "misses": self.misses, "evictions": self.evictions, "entries": len(self.entries), "bytes": self.size}
+
+@dataclass
+class ContentCache(FileCache):
+    # Used to keep the content of small, frequently requested files in memory
+
+    def read(self, path:str) -> Union[None, bytes]:
+        """Gets the content of a file, from memory if it's cached and hasn't changed on disk
+
+        Parameters
+        ----------
+        path : str
+            The path to the file
+
+        Returns
+        -------
+        Union[None, bytes]
+            The content of the file, or None if it's larger than self.max_entry_size (and so not cached)
+        """
+        content = self.get(path)
+        if content is not None:
+            return content
+
+        with open(path, "rb") as cached_file:
+            stat = os.fstat(cached_file.fileno())
+            if stat.st_size > self.max_entry_size or stat.st_size > self.max_bytes:
+                return None
+            content = cached_file.read()
+        self.put(path, content, len(content), path, (stat.st_mtime_ns, stat.st_size))
+        return content
+
+@dataclass
+class PreparedResponse:
+    # Used to represent a response that is already serialized to bytes, ready to send
+    head: bytes # The status line and headers, without a Connection header or the blank line ending the headers
+    body: bytes = b"" # The content, if it's not sent from file_path
+    file_path: Union[None, str] = None # A file to send the content from with sendfile()
+    file_size: int = 0 # The number of bytes of file_path to send
+    file_offset: int = 0 # Where in file_path to start sending from
+    chunks: Union[None, Iterable[Union[str, bytes]], AsyncIterable[Union[str, bytes]]] = None # Content that's sent piece by piece (i.e. a generator)
+    chunked: bool = False # Whether chunks are sent with Transfer-Encoding: chunked
+    must_close: bool = False # Whether the connection has to be closed after sending (to mark the end of chunks with no length)
+    validators: Union[None, Tuple[str, int]] = None # The (ETag, modified time in seconds) of the content, for answering conditional requests
+    not_modified: Union[None, PreparedResponse] = None # The 304 response to send instead when a client's copy is current
+
+    def frame(self, piece:Union[str, bytes]) -> bytes:
+        """Encodes a piece of chunks for sending, adding the chunk size and line endings if self.chunked"""
+        if isinstance(piece, str):
+            piece = piece.encode()
+        if self.chunked:
+            return b"%x\r\n%s\r\n" % (len(piece), piece)
+        return piece
+
+    def status(self) -> int:
+        """Gets the status code from the status line (i.e. 200 for "HTTP/1.1 200 Ok")"""
+        return int(self.head[9:12])
+
+    def head_bytes(self, keep_alive:Union[None, bool] = None) -> bytes:
+        """Returns the head ready to send, ending with the blank line that ends the headers
+
+        Parameters
+        ----------
+        keep_alive : Union[None, bool], optional
+            Adds a "Connection: keep-alive" header if True, "Connection: close" if False, and none if None, by default None
+        """
+        if keep_alive is None:
+            return self.head + b"\r\n"
+        if keep_alive:
+            return self.head + b"Connection: keep-alive\r\n\r\n"
+        return self.head + b"Connection: close\r\n\r\n"
+
+@dataclass
+class ResponseCache(FileCache):
+    # Used to keep PreparedResponse's for URL's so they're sent without being rebuilt
+
+    def store(self, key:str, prepared:PreparedResponse, source_path:str, signature:Union[None, Tuple[int, int]]) -> bool:
+        """Stores a PreparedResponse, see FileCache.put() for details"""
+        return self.put(key, prepared, len(prepared.head) + len(prepared.body), source_path, signature)
+
+@dataclass
+class ValidatorCache(FileCache):
+    # Used to keep the ETag and Last-Modified validators of files, so they're only computed when a file changes
+    strong: bool = False # Whether ETags are a hash of the content (strong), instead of made from the modified time and size (weak)
+    preloaded: Dict[str, Tuple[Tuple[str, str, int], Tuple[int, int]]] = field(default_factory=lambda:dict()) # path: (validators, signature) loaded from disk (i.e. a manifest), used if the file hasn't changed
+
+    def validators(self, path:str) -> Union[None, Tuple[str, str, int]]:
+        """Gets the validators of a file, computing them only if the file is new or has changed
+
+        Notes
+        -----
+        - Weak ETags (W/"size-mtime") only need a stat(), strong ETags hash the whole file once per change
+        - Preloaded validators are used the first time a file is looked up, if it's signature still matches
+
+        Parameters
+        ----------
+        path : str
+            The path to the file
+
+        Returns
+        -------
+        Union[None, Tuple[str, str, int]]
+            The ETag, Last-Modified header value and modified time (in whole seconds), or None if the file doesn't exist
+        """
+        validators = self.get(path)
+        if validators is not None:
+            return validators
+
+        signature = file_signature(path)
+        if signature is None:
+            return None
+        preloaded = self.preloaded.pop(path, None)
+        if preloaded is not None and preloaded[1] == signature:
+            validators = preloaded[0]
+            self.put(path, validators, len(validators[0]) + 64, path, signature)
+            return validators
+        modified_ns, size = signature
+        if self.strong:
+            digest = hashlib.blake2b(digest_size=16)
+            with open(path, "rb") as hashed_file:
+                for block in iter(partial(hashed_file.read, 1024 * 1024), b""):
+                    digest.update(block)
+            etag = f'"{digest.hexdigest()}"'
+        else:
+            etag = f'W/"{size:x}-{modified_ns:x}"'
+        modified = modified_ns // 1_000_000_000
+        validators = (etag, formatdate(modified, usegmt=True), modified)
+        self.put(path, validators, len(etag) + 64, path, signature)
+        return validators
+
+    def invalidate(self, key:Union[None, str] = None):
+        """Removes a key from the cache (and it's preloaded validators), or everything if no key is given"""
+        if key is None:
+            self.preloaded.clear()
+        else:
+            self.preloaded.pop(key, None)
+        super().invalidate(key)
@@ -22,6 +22,7 @@ References
 ----------
 - Status codes: https://developer.mozilla.org/en-US/docs/Web/HTTP/Status
 - HTTP 1.1 Standard: https://datatracker.ietf.org/doc/html/rfc2616
+- Range requests: https://developer.mozilla.org/en-US/docs/Web/HTTP/Range_requests
 - Python standard lib HTTP server: https://docs.python.org/3/library/http.server.html
 
 Examples
@@ -36,10 +37,32 @@ Server(port=3883).start_server()
 from __future__ import annotations
 import re
 import os
-import glob
+import gc
+import mmap
+import time
+import signal
 import socket
+import secrets
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from dataclasses import dataclass, field
-from typing import Literal, List, Union, Dict
+from functools import partial
+from email.utils import parsedate_to_datetime
+from typing import Literal, List, Union, Dict, Tuple, Iterable
+
+from .caching import ContentCache, PreparedResponse, ResponseCache, ValidatorCache, file_signature
+from .parsing import RequestParser, RequestBody, BodyError, MAX_DISCARD_SIZE
+from .routing import RouteIndex, LazyRouteIndex
+from .watching import TreeWatcher, Change
+from .manifest import Manifest
+from .bundle import Bundle
+from .logs import LogRecord, RequestLog, AccessLog
+from .metrics import ServerMetrics
+from .tracing import Span, Tracer
+from .compression import COMPRESSIBLE_TYPES, ENCODINGS, choose_encoding, compress, compress_stream, read_file_pieces, precompress_file
+
+MAX_RANGES = 16 # Range headers asking for more ranges than this are ignored, and the whole file is sent
 
 def parse_headers(input_text:str) -> Dict[str, str]:
     """Used to parse headers from HTTP request/responses
@@ -61,6 +84,77 @@ def parse_headers(input_text:str) -> Dict[str, str]:
     else:
         return dict()
 
+def parse_range(range_header:str, size:int) -> Union[None, List[Tuple[int, int]]]:
+    """Used to parse the byte ranges asked for in a Range header
+
+    Notes
+    -----
+    - Ranges that start past the end of the content are left out, and ends past the end are cut off
+    - Suffix ranges (i.e. "bytes=-500") are the last N bytes of the content
+
+    Parameters
+    ----------
+    range_header : str
+        The value of the Range header (i.e. "bytes=0-499, 1000-")
+
+    size : int
+        The size of the content the ranges are in
+
+    Returns
+    -------
+    Union[None, List[Tuple[int, int]]]
+        The (first, last) byte of each range, an empty list if none are satisfiable, or None if the header is invalid
+    """
+    unit, _, range_specs = range_header.partition("=")
+    if unit.strip().lower() != "bytes" or not range_specs:
+        return None
+    range_specs = range_specs.split(",")
+    if len(range_specs) > MAX_RANGES:
+        return None
+    ranges = []
+    for range_spec in range_specs:
+        first, dash, last = range_spec.strip().partition("-")
+        if not dash or not (first or last) or (first and not first.isdigit()) or (last and not last.isdigit()):
+            return None
+        if not first: # Suffix range
+            if int(last) > 0 and size > 0:
+                ranges.append((max(0, size - int(last)), size - 1))
+            continue
+        if last and int(last) < int(first):
+            return None
+        if int(first) < size:
+            ranges.append((int(first), min(int(last), size - 1) if last else size - 1))
+    return ranges
+
+def mapped_file_ranges(path:str, parts:List[Tuple[bytes, int, int]], tail:bytes, piece_size:int = 256 * 1024) -> Iterable[bytes]:
+    """Yields a multipart/byteranges body, slicing each range out of a memory map of the file
+
+    Parameters
+    ----------
+    path : str
+        The file the ranges are in
+
+    parts : List[Tuple[bytes, int, int]]
+        The (part headers, offset, length) of each range
+
+    tail : bytes
+        The closing boundary, sent after the last part
+
+    piece_size : int, optional
+        The most bytes of the file yielded at once, by default 256 * 1024
+
+    Yields
+    ------
+    bytes
+        The next piece of the body
+    """
+    with open(path, "rb") as mapped_file, mmap.mmap(mapped_file.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+        for part_headers, offset, length in parts:
+            yield part_headers
+            for start in range(offset, offset + length, piece_size):
+                yield mapped[start:min(start + piece_size, offset + length)]
+    yield tail
+
 def parse_content(input_text:str) -> str:
     """Parse the content from HTTP content
 
@@ -89,6 +183,11 @@ class Request:
     method: Literal["GET","POST","PUT","DELETE"] = "GET"
     headers: dict = field(default_factory=lambda: dict())
     content:str = ""
+    version: str = "1.1" # The HTTP version the request was sent with
+    body: Union[None, RequestBody] = None # Lazily reads the content as bytes, requests from a connection leave content empty and use this
+    received: Union[None, float] = None # The time.perf_counter() when the request was read from a connection, these are logged once the response is sent
+    span: Union[None, Span] = None # Marked as each stage of serving the request finishes, when the server has a tracer
+    route: Union[None, str] = None # The file the slug was routed to by Server.cached_response(), so generate_response() doesn't look it up again
     
     def __post_init__(self):
         # Make sure hostname isn't URL
@@ -105,6 +204,83 @@ class Request:
         self.headers["host"] = self.hostname
         self.headers["accept"] = self.headers.get("accept", "*/*")
 
+    def get_header(self, name:str, default:str = "") -> str:
+        """Gets the value of a header regardless of the case it was sent in
+
+        Parameters
+        ----------
+        name : str
+            The name of the header (i.e. "Connection")
+
+        default : str, optional
+            The value to return if the header was not sent, by default ""
+
+        Returns
+        -------
+        str
+            The value of the header
+        """
+        name = name.lower()
+        for header, value in self.headers.items():
+            if header.lower() == name:
+                return value
+        return default
+
+    def keep_alive(self) -> bool:
+        """Whether the client wants the connection kept open after the response
+
+        Notes
+        -----
+        - HTTP/1.1 connections are persistent unless the client sends "Connection: close"
+        - HTTP/1.0 connections close unless the client sends "Connection: keep-alive"
+        """
+        connection = self.get_header("connection").lower()
+        if self.version == "1.0":
+            return "keep-alive" in connection
+        return "close" not in connection
+
+    def is_current(self, etag:str, modified:int) -> bool:
+        """Whether the copy the client has cached (from If-None-Match or If-Modified-Since) matches the given validators
+
+        Notes
+        -----
+        - If-None-Match takes priority over If-Modified-Since, and ETags are compared weakly (W/ is ignored)
+        - Only GET requests can be answered with 304 Not Modified, so this is always False for other methods
+
+        Parameters
+        ----------
+        etag : str
+            The current ETag of the resource
+
+        modified : int
+            The time the resource was last modified, in seconds since the epoch
+
+        Returns
+        -------
+        bool
+            True if the client's copy is current
+        """
+        if self.method != "GET":
+            return False
+        if_none_match = self.get_header("if-none-match")
+        if if_none_match:
+            if if_none_match.strip() == "*":
+                return True
+            etag = etag[2:] if etag.startswith("W/") else etag
+            for candidate in if_none_match.split(","):
+                candidate = candidate.strip()
+                if (candidate[2:] if candidate.startswith("W/") else candidate) == etag:
+                    return True
+            return False
+        if_modified_since = self.get_header("if-modified-since")
+        if if_modified_since:
+            try:
+                since = parsedate_to_datetime(if_modified_since).timestamp()
+            except (TypeError, ValueError, IndexError):
+                return False # Invalid dates are ignored
+            return modified <= since
+        return False
+
 @dataclass
 class StatusCode:
     # Used to represent a HTTP response status code
@@ -178,8 +354,12 @@ class Response:
     status:StatusCode
     type: MIMEType = field(default_factory=lambda:MIMEType("application/octet-stream"))
     headers:dict = field(default_factory=lambda: {"server":"HHTTPP"})
-    content: str = ""
+    content: Union[str, bytes, memoryview, Iterable[Union[str, bytes]]] = "" # Iterables (i.e. generators) are sent piece by piece as they're produced
     is_binary: bool = False # Whether or not response should be binary instead of string
+    content_length: Union[None, int] = None # The length of iterable content if it's known, otherwise it's sent chunked
+    file_path: Union[None, str] = None # A file to send as the content with sendfile(), instead of reading it into content
+    file_size: int = 0 # The number of bytes of file_path to send
+    file_offset: int = 0 # Where in file_path the content starts
 
     def __post_init__(self):
         
@@ -195,6 +375,69 @@ class Response:
             return True
         return False
     
+    def body_size(self) -> int:
+        """Returns the length of the encoded content without reading file_path or iterables (0 for iterables of unknown length)"""
+        if self.file_path:
+            return self.file_size
+        if isinstance(self.content, (bytes, memoryview)):
+            return len(self.content)
+        if isinstance(self.content, str):
+            return len(self.content) if self.content.isascii() else len(self.content.encode())
+        return self.content_length or 0
+
+    def is_streamed(self) -> bool:
+        """Whether the content is an iterable that's sent piece by piece, instead of str or bytes (or a memoryview of bytes)"""
+        return not isinstance(self.content, (str, bytes, memoryview))
+
+    def body_bytes(self) -> bytes:
+        """Returns the content of the response encoded for sending (reading file_path if it's set)
+
+        Notes
+        -----
+        - Iterable content is joined together, which uses up generators
+        """
+        if self.file_path:
+            with open(self.file_path, "rb") as body_file:
+                body_file.seek(self.file_offset)
+                return body_file.read(self.file_size)
+        if isinstance(self.content, (bytes, memoryview)):
+            return self.content
+        if isinstance(self.content, str):
+            return self.content.encode()
+        return b"".join(piece.encode() if isinstance(piece, str) else piece for piece in self.content)
+
+    def serialize_headers(self, content_length: Union[None, int] = None, terminate: bool = True) -> bytes:
+        """Generates the status line and headers as they are sent over the wire
+
+        Notes
+        -----
+        - Headers that only differ by case (i.e. Server and server) are only sent once
+        - Lines are terminated by CRLF, and the headers end with a blank line
+
+        Parameters
+        ----------
+        content_length : Union[None, int], optional
+            If provided a Content-Length header is added (unless one is already set), by default None
+
+        terminate : bool, optional
+            Whether to add the blank line that ends the headers, by default True
+
+        Returns
+        -------
+        bytes
+            The encoded status line and headers
+        """
+        lines = [f"HTTP/1.1 {self.status.value} {self.status.description}"]
+        sent_headers = set()
+        for header, value in self.headers.items():
+            if header.lower() in sent_headers:
+                continue
+            sent_headers.add(header.lower())
+            lines.append(f"{header}: {value}")
+        if content_length is not None and "content-length" not in sent_headers:
+            lines.append(f"Content-Length: {content_length}")
+        return ("\r\n".join(lines) + ("\r\n\r\n" if terminate else "\r\n")).encode()
+
     def __str__(self) -> str:
         # Convert headers to plaintext
         header_text = ""
@@ -206,6 +449,37 @@ class Response:
         
     
 
+def send_buffers(connection: socket.socket, buffers: List[Union[bytes, memoryview]]):
+    """Sends several buffers in order, with sendmsg() where it's available so they're sent together without being joined first
+
+    Parameters
+    ----------
+    connection : socket.socket
+        The connected socket to send on
+
+    buffers : List[Union[bytes, memoryview]]
+        The buffers to send
+    """
+    if not hasattr(connection, "sendmsg"): # i.e. on windows
+        for buffer in buffers:
+            connection.sendall(buffer)
+        return
+    buffers = [memoryview(buffer) for buffer in buffers if len(buffer)]
+    while buffers:
+        # sendmsg() can send only part of the buffers, so the rest are sent in another call
+        sent = connection.sendmsg(buffers)
+        while buffers and sent >= len(buffers[0]):
+            sent -= len(buffers.pop(0))
+        if sent:
+            buffers[0] = buffers[0][sent:]
+
+def client_address(peer) -> str:
+    """Gets the IP address from a socket's peer name (i.e. ("127.0.0.1", 51234)), or "-" if it doesn't have one"""
+    return peer[0] if isinstance(peer, tuple) else "-"
+
+_END_OF_CHUNKS = object() # Marks the end of an iterable response's content in the asyncio engine
+_CLIENT_ERRORS = (ConnectionError, socket.timeout, asyncio.TimeoutError, BodyError) # Errors caused by the client, which only end it's connection
+
 @dataclass
 class Server:
     # Used to represent an overall HTTP server
@@ -213,90 +487,165 @@ class Server:
     error_on_4xx: bool = False # Should raise a python error on 4xx status codes
     error_on_5xx: bool = True # Should raise a python error on 5xx status codes
     log_limit: int = 500 # The number of logs to maintain
-    logs: List[Union[Request, Response]] = field(default_factory=lambda:[])
+    logs: Union[None, RequestLog] = None # The most recent log_limit requests and their responses, made from log_limit if not provided
+    access_log_path: Union[None, str] = None # A file to write every request to (see logs.AccessLog)
+    access_log_format: str = "clf" # The format of the access log, "clf" (Common Log Format) or "json" (a JSON object per line)
+    access_log_max_bytes: int = 0 # Rotate the access log once it's this big (0 never rotates)
+    access_log_sample_rate: float = 1.0 # The fraction (0-1) of requests written to the access log
+    access_log: Union[None, AccessLog] = None # The access log, made from the access log settings if access_log_path is set
+    metrics_enabled: bool = False # Record metrics about requests, connections and caches (see metrics.py)
+    metrics_path: Union[None, str] = "/__metrics" # The URL the metrics are served at (in the Prometheus text format) when they're enabled, None to only read them from python
+    metrics: Union[None, ServerMetrics] = None # The metrics being recorded, made if metrics_enabled and not provided
+    tracer: Union[None, Tracer] = None # Makes a Span timing each stage of every request served, and calls it's hooks (see tracing.py), None disables tracing
     file_list: List[str] = field(default_factory=lambda:[]) # all the files in the proxy_directory
-    urls: Dict[str,str] = field(default_factory=lambda:dict()) # A mapping of files to URL's
+    urls: Union[Dict[str,str], RouteIndex, LazyRouteIndex] = field(default_factory=lambda:dict()) # A mapping of URL's to files, made into a RouteIndex (or LazyRouteIndex)
     host:str = "127.0.0.1"
     port:int = 9338
     socket: Union[None, socket.socket] = None
+    threads: int = 0 # The number of worker threads to handle connections with (0 handles them in the accept loop, one request per connection)
+    backlog: int = 128 # The number of unaccepted connections the OS will queue before refusing new ones
+    reuse_port: bool = False # Sets SO_REUSEPORT so multiple processes can listen on the same port
+    keep_alive_timeout: float = 5.0 # Seconds an idle connection is kept open waiting for it's next request
+    max_keep_alive_requests: int = 100 # The most requests served on one connection before it's closed
+    use_sendfile: bool = True # Send files straight from disk with sendfile() instead of reading them into memory (only for requests read from a connection, calling generate_response() directly always reads them into content)
+    cache_max_bytes: int = 0 # The total bytes of file content to keep in memory (0 disables the content cache)
+    cache_max_entry_size: int = 256 * 1024 # Files larger than this (in bytes) are never put in the content cache
+    max_body_size: int = 16 * 1024 * 1024 # The largest request body accepted (in bytes)
+    body_spool_threshold: int = 1024 * 1024 # Request bodies larger than this are written to a temporary file by RequestBody.spool()
+    content_cache: Union[None, ContentCache] = None # The cache of file content, made from the cache settings if not provided
+    response_cache_max_bytes: int = 0 # The total bytes of pre-serialized responses to keep (0 disables the response cache)
+    response_cache: Union[None, ResponseCache] = None # The cache of pre-serialized responses, made from the settings if not provided
+    strong_etags: bool = False # Use a hash of the content for ETags, instead of the (cheaper) weak modified time and size
+    validator_cache: Union[None, ValidatorCache] = None # The cache of each file's ETag and Last-Modified, made if not provided
+    compress_level: int = 0 # The zlib level (1-9) to compress responses with for clients that accept gzip or deflate (0 disables compression)
+    compress_min_size: int = 1024 # Files smaller than this (in bytes) are not worth compressing
+    compress_types: Tuple[str, ...] = COMPRESSIBLE_TYPES # The MIME types that are compressed
+    precompress: bool = False # Make (or use existing) .gz copies of compressible files on startup, and send them to clients that accept gzip
+    precompress_workers: int = 0 # The number of threads to make .gz copies with (0 uses one per CPU)
+    precompressed: Dict[str, Tuple[str, int, Tuple[int, int], Tuple[int, int]]] = field(default_factory=lambda:dict()) # file: (.gz path, .gz size, file signature it was made from, .gz file signature)
+    watch: bool = False # Watch the proxy_directory while serving, and update urls when files are added, removed or renamed
+    watch_interval: float = 1.0 # Seconds between checking the proxy_directory for changes
+    lazy: bool = False # Find files on disk when they're requested, instead of indexing the whole proxy_directory on startup
+    lazy_cache_size: int = 10_000 # The number of lookups (found or not) remembered in lazy mode
+    manifest: Union[None, str] = None # A file to keep a manifest of the proxy_directory in, so restarts only re-check what changed (see manifest.py)
+    bundle: Union[None, str] = None # A bundle file to serve from instead of the proxy_directory (see bundle.py)
     
     def __post_init__(self):
+        self.listening = threading.Event() # Set while the server is accepting connections
+        self._stop_requested = False # Set by stop(), and cleared once the server has stopped
+        self._loop = None # The event loop serve_async() is running in
+        self._watcher_thread = None # The thread watching the proxy_directory for changes, see start_watching()
+        self._stop_watching = threading.Event()
+        self._routes_lock = threading.Lock() # Held while changes are applied to urls
+        self._watcher = None # The TreeWatcher that's caught up with urls, made by load_manifest() or the watcher thread
+        self._mime_types = dict() # The (MIME type, is binary) of files loaded from the manifest by path
+        self._manifest_stale = False # Set when urls changes, so the manifest is written again
+        self._bundle = None # The memory mapped bundle, if serving from one
+
+        if self.logs is None:
+            self.logs = RequestLog(self.log_limit)
+        if self.access_log is None and self.access_log_path:
+            self.access_log = AccessLog(self.access_log_path, self.access_log_format, self.access_log_max_bytes, sample_rate=self.access_log_sample_rate)
+        if self.metrics is None and self.metrics_enabled:
+            self.metrics = ServerMetrics()
+        if self.metrics is not None:
+            self._add_cache_metrics()
+        self._metrics_slug = self.metrics_path if self.metrics is not None else None # Compared to every slug, so it's None when there's nothing to serve
+        if self.content_cache is None and self.cache_max_bytes > 0:
+            self.content_cache = ContentCache(self.cache_max_bytes, self.cache_max_entry_size)
+        self._bad_request = self.prepare_response(None, Response(StatusCode(400, "Bad Request"))) # Sent for malformed requests
+        self._payload_too_large = self.prepare_response(None, Response(StatusCode(413, "Payload Too Large"))) # Sent for bodies over max_body_size
+        self._not_found = self.prepare_response(None, Response(StatusCode(404, "Not Found"))) # Sent for GET's of URL's that don't exist
+        self._server_error = self.prepare_response(None, Response(StatusCode(500, "Internal Server Error"))) # Sent when generating (or sending) a response fails
+        # Misses can skip generate_response() unless it raises on 4xx's, or a subclass changed how responses are made
+        self._fast_not_found = not self.error_on_4xx and type(self).generate_response is Server.generate_response and type(self)._respond is Server._respond
+        if self.response_cache is None and self.response_cache_max_bytes > 0:
+            self.response_cache = ResponseCache(self.response_cache_max_bytes, self.cache_max_entry_size)
+        if self.validator_cache is None:
+            self.validator_cache = ValidatorCache(strong=self.strong_etags)
+
         proxy_dir = os.path.abspath(self.proxy_directory)
 
-        if not self.file_list:
-            self.file_list = [
-                f"{os.path.join(proxy_dir, file)}" 
-                for file in glob.iglob(os.path.join(proxy_dir, '**',"*.*"), recursive=True)
-            ]
-        
-        # Create URL list from file_list
-        urls = dict()
-        for file in self.file_list:
-            base_url = file.replace(proxy_dir, "")
-            file = os.path.relpath(file)
-            
-            # Set homepage
-            if "index.html" in file:
-                urls["/"] = file
-                urls["/index.html"] = file
-                continue
-            
-            # Add alias if HTML file
-            if file.endswith(".html"):
-                url = base_url.replace("\\","/").replace(r"//","/").replace(".html","")
-                if not url.startswith("/"):
-                    url = "/" + url
-                urls[url] = file
-            
-            # Add path to file
-            url = base_url.replace("\\","/").replace(r"//","/")
-            if not url.startswith("/"):
-                url = "/" + url
-            urls[url] = file
-        # Set instance url list to generated URL list
-        self.urls = urls
+        # Create URL index from file_list (or the proxy_directory if it's not provided)
+        if isinstance(self.urls, (RouteIndex, LazyRouteIndex)):
+            pass # Already built
+        elif self.bundle:
+            # URL's point to the URL of the file in the bundle, instead of a path
+            self._bundle = Bundle.open(self.bundle)
+            self.urls = RouteIndex.from_urls(dict(zip(self._bundle.urls, self._bundle.urls)))
+        elif self.lazy:
+            self.urls = LazyRouteIndex(proxy_dir, self.lazy_cache_size)
+        elif self.urls:
+            self.urls = RouteIndex(dict(self.urls))
+        elif self.file_list:
+            self.urls = RouteIndex.from_files(proxy_dir, self.file_list)
+        elif self.manifest:
+            self._manifest_stale = not self.load_manifest()
+        else:
+            self.urls = RouteIndex.scan(proxy_dir, self.file_list)
+
+        if self.precompress and not self._bundle: # Bundles have their own gzipped copies
+            self.precompress_files()
+        if self._manifest_stale:
+            self.save_manifest()
     
-    def parse_request(self, input_text:str) -> Request:
+    def parse_request(self, input_text:Union[str, bytes]) -> Request:
         """Takes in the plaintext HTTP request and returns a Request object
 
+        Notes
+        -----
+        - input_text is treated as the whole request, anything after the headers is the content
+
         Parameters
         ----------
-        input_text : str
+        input_text : Union[str, bytes]
             The plaintext request
 
         Returns
         -------
         Request
             The class-based representation of the input_text request
+
+        Raises
+        ------
+        ValueError
+            If the request is incorrectly formatted
         """
-        # Parse first line of request
-        regex = r"([A-z]{3,6}) (\/.*) HTTP\/(\d\.\d)"
-        first_line = re.match(regex, input_text, re.MULTILINE)
-        
-        if not first_line:
-            raise ValueError(f"Incorrectly formatted HTTP request recieved:\n\t {input_text}")
-        method = first_line.group(1)
-        slug = first_line.group(2)
-        version = first_line.group(3)
-        
-        if not (first_line and slug and version):
-            raise ValueError(f"Incorrectly formatted HTTP request recieved:\n\t {input_text}")
-        
-        
-        # Parse headers
-        headers = parse_headers(input_text)
+        parser = RequestParser()
+        raw_request = input_text.encode() if isinstance(input_text, str) else input_text
+        if parser.feed(raw_request, final=True) == "error":
+            raise ValueError(f"Incorrectly formatted HTTP request recieved ({parser.error}):\n\t {input_text}")
+        return self.request_from_parser(parser, content=parser.body.decode(errors="replace").strip())
 
-        # Find content
-        content = parse_content(input_text)
-        
-        # Combine info to create request object
-        result = Request("schulichignite.com", slug, method, content = content, headers=headers)
+    def request_from_parser(self, parser:RequestParser, content:Union[None, str] = None, body:Union[None, RequestBody] = None) -> Request:
+        """Creates a Request object from a RequestParser that has parsed a complete request
 
-        if len(self.logs) >= self.log_limit:
-            print(f"Log limit {self.log_limit} or more, popping value")
-            self.logs.pop()
-        self.logs.append(result)
-        return result
+        Parameters
+        ----------
+        parser : RequestParser
+            The parser, it's state must be "complete"
+
+        content : Union[None, str], optional
+            The content of the request, by default the parser's body decoded
+
+        body : Union[None, RequestBody], optional
+            The stream to read the body from, by default one over the parser's (buffered) body
+
+        Returns
+        -------
+        Request
+            The class-based representation of the parsed request
+
+        Raises
+        ------
+        ValueError
+            If the parsed request is not valid (i.e. an unsupported method)
+        """
+        if content is None:
+            content = parser.body.decode(errors="replace") if parser.body else ""
+        if body is None:
+            body = RequestBody.from_bytes(parser.body)
+        return Request("schulichignite.com", parser.slug, parser.method, content = content, headers=parser.headers, version=parser.version, body=body)
         
     def generate_response(self, request: Request) -> Response:
         """Takes in a Request object and generates a correct Response object for the request
@@ -311,25 +660,91 @@ class Server:
         Response
             The object with details about the response
         """
+        started = time.perf_counter()
+        if request.slug == self._metrics_slug and request.method == "GET":
+            return self._finish_response(request, self.metrics_response(), started)
+        if self._bundle is not None:
+            return self._finish_response(request, self.bundle_response(request), started)
         headers = {"hostname": request.hostname,"server": "HHTTPP","Server": "HHTTPP"}
+        span = request.span
         
         # Pick status code & MIME Type
+        path = request.route if request.route is not None else self.urls.get(request.slug)
+        if span is not None:
+            span.mark("routed")
         try:
             if request.method in ["PUT", "POST", "DELETE"]:
                 status_code = StatusCode(403, "Forbidden")
                 mime = MIMEType("application/octet-stream")
-            elif request.slug in self.urls:
+            elif path is not None:
                 status_code = StatusCode(200, "Ok")
-                mime = MIMEType.generate_MIME_type_from_path(self.urls[request.slug])
+                known_type = self._mime_types.get(path)
+                mime = MIMEType(known_type[0], path, known_type[1]) if known_type else MIMEType.generate_MIME_type_from_path(path)
             else:
                 status_code = StatusCode(404, "Not Found")
                 mime = MIMEType("application/octet-stream")
         except:
             status_code = StatusCode(500, "Internal Server Error")
             mime = MIMEType("application/octet-stream")
+        if span is not None:
+            span.mark("mime")
+
+        # Add validators, and skip the content if the client already has the current version
+        not_modified = False
+        encoding = None
+        precompressed = None
+        if status_code.value == 200 and mime.resource_path:
+            validators = self.validator_cache.validators(mime.resource_path)
+            if validators:
+                etag, last_modified, modified = validators
+                headers["ETag"] = etag
+                headers["Last-Modified"] = last_modified
+                headers["Accept-Ranges"] = "bytes"
+                if self.compressible(mime):
+                    headers["Vary"] = "Accept-Encoding"
+                    if not request.get_header("range"): # Ranges are always of the uncompressed content
+                        precompressed = self.precompressed_variant(mime.resource_path)
+                        available = ENCODINGS if self.compress_level else ("gzip",) if precompressed else ()
+                        encoding = choose_encoding(request.get_header("accept-encoding"), available)
+                        if encoding != "gzip":
+                            precompressed = None
+                    if encoding:
+                        # Each encoding is a different representation, so it needs it's own ETag
+                        etag = headers["ETag"] = f'{etag[:-1]}-{encoding}"'
+                if request.is_current(etag, modified):
+                    status_code = StatusCode(304, "Not Modified")
+                    not_modified = True
 
         # Get content
-        if mime.resource_path:
+        if span is not None:
+            span.mark("validators")
+        read_started = time.perf_counter() if self.metrics is not None else 0.0
+        # Only requests read from a connection leave files on disk, so responses from calling generate_response() directly have their content
+        from_disk = self.use_sendfile and request.received is not None
+        file_path, file_size = None, 0
+        cached_content = None
+        if mime.resource_path and self.content_cache and not (not_modified or precompressed):
+            # Small files come from memory, larger ones (None) are handled below
+            cached_content = self.content_cache.read(mime.resource_path)
+        if not_modified:
+            content = b"" if mime.is_binary else ""
+        elif precompressed:
+            # Send the .gz copy made on startup as it is, so there's no cost to compress it
+            headers["Content-Encoding"] = "gzip"
+            if from_disk:
+                file_path, file_size = precompressed
+                content = b""
+            else:
+                with open(precompressed[0], "rb") as gzipped_file:
+                    content = gzipped_file.read()
+        elif cached_content is not None:
+            content = cached_content
+        elif mime.resource_path and from_disk:
+            # Leave the content on disk, it's sent straight from the file by _send_prepared()
+            file_path = mime.resource_path
+            file_size = os.path.getsize(file_path)
+            content = b"" if mime.is_binary else ""
+        elif mime.resource_path:
             if mime.is_binary:
                 with open(mime.resource_path, "rb") as byte_file:
                     content = byte_file.read()
@@ -338,24 +753,975 @@ class Server:
                     content = text_file.read()
         else:
             content = ""
+        if self.metrics is not None and mime.resource_path and not not_modified:
+            self.metrics.file_read_duration.observe(time.perf_counter() - read_started)
+        if span is not None:
+            span.mark("read")
         
         # Create response object
-        result = Response(status_code,type=mime, headers=headers, content=content, is_binary=mime.is_binary)
-        
-        # Error if server is setup that way
+        result = Response(status_code,type=mime, headers=headers, content=content, is_binary=mime.is_binary, file_path=file_path, file_size=file_size)
+        if status_code.value == 200 and mime.resource_path and request.get_header("range"):
+            result = self.range_response(request, result)
+            status_code = result.status
+        elif status_code.value == 200 and encoding and not precompressed:
+            result = self.compress_response(result, encoding)
+        return self._finish_response(request, result, started)
+
+    def _finish_response(self, request: Request, result: Response, started: float) -> Response:
+        # Raises on error status codes if the server is setup that way, and logs the response (unless it's logged once it's sent)
+        status_code = result.status
         if self.error_on_4xx and (399<status_code.value<500):
             raise ValueError(f"Recieved client error status code '{status_code}: {status_code.description}' on request: {request}")
             
         if self.error_on_5xx and (499<status_code.value<600):
             raise ValueError(f"Recieved server error status code {status_code} on request: {request}")
 
-        if len(self.logs) >=self.log_limit:
-            self.logs.pop()
-        self.logs.append(result)
+        if request.received is None:
+            self.log_response(request, status_code.value, result.body_size(), started)
+        if request.span is not None:
+            request.span.mark("generated")
+        return result
+
+    def log_response(self, request: Request, status: int, bytes_sent: int, started: float, client: str = "-"):
+        """Records a finished response in self.logs, and queues it for the access log if there is one
+
+        Parameters
+        ----------
+        request : Request
+            The request that was responded to
+
+        status : int
+            The status code of the response
+
+        bytes_sent : int
+            The bytes sent for the response (or the size of it's body if it wasn't sent)
+
+        started : float
+            The time.perf_counter() the request was received (or the response was started) at
+
+        client : str, optional
+            The address of the client, by default "-" for responses that weren't sent over a connection
+        """
+        self._log(request.method, request.slug, request.version, status, bytes_sent, started, client)
+
+    def _log(self, method:str, slug:str, version:str, status:int, bytes_sent:int, started:float, client:str):
+        # Records a finished response in the logs and metrics, see log_response()
+        latency = time.perf_counter() - started
+        record = LogRecord(time.time(), method, slug, status, bytes_sent, latency, client, version)
+        self.logs.append(record)
+        if self.metrics is not None:
+            self.metrics.observe_response(method, status, bytes_sent, latency)
+        if self.access_log is not None:
+            self.access_log.log(record)
+
+    def metrics_response(self) -> Response:
+        """Generates the response with every metric in the Prometheus text format, served at self.metrics_path"""
+        headers = {"Cache-Control": "no-store"}
+        return Response(StatusCode(200, "Ok"), MIMEType("text/plain; version=0.0.4; charset=utf-8"), headers, self.metrics.render())
+
+    def _add_cache_metrics(self):
+        # Exports the counters the caches already keep, they're only read when the metrics are
+        def cache_stat(stat: str) -> Dict[Tuple[str], int]:
+            caches = (("content", self.content_cache), ("response", self.response_cache), ("validator", self.validator_cache),
+                ("routes", self.urls if isinstance(self.urls, LazyRouteIndex) else None))
+            values = dict()
+            for name, cache in caches:
+                value = cache.stats().get(stat) if cache else None
+                if value is not None:
+                    values[(name,)] = value
+            return values
+        registry = self.metrics.registry
+        registry.callback("hhttpp_cache_hits_total", "counter", "Lookups found in each cache", ("cache",), partial(cache_stat, "hits"))
+        registry.callback("hhttpp_cache_misses_total", "counter", "Lookups not found in each cache", ("cache",), partial(cache_stat, "misses"))
+        registry.callback("hhttpp_cache_evictions_total", "counter", "Entries removed from each cache to make room", ("cache",), partial(cache_stat, "evictions"))
+        registry.callback("hhttpp_cache_entries", "gauge", "Entries in each cache", ("cache",), partial(cache_stat, "entries"))
+        registry.callback("hhttpp_cache_bytes", "gauge", "Bytes kept in each cache", ("cache",), partial(cache_stat, "bytes"))
+
+    def bundle_response(self, request: Request) -> Response:
+        """Generates the response to a request from the bundle, the same way generate_response() does from files
+
+        Notes
+        -----
+        - The content is a memoryview slice of the memory mapped bundle, so it's sent without being read or copied
+        - Files with a gzipped copy in the bundle send it to clients that accept gzip (except for Range requests)
+
+        Parameters
+        ----------
+        request : Request
+            The object with details about the request
+
+        Returns
+        -------
+        Response
+            The object with details about the response
+        """
+        headers = {"hostname": request.hostname,"server": "HHTTPP","Server": "HHTTPP"}
+        url = self.urls.get(request.slug)
+        if request.method in ["PUT", "POST", "DELETE"]:
+            return Response(StatusCode(403, "Forbidden"), MIMEType("application/octet-stream"), headers)
+        if url is None:
+            return Response(StatusCode(404, "Not Found"), MIMEType("application/octet-stream"), headers)
+
+        bundle = self._bundle
+        index = bundle.index[url]
+        mime_type, is_binary = bundle.mime_types[bundle.mime_indexes[index]]
+        mime = MIMEType(mime_type, is_binary=is_binary)
+        etag = headers["ETag"] = bundle.etags[index]
+        headers["Last-Modified"] = bundle.last_modified[index]
+        headers["Accept-Ranges"] = "bytes"
+        gzipped = False
+        if bundle.gzip_sizes[index] >= 0:
+            headers["Vary"] = "Accept-Encoding"
+            if not request.get_header("range"): # Ranges are always of the uncompressed content
+                gzipped = choose_encoding(request.get_header("accept-encoding"), ("gzip",)) == "gzip"
+            if gzipped:
+                etag = headers["ETag"] = f'{etag[:-1]}-gzip"'
+                headers["Content-Encoding"] = "gzip"
+        if request.is_current(etag, bundle.modified[index]):
+            return Response(StatusCode(304, "Not Modified"), mime, headers, b"" if is_binary else "", is_binary)
+
+        result = Response(StatusCode(200, "Ok"), mime, headers, bundle.content(index, gzipped), is_binary)
+        if request.get_header("range"):
+            result = self.range_response(request, result)
         return result
     
+    def compressible(self, mime: MIMEType, ignore_enabled: bool = False) -> bool:
+        """Whether compression is enabled (unless ignore_enabled), and the resource is an allowed type that is at least compress_min_size bytes"""
+        if not ((self.compress_level or self.precompressed or ignore_enabled) and mime.type in self.compress_types and mime.resource_path):
+            return False
+        return os.path.getsize(mime.resource_path) >= self.compress_min_size
+
+    def precompress_files(self):
+        """Makes (or picks up existing) .gz copies of the compressible files in urls, see compression.precompress_file()
+
+        Notes
+        -----
+        - Files are compressed in parallel on precompress_workers threads (zlib releases the GIL while compressing)
+        - Files that can't be compressed (i.e. the folder is read only) are compressed per request if compress_level is set
+        - In lazy mode files aren't known until they're requested, so there's nothing to compress on startup
+        - Files that already have a .gz copy (i.e. from the manifest) are skipped
+        """
+        files = [path for path in set(self.urls.values()) if path not in self.precompressed and self.compressible(MIMEType.generate_MIME_type_from_path(path), True)]
+        with ThreadPoolExecutor(self.precompress_workers or None) as pool:
+            for path, variant in zip(files, pool.map(precompress_file, files)):
+                if variant:
+                    self.precompressed[path] = variant
+
+    def apply_changes(self, changes: List[Change]):
+        """Applies files being added and removed to urls and the caches
+
+        Notes
+        -----
+        - The changes are made to a copy of urls which then replaces it, so requests being handled
+          never see a partly updated table
+        - Removed files are dropped from every cache, and the response cache is cleared since new files
+          can change what a URL points to (i.e. a new index.html)
+        - New files are precompressed if precompress is set
+
+        Parameters
+        ----------
+        changes : List[Change]
+            ("added" or "removed", URL, path) for each file, see watching.TreeWatcher.poll()
+        """
+        if not changes:
+            return
+        with self._routes_lock:
+            urls = self.urls.copy()
+            for change, url, path in changes:
+                if change == "added":
+                    urls.add(url, path)
+                    if self.precompress and self.compressible(MIMEType.generate_MIME_type_from_path(path), True):
+                        variant = precompress_file(path)
+                        if variant:
+                            self.precompressed[path] = variant
+                else:
+                    urls.remove(url)
+                    self.precompressed.pop(path, None)
+                    self._mime_types.pop(path, None)
+                    for cache in (self.content_cache, self.validator_cache):
+                        if cache:
+                            cache.invalidate(path)
+            self.urls = urls
+            self._manifest_stale = True
+            if self.response_cache:
+                self.response_cache.invalidate()
+
+    def load_manifest(self) -> bool:
+        """Builds urls from the manifest file, or from the proxy_directory if there isn't a usable one
+
+        Notes
+        -----
+        - Only directories are checked on disk, and files added or removed since the manifest was
+          written are applied with apply_changes()
+        - Files that were edited are noticed by the caches the first time they're used, since their
+          validators are kept with the modified time and size they were made from
+        - .gz copies are kept with the modified time and size of both the file and the copy, so one that was
+          changed or removed while the server was stopped isn't sent
+        - A manifest for another folder, or with the other kind of ETags, isn't used
+
+        Returns
+        -------
+        bool
+            True if the manifest was used and is still current, False if it needs to be written again
+        """
+        proxy_dir = os.path.abspath(self.proxy_directory)
+        watcher = self._watcher = TreeWatcher(proxy_dir)
+        manifest = Manifest.read(self.manifest)
+        if manifest is None or manifest.directory != proxy_dir or manifest.strong_etags != self.strong_etags:
+            self.urls = RouteIndex.from_urls(watcher.snapshot())
+            self.file_list.extend(self.urls.files.values())
+            return False
+
+        # Built with zip() so there's as little python as possible per file
+        paths = manifest.paths()
+        urls = dict(zip(manifest.urls, paths))
+        signatures = list(zip(manifest.modified, manifest.sizes))
+        validators = zip(manifest.etags, manifest.last_modified, manifest.modified_seconds)
+        # Checked on disk the first time they're used, so files edited since the manifest was written get new validators
+        self.validator_cache.preloaded.update(zip(paths, zip(validators, signatures)))
+        self._mime_types.update(zip(paths, map(manifest.mime_types.__getitem__, manifest.mime_indexes)))
+        for path, precompressed_size, precompressed_modified, signature in zip(paths, manifest.precompressed_sizes, manifest.precompressed_modified, signatures):
+            if precompressed_size >= 0:
+                # Checked against both files on disk every time it's used, see precompressed_variant()
+                self.precompressed[path] = (path + ".gz", precompressed_size, signature, (precompressed_modified, precompressed_size))
+        self.urls = RouteIndex.from_urls(urls)
+
+        watcher.directories = manifest.directory_states()
+        changes = watcher.poll()
+        self.apply_changes(changes)
+        self.file_list[:] = self.urls.files.values()
+        return not changes
+
+    def save_manifest(self) -> bool:
+        """Writes the manifest file with every file in urls, see manifest.py
+
+        Notes
+        -----
+        - Validators that aren't cached are computed, which hashes the file if strong_etags is set
+        - Should not be called while the watcher thread is running, it's called on startup and once it's stopped
+
+        Returns
+        -------
+        bool
+            True if it was written, False if it couldn't be (i.e. the folder is read only)
+        """
+        proxy_dir = os.path.abspath(self.proxy_directory)
+        if self._watcher is None:
+            self._watcher = TreeWatcher(proxy_dir)
+            self._watcher.snapshot()
+        manifest = Manifest(proxy_dir, self.strong_etags)
+        for state in self._watcher.directories.values():
+            manifest.add_directory(state.url, state.modified)
+        for url, path in self.urls.files.items():
+            if manifest.path(url) != path:
+                continue # Files from file_list or urls aren't found by their URL
+            # The signature is taken first, so if the file changes before the validators are made they're checked again on load
+            signature = file_signature(path)
+            validators = self.validator_cache.validators(path)
+            if signature is None or validators is None:
+                continue
+            known_type = self._mime_types.get(path)
+            if known_type is None:
+                mime = MIMEType.generate_MIME_type_from_path(path)
+                known_type = (mime.type, mime.is_binary)
+            variant = self.precompressed.get(path)
+            current = variant and variant[2] == signature and file_signature(variant[0]) == variant[3]
+            manifest.add_file(url, signature[1], signature[0], known_type[0], known_type[1], validators, variant[3] if current else None)
+        try:
+            manifest.write(self.manifest)
+        except OSError as e:
+            print(f"Could not write manifest {self.manifest}: {e}")
+            return False
+        self._manifest_stale = False
+        return True
+
+    def start_watching(self):
+        """Starts a thread that watches the proxy_directory for files being added, removed or renamed, see apply_changes()
+
+        Notes
+        -----
+        - The whole tree is listed once when the thread starts, then only directories that change are listed again
+        - This is called by start_server() and serve_async() when self.watch is True
+        - Does nothing in lazy mode, where files are always looked up on disk, or when serving from a bundle
+        """
+        if self.lazy or self._bundle or (self._watcher_thread and self._watcher_thread.is_alive()):
+            return
+        self._stop_watching.clear()
+        self._watcher_thread = threading.Thread(target=self._watch, name="hhttpp-watcher", daemon=True)
+        self._watcher_thread.start()
+
+    def stop_watching(self):
+        """Stops the thread started by start_watching()"""
+        self._stop_watching.set()
+        if self._watcher_thread:
+            self._watcher_thread.join()
+            self._watcher_thread = None
+
+    def _watch(self):
+        # Runs in the watcher thread, applying changes until stop_watching() is called
+        watcher = self._watcher
+        if watcher is None:
+            watcher = self._watcher = TreeWatcher(os.path.abspath(self.proxy_directory))
+            files = watcher.snapshot()
+            # Catch up on anything that changed since urls was built
+            changes = [("removed", url, path) for url, path in self.urls.files.items() if url not in files]
+            changes += [("added", url, path) for url, path in files.items() if self.urls.files.get(url) != path]
+        else:
+            changes = watcher.poll() # Already caught up (i.e. by load_manifest()), so only what changed since
+        while True:
+            try:
+                self.apply_changes(changes)
+            except Exception as e:
+                print(f"Error while applying file changes: {e}")
+            if self._stop_watching.wait(self.watch_interval):
+                break
+            changes = watcher.poll()
+
+    def precompressed_variant(self, path: str) -> Union[None, Tuple[str, int]]:
+        """Gets the path and size of the .gz copy of a file, if there is one and neither the file or the copy have changed since it was made"""
+        variant = self.precompressed.get(path)
+        if variant is None or file_signature(path) != variant[2] or file_signature(variant[0]) != variant[3]:
+            return None # Sent uncompressed, or compressed as it's sent
+        return variant[0], variant[1]
+
+    def compress_response(self, resp: Response, encoding: str) -> Response:
+        """Compresses the content of a response with gzip or deflate, at the level set by compress_level
+
+        Notes
+        -----
+        - Content in memory is compressed all at once, and sent with a Content-Length
+        - Files and iterable content are compressed piece by piece as they're sent (with Transfer-Encoding: chunked),
+          so they're never held in memory as a whole
+        - Async iterables are not compressed
+
+        Parameters
+        ----------
+        resp : Response
+            The response to compress
+
+        encoding : str
+            The encoding to use, either "gzip" or "deflate"
+
+        Returns
+        -------
+        Response
+            The compressed response
+        """
+        level = self.compress_level or 6
+        if resp.file_path:
+            content = compress_stream(read_file_pieces(resp.file_path, resp.file_size), encoding, level)
+        elif hasattr(resp.content, "__aiter__"):
+            return resp
+        elif resp.is_streamed():
+            content = compress_stream(resp.content, encoding, level)
+        else:
+            content = compress(resp.body_bytes(), encoding, level)
+        headers = dict(resp.headers)
+        headers["Content-Encoding"] = encoding
+        if "vary" not in headers:
+            headers["Vary"] = "Accept-Encoding"
+        return Response(resp.status, resp.type, headers, content, True)
+
+    def range_response(self, request: Request, resp: Response) -> Response:
+        """Narrows a full response for a file down to the ranges asked for in the request's Range header
+
+        Notes
+        -----
+        - Invalid Range headers, and ones that don't match the request's If-Range, are ignored and resp is returned
+        - One range is sent as it is, more are sent as multipart/byteranges
+        - Ranges of files on disk are sent with sendfile() from an offset, or sliced from a memory map of the file
+
+        Parameters
+        ----------
+        request : Request
+            The request with the Range header
+
+        resp : Response
+            The full 200 response for the file
+
+        Returns
+        -------
+        Response
+            A 206 Partial Content response, a 416 Range Not Satisfiable, or resp if the whole file should be sent
+        """
+        if request.method != "GET":
+            return resp
+        if_range = request.get_header("if-range")
+        if if_range:
+            if if_range.startswith('"') or if_range.startswith("W/"):
+                # ETags have to match exactly, and weak ones never do
+                if if_range != resp.headers.get("ETag") or if_range.startswith("W/"):
+                    return resp
+            elif if_range != resp.headers.get("Last-Modified"):
+                return resp
+
+        body = None if resp.file_path else resp.body_bytes()
+        size = resp.file_size if resp.file_path else len(body)
+        ranges = parse_range(request.get_header("range"), size)
+        if ranges is None:
+            return resp
+        headers = dict(resp.headers)
+        if not ranges:
+            headers["Content-Range"] = f"bytes */{size}"
+            return Response(StatusCode(416, "Range Not Satisfiable"), resp.type, headers)
+
+        if len(ranges) == 1:
+            first, last = ranges[0]
+            headers["Content-Range"] = f"bytes {first}-{last}/{size}"
+            if body is None:
+                return Response(StatusCode(206, "Partial Content"), resp.type, headers, resp.content, resp.is_binary, file_path=resp.file_path, file_size=last - first + 1, file_offset=first)
+            return Response(StatusCode(206, "Partial Content"), resp.type, headers, body[first:last + 1], resp.is_binary)
+
+        boundary = secrets.token_hex(16)
+        parts = []
+        for index, (first, last) in enumerate(ranges):
+            separator = "\r\n" if index else "" # Each part after the first starts on a new line
+            part_headers = f"{separator}--{boundary}\r\nContent-Type: {resp.type}\r\nContent-Range: bytes {first}-{last}/{size}\r\n\r\n"
+            parts.append((part_headers.encode(), first, last - first + 1))
+        tail = f"\r\n--{boundary}--\r\n".encode()
+        if body is None:
+            content = mapped_file_ranges(resp.file_path, parts, tail)
+        else:
+            content = b"".join(part_headers + body[offset:offset + length] for part_headers, offset, length in parts) + tail
+        result = Response(StatusCode(206, "Partial Content"), resp.type, headers, content, True)
+        result.content_length = sum(len(part_headers) + length for part_headers, _, length in parts) + len(tail)
+        result.headers["Content-Type"] = result.headers["content-type"] = f"multipart/byteranges; boundary={boundary}"
+        return result
+
+    def cache_stats(self) -> Dict[str, int]:
+        """Returns the hits, misses, evictions, entries and bytes of the content cache (all 0 if it's disabled)"""
+        if not self.content_cache:
+            return {"hits": 0, "misses": 0, "evictions": 0, "entries": 0, "bytes": 0}
+        return self.content_cache.stats()
+
+    def prepare_response(self, request: Union[None, Request], resp: Response) -> PreparedResponse:
+        """Serializes a Response so it's ready to send, and stores it in the response cache when possible
+
+        Notes
+        -----
+        - Only successful GET responses for files are cached, and they're dropped when the file changes on disk
+        - Small bodies are kept in memory, larger ones are sent from the file with sendfile()
+        - Iterable content is sent as it's produced, with a Content-Length if resp.content_length is set,
+          otherwise with Transfer-Encoding: chunked (or by closing the connection for HTTP/1.0 clients)
+        - Cached responses with an ETag keep a 304 Not Modified response to answer conditional requests with
+
+        Parameters
+        ----------
+        request : Union[None, Request]
+            The request the response is for, or None to skip caching
+
+        resp : Response
+            The response to serialize
+
+        Returns
+        -------
+        PreparedResponse
+            The serialized response
+        """
+        if resp.file_path:
+            prepared = PreparedResponse(resp.serialize_headers(resp.file_size, terminate=False), file_path=resp.file_path, file_size=resp.file_size, file_offset=resp.file_offset)
+        elif resp.is_streamed():
+            if resp.content_length is not None:
+                prepared = PreparedResponse(resp.serialize_headers(resp.content_length, terminate=False), chunks=resp.content)
+            elif request and request.version == "1.0":
+                # HTTP/1.0 clients don't support chunked, so the end of the content is marked by closing the connection
+                prepared = PreparedResponse(resp.serialize_headers(terminate=False), chunks=resp.content, must_close=True)
+            else:
+                head = resp.serialize_headers(terminate=False) + b"Transfer-Encoding: chunked\r\n"
+                prepared = PreparedResponse(head, chunks=resp.content, chunked=True)
+            return prepared # Iterables can only be sent once, so they're never cached
+        elif resp.status.value == 304:
+            # 304's never have a body, and a Content-Length would be taken as the length of the full response
+            prepared = PreparedResponse(resp.serialize_headers(terminate=False))
+        else:
+            body = resp.body_bytes()
+            prepared = PreparedResponse(resp.serialize_headers(len(body), terminate=False), body)
+
+        source_path = resp.type.resource_path
+        if self.response_cache and request and request.method == "GET" and resp.status.value == 200 and source_path:
+            signature = file_signature(source_path)
+            if prepared.file_path and signature and prepared.file_size <= self.cache_max_entry_size:
+                # Small enough to keep the body in memory
+                with open(prepared.file_path, "rb") as body_file:
+                    prepared = PreparedResponse(prepared.head, body_file.read(prepared.file_size))
+            elif prepared.file_path and prepared.file_path != source_path:
+                signature = None # Entries are only checked against source_path, so .gz copies sent from disk aren't cached
+            etag, last_modified = resp.headers.get("ETag"), resp.headers.get("Last-Modified")
+            if etag and last_modified:
+                headers = {header: value for header, value in resp.headers.items() if header.lower() != "content-encoding"}
+                not_modified = Response(StatusCode(304, "Not Modified"), resp.type, headers)
+                prepared.not_modified = PreparedResponse(not_modified.serialize_headers(terminate=False))
+                prepared.validators = (etag, int(parsedate_to_datetime(last_modified).timestamp()))
+            if signature:
+                self.response_cache.store(self._cache_key(request), prepared, source_path, signature)
+        return prepared
+
+    def _respond(self, request: Request) -> PreparedResponse:
+        # Generates and prepares the response to a request that is not in the response cache
+        prepared = self.prepare_response(request, self.generate_response(request))
+        if request.span is not None:
+            request.span.mark("serialized")
+        return prepared
+
+    def _cache_key(self, request: Request) -> str:
+        # Responses are cached per encoding, since the same URL can be sent compressed or not
+        if self.compress_level or self.precompressed:
+            encoding = choose_encoding(request.get_header("accept-encoding"))
+            if encoding:
+                return f"{request.slug} {encoding}"
+        return request.slug
+
+    def cached_response(self, request: Request) -> Union[None, PreparedResponse]:
+        """Gets the PreparedResponse for a request from the response cache, None if it's not cached
+
+        Notes
+        -----
+        - GET's for URL's that don't exist get a 404 that was prepared on startup, so floods of misses
+          (i.e. from scanners) don't build a response each time
+        - URL's that aren't in the response cache are looked up once here, and the file found is kept
+          in request.route for generate_response()
+        """
+        if request.slug == self._metrics_slug:
+            return None # Always generated, so they're current
+        if self.response_cache and request.method == "GET" and not request.get_header("range"):
+            prepared = self.response_cache.get(self._cache_key(request))
+            if prepared:
+                if prepared.not_modified and request.is_current(*prepared.validators):
+                    return prepared.not_modified
+                return prepared
+        if self._fast_not_found and request.method == "GET":
+            request.route = self.urls.get(request.slug)
+            if request.route is None:
+                return self._not_found
+        return None
+
+    def _send_prepared(self, client_connection: socket.socket, prepared: PreparedResponse, keep_alive: Union[None, bool] = None) -> int:
+        # Writes a PreparedResponse to a connected client, and returns the number of bytes sent
+        head = prepared.head_bytes(keep_alive)
+        if prepared.file_path:
+            with open(prepared.file_path, "rb") as body_file: # Opened before the head is sent, so a missing file can still get an error response
+                client_connection.sendall(head)
+                # Uses os.sendfile() where available, so the file is copied by the kernel and never enters python
+                return len(head) + client_connection.sendfile(body_file, prepared.file_offset, prepared.file_size)
+        elif prepared.chunks is not None:
+            client_connection.sendall(head)
+            sent = len(head)
+            for piece in prepared.chunks:
+                if piece: # An empty chunk would end a chunked body early
+                    framed = prepared.frame(piece)
+                    client_connection.sendall(framed)
+                    sent += len(framed)
+            if prepared.chunked:
+                client_connection.sendall(b"0\r\n\r\n")
+                sent += 5
+            return sent
+        elif isinstance(prepared.body, memoryview):
+            # Slices of a bundle are sent straight from the memory map, instead of being copied to join them to the head
+            send_buffers(client_connection, [head, prepared.body])
+        else:
+            client_connection.sendall(head + prepared.body)
+        return len(head) + len(prepared.body)
+
+    async def _write_prepared(self, writer: asyncio.StreamWriter, prepared: PreparedResponse, keep_alive: Union[None, bool] = None) -> int:
+        # Writes a PreparedResponse to a client connected to serve_async(), and returns the number of bytes sent
+        head = prepared.head_bytes(keep_alive)
+        body_file = open(prepared.file_path, "rb") if prepared.file_path else None # Opened before the head is sent, so a missing file can still get an error response
+        writer.write(head)
+        sent = len(head)
+        if body_file is not None:
+            with body_file:
+                # Uses os.sendfile() where the transport supports it, and falls back to reading chunks
+                sent += await asyncio.get_running_loop().sendfile(writer.transport, body_file, prepared.file_offset, prepared.file_size)
+        elif prepared.chunks is not None:
+            if hasattr(prepared.chunks, "__aiter__"):
+                async for piece in prepared.chunks:
+                    if piece:
+                        framed = prepared.frame(piece)
+                        writer.write(framed)
+                        sent += len(framed)
+                        await writer.drain()
+            else:
+                # Regular iterables might block while producing pieces, so they're run in the executor
+                loop = asyncio.get_running_loop()
+                get_next_piece = partial(next, iter(prepared.chunks), _END_OF_CHUNKS)
+                while True:
+                    piece = await loop.run_in_executor(None, get_next_piece)
+                    if piece is _END_OF_CHUNKS:
+                        break
+                    if piece:
+                        framed = prepared.frame(piece)
+                        writer.write(framed)
+                        sent += len(framed)
+                        await writer.drain()
+            if prepared.chunked:
+                writer.write(b"0\r\n\r\n")
+                sent += 5
+        else:
+            writer.write(prepared.body)
+            sent += len(prepared.body)
+        await writer.drain() # Waits on slow readers without blocking other clients
+        return sent
+
+    def send_response(self, client_connection: socket.socket, resp: Response):
+        """Writes a Response object to a connected client
+
+        Parameters
+        ----------
+        client_connection : socket.socket
+            The socket of the client to send the response to
+
+        resp : Response
+            The response to send
+        """
+        self._send_prepared(client_connection, self.prepare_response(None, resp))
+
+    def _parsed_request(self, parser:RequestParser, source=None, async_source=None, parse_time:float = 0.0, client:str = "-") -> Union[Request, PreparedResponse]:
+        # Gets the Request (with a streamed body) from a parser that's finished, and resets it for the next request
+        # Returns the error response to send (before closing) if the request is malformed or too large
+        # parse_time is the seconds already spent in parser.feed(), for the metrics
+        parse_started = time.perf_counter()
+        try:
+            if parser.state == "error":
+                raise ValueError(parser.error)
+            if parser.content_length > self.max_body_size:
+                return self._rejected(parser, self._payload_too_large, parse_started, client)
+            body = parser.take_body(source, async_source, self.max_body_size, self.body_spool_threshold)
+            request = self.request_from_parser(parser, body=body)
+            request.received = time.perf_counter()
+            if self.metrics is not None:
+                self.metrics.request_bytes.inc((), parser.head_size() + parser.content_length)
+                self.metrics.parse_duration.observe(parse_time + request.received - parse_started)
+            return request
+        except ValueError: # Malformed, or a method or slug Request doesn't accept
+            return self._rejected(parser, self._bad_request, parse_started, client)
+        finally:
+            parser.reset()
+
+    def _rejected(self, parser:RequestParser, response:PreparedResponse, started:float, client:str) -> PreparedResponse:
+        # Logs a request that was refused before it became a Request (with as much of it as was parsed), then returns the response to send
+        # These are logged instead of printed, since anyone can send them as fast as they like
+        # The response is always sent with Connection: close, so it's size is known before it's sent
+        bytes_sent = len(response.head_bytes(False)) + len(response.body)
+        self._log(parser.method or "-", parser.slug or "-", parser.version or "1.1", response.status(), bytes_sent, started, client)
+        return response
+
+    def _failed(self, request:Request, error:Exception) -> PreparedResponse:
+        # Reports an error raised while generating or sending the response to request (a bug, a file removed after it was found,
+        # or error_on_4xx/error_on_5xx), then returns the 500 to send in it's place. The caller logs it like any other response
+        print(f"Error while responding to {request.method} {request.slug}: {error}")
+        return self._server_error
+
+    def _unsent(self, prepared:PreparedResponse, error:Exception) -> bool:
+        # Whether an error from _send_prepared() or _write_prepared() came before any of the response was sent
+        # The only one that can is opening the file, which is done before the head is sent so a 500 can go in it's place
+        return bool(prepared.file_path) and isinstance(error, OSError) and error.filename == prepared.file_path
+
+    def _should_keep_alive(self, request:Request, requests_served:int) -> bool:
+        # Whether the connection should stay open after responding to request
+        # Bodies the response didn't read have to be skipped to reach the next request, so big ones close the connection instead
+        remaining_body = request.body.remaining() if request.body else 0
+        if remaining_body is None or remaining_body > MAX_DISCARD_SIZE:
+            return False
+        return request.keep_alive() and requests_served < self.max_keep_alive_requests
+
+    def handle_connection(self, client_connection: socket.socket, accepted: Union[None, float] = None, allow_keep_alive: bool = True):
+        """Reads requests from a connected client, then generates and sends the responses
+
+        Notes
+        -----
+        - Requests are served in the order they're sent (including pipelined requests) until the client
+          asks to close, the connection is idle for self.keep_alive_timeout seconds, or 
+          self.max_keep_alive_requests have been served
+        - Without allow_keep_alive the first response is sent with Connection: close, and the connection is closed after it
+
+        Parameters
+        ----------
+        client_connection : socket.socket
+            The socket of the accepted client, it is closed once the last response is sent
+
+        accepted : Union[None, float], optional
+            The time.perf_counter() the client was accepted at, the first stage of it's first request's span, by default None
+
+        allow_keep_alive : bool, optional
+            Whether the connection can be kept open between requests, by default True
+        """
+        metrics = self.metrics
+        tracer = self.tracer
+        if metrics is not None:
+            metrics.connections.inc()
+            metrics.active_connections.inc()
+        try:
+            with client_connection:
+                client_connection.settimeout(self.keep_alive_timeout)
+                parser = RequestParser(stream_body=True)
+                requests_served = 0
+                read_more = lambda: client_connection.recv(65536)
+                try:
+                    client = client_address(client_connection.getpeername())
+                except OSError: # Already disconnected
+                    client = "-"
+                while True:
+                    # Get the client request
+                    waiting = metrics is not None and requests_served > 0 # Kept alive, and waiting for the next request
+                    if waiting:
+                        metrics.keep_alive_connections.inc()
+                    try:
+                        feed_started = time.perf_counter()
+                        state = parser.feed() # Parses any pipelined request that's already been read
+                        parse_time = time.perf_counter() - feed_started
+                        request_started = None if state == "incomplete" else feed_started # When the first of the request was read
+                        while state == "incomplete":
+                            raw_data = client_connection.recv(65536)
+                            if not raw_data:
+                                return # Client closed the connection
+                            feed_started = time.perf_counter()
+                            if request_started is None:
+                                request_started = feed_started
+                            state = parser.feed(raw_data)
+                            parse_time += time.perf_counter() - feed_started
+                    except (socket.timeout, ConnectionError):
+                        return # Connection was idle too long, or reset
+                    finally:
+                        if waiting:
+                            metrics.keep_alive_connections.dec()
+
+                    req = self._parsed_request(parser, read_more, parse_time=parse_time, client=client)
+                    if isinstance(req, PreparedResponse):
+                        self._send_prepared(client_connection, req, keep_alive=False)
+                        break
+                    requests_served += 1
+                    if tracer is not None:
+                        self._start_span(req, accepted if requests_served == 1 else None, request_started, feed_started)
+                    try:
+                        prepared = self.cached_response(req)
+                        if prepared is None:
+                            prepared = self._respond(req)
+                        elif req.span is not None:
+                            req.span.mark("cached")
+                    except _CLIENT_ERRORS: # i.e. a broken body, read while generating the response
+                        raise
+                    except Exception as e:
+                        prepared = self._failed(req, e)
+                    keep_alive = allow_keep_alive and self._should_keep_alive(req, requests_served) and not prepared.must_close and prepared is not self._server_error
+                    try:
+                        sent = self._send_prepared(client_connection, prepared, keep_alive)
+                        status = prepared.status()
+                    except _CLIENT_ERRORS:
+                        raise
+                    except Exception as e:
+                        if self._unsent(prepared, e):
+                            prepared, keep_alive = self._failed(req, e), False
+                            sent = self._send_prepared(client_connection, prepared, keep_alive)
+                        else: # Part of the response is already sent, so all that's left is to record it and close the connection
+                            self._failed(req, e)
+                            sent, keep_alive = 0, False
+                        status = 500
+                    self.log_response(req, status, sent, req.received, client)
+                    if req.span is not None:
+                        tracer.finish(req.span, status, sent)
+                    if not keep_alive:
+                        break
+
+                    # Skip any body that wasn't read, then start on the next request
+                    try:
+                        req.body.discard()
+                    except _CLIENT_ERRORS:
+                        break
+                    parser.feed(req.body.leftover())
+
+                try:
+                    client_connection.shutdown(socket.SHUT_RDWR)
+                except OSError: # The client already closed (or reset) the connection
+                    pass
+        finally:
+            if metrics is not None:
+                metrics.active_connections.dec()
+
+    def _start_span(self, request: Request, accepted: Union[None, float], started: float, received: float):
+        # Makes the span for a request read from a connection, with the stages it's already been through
+        marks = [("accepted", accepted)] if accepted is not None else []
+        marks += [("started", started), ("received", received), ("parsed", request.received)]
+        request.span = self.tracer.start(request.method, request.slug, marks)
+
+    def _handle_accepted_connection(self, client_connection: socket.socket, accepted: Union[None, float] = None, allow_keep_alive: bool = True):
+        # Runs handle_connection() for start_server() (in a worker thread or the accept loop), errors only end the current connection
+        try:
+            self.handle_connection(client_connection, accepted, allow_keep_alive)
+        except _CLIENT_ERRORS as e: # Clients resetting connections or sending broken bodies, only counted since anyone can cause them
+            if self.metrics is not None:
+                self.metrics.connection_errors.inc((type(e).__name__,))
+        except Exception as e: # Anything else is a bug, errors in generating a response are sent as a 500 by handle_connection()
+            print(f"Error while handling connection: {e}")
+
+    async def _handle_async_client(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        # Serves every request sent on one connection for serve_async()
+        loop = asyncio.get_running_loop()
+        self._async_clients.add(writer)
+        accepted = time.perf_counter() if self.tracer is not None else None
+        metrics = self.metrics
+        tracer = self.tracer
+        if metrics is not None:
+            metrics.connections.inc()
+            metrics.active_connections.inc()
+        try:
+            parser = RequestParser(stream_body=True)
+            requests_served = 0
+            client = client_address(writer.get_extra_info("peername"))
+            async def read_more() -> bytes:
+                return await asyncio.wait_for(reader.read(65536), self.keep_alive_timeout)
+            def read_more_threadsafe() -> bytes:
+                # Lets the body be read by a response being generated in the executor
+                return asyncio.run_coroutine_threadsafe(read_more(), loop).result()
+            while True:
+                # Read until a full request is parsed, giving up if the client is idle too long
+                waiting = metrics is not None and requests_served > 0 # Kept alive, and waiting for the next request
+                if waiting:
+                    metrics.keep_alive_connections.inc()
+                try:
+                    feed_started = time.perf_counter()
+                    state = parser.feed() # Parses any pipelined request that's already been read
+                    parse_time = time.perf_counter() - feed_started
+                    request_started = None if state == "incomplete" else feed_started # When the first of the request was read
+                    while state == "incomplete":
+                        try:
+                            raw_data = await asyncio.wait_for(reader.read(65536), self.keep_alive_timeout)
+                        except asyncio.TimeoutError:
+                            raw_data = b""
+                        if not raw_data:
+                            return # Client closed the connection, or it timed out
+                        feed_started = time.perf_counter()
+                        if request_started is None:
+                            request_started = feed_started
+                        state = parser.feed(raw_data)
+                        parse_time += time.perf_counter() - feed_started
+                finally:
+                    if waiting:
+                        metrics.keep_alive_connections.dec()
+
+                req = self._parsed_request(parser, read_more_threadsafe, read_more, parse_time, client)
+                if isinstance(req, PreparedResponse):
+                    await self._write_prepared(writer, req, keep_alive=False)
+                    break
+                requests_served += 1
+                if tracer is not None:
+                    self._start_span(req, accepted if requests_served == 1 else None, request_started, feed_started)
+                try:
+                    prepared = self.cached_response(req)
+                    if prepared is None:
+                        # Generating the response reads files, so it's run in a thread to keep the event loop free
+                        prepared = await loop.run_in_executor(None, self._respond, req)
+                    elif req.span is not None:
+                        req.span.mark("cached")
+                except _CLIENT_ERRORS:
+                    raise
+                except Exception as e:
+                    prepared = self._failed(req, e)
+                keep_alive = self._should_keep_alive(req, requests_served) and not prepared.must_close and prepared is not self._server_error
+                try:
+                    sent = await self._write_prepared(writer, prepared, keep_alive)
+                    status = prepared.status()
+                except _CLIENT_ERRORS:
+                    raise
+                except Exception as e:
+                    if self._unsent(prepared, e):
+                        prepared, keep_alive = self._failed(req, e), False
+                        sent = await self._write_prepared(writer, prepared, keep_alive)
+                    else: # Part of the response is already sent, so all that's left is to record it and close the connection
+                        self._failed(req, e)
+                        sent, keep_alive = 0, False
+                    status = 500
+                self.log_response(req, status, sent, req.received, client)
+                if req.span is not None:
+                    tracer.finish(req.span, status, sent)
+                if not keep_alive:
+                    break
+
+                # Skip any body that wasn't read, then start on the next request
+                await req.body.adiscard()
+                parser.feed(req.body.leftover())
+        except _CLIENT_ERRORS as e: # Only counted, since anyone can cause them
+            if metrics is not None:
+                metrics.connection_errors.inc((type(e).__name__,))
+        except Exception as e: # Anything else is a bug, errors in generating a response are sent as a 500 above
+            print(f"Error while handling connection: {e}")
+        finally:
+            self._async_clients.discard(writer)
+            writer.close()
+            if metrics is not None:
+                metrics.active_connections.dec()
+
+    async def serve_async(self):
+        """Starts an asyncio based server on the specified port, this is an alternative to start_server()
+
+        Notes
+        -----
+        - Each connection is a coroutine instead of a thread, so many idle or slow clients can be held at once
+        - Responses are generated (and files are read) in the default executor so large files don't block the event loop
+        - Connections are kept open between requests the same way as handle_connection()
+
+        Examples
+        --------
+        Serving the current directory with asyncio
+        ```
+        import asyncio
+        from hhttpp import Server
+
+        asyncio.run(Server().serve_async())
+        ```
+        """
+        print("Starting")
+        self._stop_event = asyncio.Event()
+        self._loop = asyncio.get_running_loop()
+        self._async_clients = set()
+        server = await asyncio.start_server(
+            self._handle_async_client, self.host, self.port, backlog=self.backlog, reuse_address=True,
+            reuse_port=self.reuse_port or None
+        )
+        self.port = server.sockets[0].getsockname()[1] # Get the real port in case port 0 (any free port) was used
+        print(f'Listening on port {self.port} ...')
+
+        if self.watch:
+            self.start_watching()
+        self.listening.set()
+        try:
+            if not self._stop_requested:
+                await self._stop_event.wait()
+        finally:
+            self._stop_requested = False
+            self.listening.clear()
+            if self.watch:
+                self.stop_watching()
+            if self.manifest and self._manifest_stale:
+                self.save_manifest()
+            server.close()
+            for writer in list(self._async_clients):
+                writer.close()
+            await server.wait_closed()
+            self._loop = None
+            if self.access_log:
+                self.access_log.close() # Writes any records still queued
+
+    def stop(self):
+        """Stops a running server after it's current accept() call returns
+
+        Notes
+        -----
+        - If the server has not started yet, it stops as soon as it starts
+        """
+        self._stop_requested = True
+        if self._loop: # Running with serve_async()
+            self._loop.call_soon_threadsafe(self._stop_event.set)
+
     def start_server(self):
-        """Starts a server on the specified port"""
+        """Starts a server on the specified port
+
+        Notes
+        -----
+        - If self.threads is more than 0, connections are handed to a pool of that many worker threads,
+          otherwise each connection is handled in the accept loop before the next one is accepted, and
+          closed after one response (without keep-alive) so idle clients don't stall the others
+        - When every worker is busy new connections wait in the OS backlog (self.backlog) until one is free
+        """
         print("Starting")
         with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
             ## SOL_Socket details can be found here https://www.gnu.org/software/libc/manual/html_node/Socket_002dLevel-Options.html#Socket_002dLevel-Options
@@ -363,53 +1729,164 @@ class Server:
             ## If you enable this option, you can actually have two sockets with the same Internet port number; but the system won't allow you to use the two identically-named sockets in a way that would confuse the Internet.
             ## The reason for this option is that some higher-level Internet protocols, including FTP, require you to keep reusing the same port number.
             s.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1) # Set internal socket to allow SO_REUSEADDR
+            if self.reuse_port:
+                ## SO_REUSEPORT lets several processes bind the same port, the kernel then spreads new connections between them
+                s.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
             s.bind((self.host, self.port)) # Bind the configured socket to the server (assign ip address and port number to the socket instance)
-            s.listen(1) # Listen for incoming connections
+            s.listen(self.backlog) # Listen for incoming connections
+            self.port = s.getsockname()[1] # Get the real port in case port 0 (any free port) was used
+            self.socket = s
 
             print(f'Listening on port {self.port} ...')
             
-            s.settimeout(None)            
-            while True:
+            # Timeout lets the loop notice stop() being called
+            s.settimeout(0.5)
+
+            pool = None
+            if self.threads > 0:
+                pool = ThreadPoolExecutor(max_workers=self.threads, thread_name_prefix="hhttpp")
+                # Limits connections handed to the pool to the number of workers, the rest wait in the backlog
+                free_workers = threading.BoundedSemaphore(self.threads)
+
+            if self.watch:
+                self.start_watching()
+            self.listening.set()
+            try:
+                while not self._stop_requested:
+                    try:
+                        if pool:
+                            # Wait for a free worker before accepting
+                            if not free_workers.acquire(timeout=0.5):
+                                continue
+                        # Wait for client connections
+                        try:
+                            client_connection, _ = s.accept()
+                        except socket.timeout:
+                            if pool:
+                                free_workers.release()
+                            continue
+                        accepted = time.perf_counter() if self.tracer is not None else None
+
+                        if pool:
+                            future = pool.submit(self._handle_accepted_connection, client_connection, accepted)
+                            future.add_done_callback(lambda _: free_workers.release())
+                        else:
+                            # Keeping the connection open would block the accept loop until it's idle for keep_alive_timeout
+                            self._handle_accepted_connection(client_connection, accepted, allow_keep_alive=False)
+                    except KeyboardInterrupt:
+                        break
+            finally:
+                self._stop_requested = False
+                self.listening.clear()
+                self.socket = None
+                if self.watch:
+                    self.stop_watching()
+                if self.manifest and self._manifest_stale:
+                    self.save_manifest()
+                if pool:
+                    pool.shutdown(wait=True)
+                if self.access_log:
+                    self.access_log.close() # Writes any records still queued
+
+    def _run_worker(self, engine:str):
+        # Runs inside a forked worker process from start_workers(), never returns
+        signal.signal(signal.SIGTERM, lambda signum, frame: self.stop())
+        signal.signal(signal.SIGINT, signal.SIG_IGN) # Ctrl+C is handled by the supervisor
+        exit_code = 0
+        try:
+            if engine == "asyncio":
+                asyncio.run(self.serve_async())
+            else:
+                self.start_server()
+        except BaseException as e:
+            print(f"Worker {os.getpid()} crashed: {e}")
+            exit_code = 1
+        finally:
+            os._exit(exit_code)
+
+    def start_workers(self, workers:int, engine:str = "sockets"):
+        """Forks multiple worker processes that all serve the same port, and supervises them
+
+        Notes
+        -----
+        - Each worker binds the port with SO_REUSEPORT, and the kernel spreads connections between them
+        - The urls table is built before forking, so the workers share it copy-on-write
+        - Workers that exit unexpectedly are restarted, SIGTERM and SIGINT are passed on to the workers
+        - Only works on platforms with os.fork() and SO_REUSEPORT (i.e. linux)
+
+        Parameters
+        ----------
+        workers : int
+            The number of worker processes to start
+
+        engine : str, optional
+            The engine each worker serves with, either "sockets" or "asyncio", by default "sockets"
+
+        Raises
+        ------
+        OSError
+            If the platform does not support os.fork() or SO_REUSEPORT
+        """
+        if not hasattr(os, "fork") or not hasattr(socket, "SO_REUSEPORT"):
+            raise OSError("Worker processes need os.fork() and SO_REUSEPORT, which this platform does not support")
+        if workers < 1:
+            raise ValueError(f"Need at least 1 worker, got {workers}")
+        self.reuse_port = True
+
+        # Reserve a port for every worker to share when any free port (0) is requested
+        port_reservation = None
+        if self.port == 0:
+            port_reservation = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            port_reservation.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+            port_reservation.bind((self.host, 0))
+            self.port = port_reservation.getsockname()[1]
+
+        # Stop the garbage collector from writing to objects made so far (i.e. urls), so pages stay shared between workers
+        gc.freeze()
+
+        children = set()
+        stopping = False
+
+        def spawn_worker():
+            pid = os.fork()
+            if pid == 0:
+                children.clear() # Signals the worker gets before _run_worker() sets it's handlers shouldn't reach siblings
+                self._run_worker(engine)
+            print(f"Started worker {pid}")
+            children.add(pid)
+
+        def forward_signal(signum, frame):
+            nonlocal stopping
+            stopping = True
+            for pid in children:
                 try:
-                    # Wait for client connections
-                    print("Accepting")
-                    client_connection, _ = s.accept()
-                    print("Accepted")
+                    os.kill(pid, signal.SIGTERM)
+                except ProcessLookupError:
+                    pass
 
-                    # Get the client request
-                    print("Decoding")
-                    raw_data = client_connection.recv(4096)
-                    if raw_data:
-                        print("Raw data found")
-                        request = raw_data.decode()
-                    else: 
-                        print("No raw data found")
-                        continue
-                    print("Decoded")
-                    print(request)
-                    
-                    req = self.parse_request(request)
-                    resp = self.generate_response(req)
-                    
-                    if resp.is_binary:
-                        client_connection.send(str(f"HTTP/1.1 {resp.status.value} {resp.status.description}\n").encode())
-                        header_text = ""
-                        print(f"{resp.headers=}")
-                        for header in resp.headers:
-                            header_text += f"{header}: {resp.headers[header]}\n"
-                        client_connection.send(header_text.encode())
-                        client_connection.send("\n".encode())
-                        client_connection.sendall(resp.content)
-                    else:
-                        client_connection.sendall(str(resp).encode())
-                    print("waiting to close")
-                    # client_connection.close()
-                    client_connection.shutdown(socket.SHUT_RDWR)
-                    print("Closed")
-                except socket.timeout:
-                    continue
-                except KeyboardInterrupt:
+        previous_handlers = {
+            signal.SIGTERM: signal.signal(signal.SIGTERM, forward_signal),
+            signal.SIGINT: signal.signal(signal.SIGINT, forward_signal),
+        }
+        try:
+            for _ in range(workers):
+                spawn_worker()
+            while children:
+                try:
+                    pid, status = os.wait()
+                except ChildProcessError:
                     break
+                children.discard(pid)
+                if not stopping:
+                    print(f"Worker {pid} exited unexpectedly (status {status}), restarting")
+                    time.sleep(0.1) # Avoid spinning if workers crash on startup
+                    spawn_worker()
+        finally:
+            for signum, handler in previous_handlers.items():
+                signal.signal(signum, handler)
+            if port_reservation:
+                port_reservation.close()
+            gc.unfreeze()
 
 if __name__ == "__main__": # Code inside this statement will only run if the file is explicitly called and not just imported.
     s = Server(f"tests{os.sep}example_site")
@@ -2,12 +2,17 @@
 
 # Python Standard Library dependencies
 import os                           # Used to validate paths
+import asyncio                      # Used to run the asyncio engine
+import json                         # Used to print benchmark results as JSON
 import socket                       # Used to validate ports
 from random import randint          # Provides a random integer between a range
 
 # Internal Dependencies
 from hhttpp import __version__      # Get the current hhttpp version
 from hhttpp.classes import Server   # Used to instantiate hhttpp Server's
+from hhttpp.compression import COMPRESSIBLE_TYPES # The default MIME types to compress
+from hhttpp.bundle import build_bundle # Used to pack a folder into a bundle
+from hhttpp.bench import url_mix, parse_url_mix, run_clients, bench_server # Used to benchmark servers
 
 # Third Party Dependencies
 from docopt import docopt           # Used for argument parsing
@@ -17,7 +22,9 @@ usage = """hhttpp
 Free range artisnal HTTP server
 
 Usage: 
-    hhttpp [-h] [-v] [-p PORT] [-f PROXY_FOLDER]
+    hhttpp [-h] [-v] [-p PORT] [-f PROXY_FOLDER] [-t THREADS] [-b BACKLOG] [-e ENGINE] [-w WORKERS] [-c CACHE_SIZE] [--response-cache CACHE_SIZE] [--strong-etags] [--compress LEVEL] [--compress-min-size BYTES] [--compress-types TYPES] [--precompress] [--watch] [--lazy] [--manifest FILE] [--bundle FILE] [--access-log FILE] [--access-log-format FORMAT] [--access-log-max-size MB] [--access-log-sample RATE] [--metrics]
+    hhttpp bundle build [-f PROXY_FOLDER] [--no-gzip] OUTPUT
+    hhttpp bench [-f PROXY_FOLDER] [-t THREADS] [-b BACKLOG] [-e ENGINE] [-w WORKERS] [-c CACHE_SIZE] [--response-cache CACHE_SIZE] [--strong-etags] [--compress LEVEL] [--compress-min-size BYTES] [--compress-types TYPES] [--precompress] [--lazy] [--manifest FILE] [--bundle FILE] [--access-log FILE] [--access-log-format FORMAT] [--access-log-max-size MB] [--access-log-sample RATE] [--metrics] [--target HOST:PORT] [--clients CLIENTS] [--duration SECONDS] [--requests REQUESTS] [--warmup SECONDS] [--no-keep-alive] [--accept-gzip] [--urls URLS] [--json]
 
 Options:
     -h, --help            Show this help message and exit
@@ -25,6 +32,47 @@ Options:
     -p PORT, --port PORT  The port to start the server on 
     -f PROXY_FOLDER, --folder PROXY_FOLDER 
                           Lets you specify a folder to proxy instead of cwd
+    -t THREADS, --threads THREADS
+                          The number of worker threads to serve with (default 8, 0 serves one connection at a time, without keep-alive)
+    -b BACKLOG, --backlog BACKLOG
+                          The number of pending connections to queue before refusing new ones (default 128)
+    -e ENGINE, --engine ENGINE
+                          The serving engine to use, either sockets or asyncio (default sockets)
+    -w WORKERS, --workers WORKERS
+                          The number of processes to serve with, each binds the port with SO_REUSEPORT (default 1)
+    -c CACHE_SIZE, --cache CACHE_SIZE
+                          Megabytes of small files to keep cached in memory (default 0, which disables the cache)
+    --response-cache CACHE_SIZE
+                          Megabytes of pre-serialized responses to keep in memory (default 0, which disables the cache)
+    --strong-etags        Use a hash of each file's content for ETags, instead of it's modified time and size
+    --compress LEVEL      The level (1-9) to gzip/deflate text files with for clients that accept it (default 0, which disables compression)
+    --compress-min-size BYTES
+                          Files smaller than this are sent uncompressed (default 1024)
+    --compress-types TYPES
+                          Comma separated MIME types to compress (default text/html,text/css,text/javascript,text/plain,image/svg+xml)
+    --precompress         Make .gz copies of compressible files on startup (or use existing ones), and send them to clients that accept gzip
+    --watch               Watch the folder for files being added, removed or renamed while serving
+    --lazy                Find files when they're requested instead of indexing the whole folder on startup (for very large folders)
+    --manifest FILE       Keep what's known about every file in FILE, so restarts only re-check what changed
+    --bundle FILE         Serve from a bundle made with "hhttpp bundle build" instead of a folder
+    --no-gzip             Don't add gzipped copies of compressible files to the bundle
+    --access-log FILE     Write every request to FILE from a background thread
+    --access-log-format FORMAT
+                          The access log format, either clf (Common Log Format) or json (default clf)
+    --access-log-max-size MB
+                          Megabytes the access log can reach before it's rotated (default 0, which never rotates)
+    --access-log-sample RATE
+                          The fraction (0-1) of requests to write to the access log (default 1)
+    --metrics             Record metrics about requests, connections and caches, and serve them at /__metrics
+    --target HOST:PORT    Benchmark a server that's already running, instead of starting one with the other options
+    --clients CLIENTS     The number of clients sending requests at the same time (default 16)
+    --duration SECONDS    Seconds to send requests for (default 10)
+    --requests REQUESTS   Send this many requests in total, instead of sending them for --duration
+    --warmup SECONDS      Seconds to send requests for before measuring, to fill caches (default 0)
+    --no-keep-alive       Open a new connection for every request, instead of keeping them open
+    --accept-gzip         Send Accept-Encoding: gzip, so compressed responses are benchmarked
+    --urls URLS           Comma separated URL's to request, each with an optional weight (i.e. /:5,/faq), instead of every file in the folder
+    --json                Print the benchmark results as JSON
 """
 
 def main():
@@ -32,12 +80,73 @@ def main():
     args = docopt(usage, version=__version__) # Will be used in later post to do CLI parsing
     port = 8338
     folder = "."
+    threads = 8
+    backlog = 128
+    engine = "sockets"
+    workers = 1
+    cache_size = 0
+    response_cache_size = 0
+    compress_level = 0
+    compress_min_size = 1024
+    compress_types = COMPRESSIBLE_TYPES
+    access_log_format = "clf"
+    access_log_max_bytes = 0
+    access_log_sample_rate = 1.0
     if args["--port"]:
         port = int(args["--port"])
     if args["--folder"]:
         if not os.path.exists(args["--folder"]):
             raise ValueError(f"Folder path {args['--folder']} does not exist")
         folder = args["--folder"]
+    if args["bundle"]:
+        file_count = build_bundle(folder, args["OUTPUT"], gzip=not args["--no-gzip"])
+        print(f"Bundled {file_count} files from {os.path.abspath(folder)} into {args['OUTPUT']}")
+        return
+    if args["--bundle"] and not os.path.exists(args["--bundle"]):
+        raise ValueError(f"Bundle {args['--bundle']} does not exist")
+    if args["--threads"]:
+        threads = int(args["--threads"])
+        if threads < 0:
+            raise ValueError(f"Thread count {threads} can not be negative")
+    if args["--backlog"]:
+        backlog = int(args["--backlog"])
+    if args["--engine"]:
+        engine = args["--engine"].lower()
+        if engine not in ("sockets", "asyncio"):
+            raise ValueError(f"Engine {args['--engine']} is not valid, use sockets or asyncio")
+    if args["--workers"]:
+        workers = int(args["--workers"])
+        if workers < 1:
+            raise ValueError(f"Worker count {workers} must be at least 1")
+    if args["--cache"]:
+        cache_size = int(float(args["--cache"]) * 1024 * 1024)
+    if args["--response-cache"]:
+        response_cache_size = int(float(args["--response-cache"]) * 1024 * 1024)
+    if args["--compress"]:
+        compress_level = int(args["--compress"])
+        if not 0 <= compress_level <= 9:
+            raise ValueError(f"Compression level {compress_level} must be between 0 and 9")
+    if args["--compress-min-size"]:
+        compress_min_size = int(args["--compress-min-size"])
+    if args["--compress-types"]:
+        compress_types = tuple(mime_type.strip() for mime_type in args["--compress-types"].split(",") if mime_type.strip())
+    if args["--access-log-format"]:
+        access_log_format = args["--access-log-format"].lower()
+        if access_log_format not in ("clf", "json"):
+            raise ValueError(f"Access log format {args['--access-log-format']} is not valid, use clf or json")
+    if args["--access-log-max-size"]:
+        access_log_max_bytes = int(float(args["--access-log-max-size"]) * 1024 * 1024)
+    if args["--access-log-sample"]:
+        access_log_sample_rate = float(args["--access-log-sample"])
+        if not 0 <= access_log_sample_rate <= 1:
+            raise ValueError(f"Access log sample rate {access_log_sample_rate} must be between 0 and 1")
+    settings = dict(proxy_directory=folder, threads=threads, backlog=backlog, cache_max_bytes=cache_size, response_cache_max_bytes=response_cache_size, strong_etags=args["--strong-etags"],
+        compress_level=compress_level, compress_min_size=compress_min_size, compress_types=compress_types, precompress=args["--precompress"], watch=args["--watch"], lazy=args["--lazy"], manifest=args["--manifest"], bundle=args["--bundle"],
+        access_log_path=args["--access-log"], access_log_format=access_log_format, access_log_max_bytes=access_log_max_bytes, access_log_sample_rate=access_log_sample_rate,
+        metrics_enabled=args["--metrics"])
+    if args["bench"]:
+        bench(args, settings, engine, workers)
+        return
     # Assign port
     valid_port = False
     while not valid_port:
@@ -53,4 +162,42 @@ def main():
             print(f"Valid port found: {port}")
             valid_port = True
             port_testing_socket.close()
-    Server(folder, port=port).start_server()
+    server = Server(port=port, **settings)
+    if workers > 1:
+        server.start_workers(workers, engine)
+    elif engine == "asyncio":
+        try:
+            asyncio.run(server.serve_async())
+        except KeyboardInterrupt:
+            pass
+    else:
+        server.start_server()
+
+def bench(args:dict, settings:dict, engine:str, workers:int):
+    # Runs "hhttpp bench", against --target or a server started with the other options
+    clients = int(args["--clients"]) if args["--clients"] else 16
+    if clients < 1:
+        raise ValueError(f"Client count {clients} must be at least 1")
+    duration = float(args["--duration"]) if args["--duration"] else 10.0
+    requests = int(args["--requests"]) if args["--requests"] else None
+    if requests is not None and requests < 1:
+        raise ValueError(f"Request count {requests} must be at least 1")
+    client_options = dict(clients=clients, duration=duration, requests=requests, keep_alive=not args["--no-keep-alive"], accept_gzip=args["--accept-gzip"],
+        warmup=float(args["--warmup"]) if args["--warmup"] else 0.0)
+    if args["--urls"]:
+        mix = parse_url_mix(args["--urls"])
+    else:
+        mix = url_mix(settings["proxy_directory"], settings["bundle"])
+
+    if args["--target"]:
+        host, _, port = args["--target"].split("://")[-1].rstrip("/").rpartition(":")
+        if not host or not port.isdigit():
+            raise ValueError(f"Target {args['--target']} is not valid, use HOST:PORT")
+        if not args["--json"]:
+            print(f"Benchmarking {host}:{port} with {len(mix)} URL's")
+        result = run_clients(host, int(port), mix, **client_options)
+    else:
+        if not args["--json"]:
+            print(f"Benchmarking the {engine} engine serving {os.path.abspath(settings['bundle'] or settings['proxy_directory'])} with {len(mix)} URL's")
+        result = bench_server(settings, mix, engine, workers, **client_options)
+    print(json.dumps(result.to_dict(), indent=2) if args["--json"] else result.summary())
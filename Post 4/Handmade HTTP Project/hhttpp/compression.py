@@ -0,0 +1,209 @@
+"""This module houses the helpers used to compress responses with gzip or deflate
+
+Compression is done with zlib, either all at once for content that's already in memory, or
+incrementally for files and streamed content so they're never held in memory as a whole. Files
+that don't change can also be compressed once ahead of time, into a .gz file next to them.
+
+References
+----------
+- Accept-Encoding: https://developer.mozilla.org/en-US/docs/Web/HTTP/Headers/Accept-Encoding
+- Content-Encoding: https://developer.mozilla.org/en-US/docs/Web/HTTP/Headers/Content-Encoding
+- zlib: https://docs.python.org/3/library/zlib.html
+- Precompressed files (gzip_static in nginx): https://nginx.org/en/docs/http/ngx_http_gzip_static_module.html
+
+Examples
+--------
+Compressing a file for a client that sent "Accept-Encoding: gzip, deflate;q=0.5"
+```
+from hhttpp.compression import choose_encoding, compress_stream, read_file_pieces
+
+encoding = choose_encoding("gzip, deflate;q=0.5") # "gzip"
+
+for piece in compress_stream(read_file_pieces("index.html"), encoding):
+    ...
+```
+"""
+from __future__ import annotations
+import os
+import zlib
+import tempfile
+from typing import Union, Tuple, Iterable, Iterator
+
+from .caching import file_signature
+
+ENCODINGS = ("gzip", "deflate") # The supported encodings, in order of preference
+WBITS = {"gzip": 31, "deflate": 15} # The zlib window bits that produce each encoding's format
+
+COMPRESSIBLE_TYPES = ("text/html", "text/css", "text/javascript", "text/plain", "image/svg+xml") # Default MIME types worth compressing
+
+def choose_encoding(accept_encoding:str, available:Tuple[str, ...] = ENCODINGS) -> Union[None, str]:
+    """Picks the encoding to use from an Accept-Encoding header
+
+    Notes
+    -----
+    - Encodings with a higher q-value are preferred, and ties go to the order of ENCODINGS
+    - Encodings with q=0 are never used, and "*" matches any encoding that isn't listed
+
+    Parameters
+    ----------
+    accept_encoding : str
+        The value of the Accept-Encoding header (i.e. "gzip, deflate;q=0.5")
+
+    available : Tuple[str, ...], optional
+        The encodings that can be used, by default ENCODINGS
+
+    Returns
+    -------
+    Union[None, str]
+        The encoding, or None if the content should be sent uncompressed
+    """
+    if not accept_encoding:
+        return None
+    qualities = dict()
+    for coding in accept_encoding.lower().split(","):
+        name, _, parameters = coding.partition(";")
+        quality = 1.0
+        parameter, _, value = parameters.partition("=")
+        if parameter.strip() == "q":
+            try:
+                quality = float(value)
+            except ValueError:
+                quality = 0.0
+        qualities[name.strip()] = quality
+    wildcard = qualities.get("*", 0.0)
+    best, best_quality = None, 0.0
+    for encoding in ENCODINGS:
+        if encoding not in available:
+            continue
+        quality = qualities.get(encoding, wildcard)
+        if quality > best_quality:
+            best, best_quality = encoding, quality
+    return best
+
+def compress(data:bytes, encoding:str, level:int = 6) -> bytes:
+    """Compresses content that's already in memory all at once
+
+    Parameters
+    ----------
+    data : bytes
+        The content to compress
+
+    encoding : str
+        The encoding to use, one of ENCODINGS
+
+    level : int, optional
+        The zlib compression level from 1 (fastest) to 9 (smallest), by default 6
+
+    Returns
+    -------
+    bytes
+        The compressed content
+    """
+    compressor = zlib.compressobj(level, zlib.DEFLATED, WBITS[encoding])
+    return compressor.compress(data) + compressor.flush()
+
+def compress_stream(pieces:Iterable[Union[str, bytes]], encoding:str, level:int = 6) -> Iterator[bytes]:
+    """Compresses content piece by piece, so it's never held in memory as a whole
+
+    Parameters
+    ----------
+    pieces : Iterable[Union[str, bytes]]
+        The content to compress
+
+    encoding : str
+        The encoding to use, one of ENCODINGS
+
+    level : int, optional
+        The zlib compression level from 1 (fastest) to 9 (smallest), by default 6
+
+    Yields
+    ------
+    bytes
+        The next piece of compressed content (empty pieces are skipped)
+    """
+    compressor = zlib.compressobj(level, zlib.DEFLATED, WBITS[encoding])
+    for piece in pieces:
+        compressed = compressor.compress(piece.encode() if isinstance(piece, str) else piece)
+        if compressed:
+            yield compressed
+    yield compressor.flush()
+
+def read_file_pieces(path:str, size:Union[None, int] = None, piece_size:int = 64 * 1024) -> Iterator[bytes]:
+    """Reads a file piece by piece
+
+    Parameters
+    ----------
+    path : str
+        The file to read
+
+    size : Union[None, int], optional
+        The most bytes to read, or None for the whole file, by default None
+
+    piece_size : int, optional
+        The most bytes read at once, by default 64 * 1024
+
+    Yields
+    ------
+    bytes
+        The next piece of the file
+    """
+    with open(path, "rb") as read_file:
+        remaining = size
+        while remaining is None or remaining > 0:
+            piece = read_file.read(piece_size if remaining is None else min(piece_size, remaining))
+            if not piece:
+                break
+            if remaining is not None:
+                remaining -= len(piece)
+            yield piece
+
+def precompress_file(path:str, level:int = 9) -> Union[None, Tuple[str, int, Tuple[int, int], Tuple[int, int]]]:
+    """Makes a gzipped copy of a file next to it (path + ".gz"), or uses the existing one if it's current
+
+    Notes
+    -----
+    - An existing .gz file is current if it was modified at the same time or after the file
+    - The copy is written to a temporary file and moved into place, so it's never seen half written
+
+    Parameters
+    ----------
+    path : str
+        The file to compress
+
+    level : int, optional
+        The zlib compression level, since it's only done once this defaults to the smallest output, by default 9
+
+    Returns
+    -------
+    Union[None, Tuple[str, int, Tuple[int, int], Tuple[int, int]]]
+        The path and size of the .gz file, the file_signature() of the file it was made from, and the
+        file_signature() of the .gz file (so it's not sent if it's changed), or None if it can't be made
+        (i.e. the folder is read only)
+    """
+    signature = file_signature(path)
+    if signature is None:
+        return None
+    sidecar_path = path + ".gz"
+    try:
+        sidecar_stat = os.stat(sidecar_path)
+        if sidecar_stat.st_mtime_ns >= signature[0]:
+            return sidecar_path, sidecar_stat.st_size, signature, (sidecar_stat.st_mtime_ns, sidecar_stat.st_size)
+    except OSError:
+        pass # No existing .gz file
+
+    try:
+        temporary_file = tempfile.NamedTemporaryFile("wb", dir=os.path.dirname(sidecar_path) or ".", suffix=".tmp", delete=False)
+    except OSError:
+        return None
+    try:
+        with temporary_file:
+            for piece in compress_stream(read_file_pieces(path), "gzip", level):
+                temporary_file.write(piece)
+        os.replace(temporary_file.name, sidecar_path)
+    except OSError:
+        os.remove(temporary_file.name)
+        return None
+    sidecar_signature = file_signature(sidecar_path)
+    if sidecar_signature is None:
+        return None # Removed as soon as it was made
+    return sidecar_path, sidecar_signature[1], signature, sidecar_signature
@@ -0,0 +1,298 @@
+"""This module houses the logs the Server keeps of the requests it's responded to
+
+The request log is a ring buffer with a fixed number of slots, so once it's full each new record takes
+the slot of the oldest one. Records are small tuples (when, method, slug, status, bytes and latency),
+never the requests or responses themselves, so the log's memory use doesn't grow with the size of
+the files being sent.
+
+The access log writes the same records to a file. Serving threads only put records on a bounded queue,
+and a background thread formats and writes them in batches, so a slow disk (or terminal) never slows
+down responses. When the queue is full records are dropped (and counted) instead of waiting.
+
+Classes
+-------
+LogRecord:
+    Used to represent one request and the response sent to it
+
+RequestLog:
+    Used to keep the most recent LogRecord's in a fixed size ring buffer
+
+AccessLog:
+    Used to write LogRecord's to a file from a background thread, in Common Log Format or JSON lines
+
+References
+----------
+- Ring buffers: https://en.wikipedia.org/wiki/Circular_buffer
+- Common Log Format: https://httpd.apache.org/docs/current/logs.html#common
+- JSON lines: https://jsonlines.org/
+
+Examples
+--------
+Keeping the last 3 requests
+```
+import time
+from hhttpp.logs import LogRecord, RequestLog
+
+log = RequestLog(3)
+for slug in ("/", "/faq", "/about", "/posts"):
+    log.append(LogRecord(time.time(), "GET", slug, 200, 1097, 0.0002))
+
+len(log) # 3
+[record.slug for record in log.recent(2)] # ["/about", "/posts"]
+```
+
+Writing a JSON line for a tenth of requests to access.log, starting a new file every 10MB
+```
+from hhttpp import Server
+from hhttpp.logs import AccessLog
+
+Server(access_log=AccessLog("access.log", format="json", max_bytes=10 * 1024 * 1024, sample_rate=0.1)).start_server()
+```
+"""
+from __future__ import annotations
+import os
+import json
+import time
+import queue
+import random
+import threading
+from datetime import datetime, timezone
+from typing import Union, List, Iterator, NamedTuple
+
+FORMATS = ("clf", "json") # The formats an AccessLog can write
+
+class LogRecord(NamedTuple):
+    # Used to represent one request and the response sent to it
+    timestamp: float # When the response was finished (seconds since the epoch)
+    method: str # The method of the request (i.e. "GET")
+    slug: str # The slug that was requested (i.e. "/index.html")
+    status: int # The status code of the response (i.e. 200)
+    bytes_sent: int # The bytes sent for the response (or the size of it's body when it wasn't sent over a connection)
+    latency: float # Seconds from the request being read (or the response being started) until it was finished
+    client: str = "-" # The address of the client, if it was sent over a connection
+    version: str = "1.1" # The HTTP version of the request
+
+class RequestLog:
+    # Used to keep the most recent LogRecord's in a fixed size ring buffer
+    def __init__(self, capacity:int = 500):
+        if capacity < 1:
+            raise ValueError(f"A request log needs a capacity of at least 1, got {capacity}")
+        self.capacity = capacity # The number of records kept
+        self.total = 0 # The number of records ever appended, including those that were overwritten
+        self._slots: List[Union[None, LogRecord]] = [None] * capacity
+        self._lock = threading.Lock()
+
+    def append(self, record:LogRecord):
+        """Adds a record in O(1), overwriting the oldest one once the log is full (safe to call from any thread)"""
+        with self._lock:
+            self._slots[self.total % self.capacity] = record
+            self.total += 1
+
+    def recent(self, count:Union[None, int] = None) -> List[LogRecord]:
+        """Gets the most recent records, oldest first
+
+        Parameters
+        ----------
+        count : Union[None, int], optional
+            The most records to get, by default None which gets every record in the log
+
+        Returns
+        -------
+        List[LogRecord]
+            Up to count records, ending with the newest one
+        """
+        with self._lock:
+            total, slots = self.total, list(self._slots)
+        kept = min(total, self.capacity)
+        if count is None or count > kept:
+            count = kept
+        if count <= 0:
+            return []
+        start = (total - count) % self.capacity
+        if start + count <= self.capacity:
+            return slots[start:start + count]
+        return slots[start:] + slots[:start + count - self.capacity]
+
+    def clear(self):
+        """Removes every record"""
+        with self._lock:
+            self._slots = [None] * self.capacity
+            self.total = 0
+
+    def __len__(self) -> int:
+        return min(self.total, self.capacity)
+
+    def __iter__(self) -> Iterator[LogRecord]:
+        return iter(self.recent())
+
+    def __repr__(self) -> str:
+        return f"RequestLog(capacity={self.capacity}, records={len(self)}, total={self.total})"
+
+_STOP = object() # Put on an AccessLog's queue to stop it's writer thread
+
+class AccessLog:
+    # Used to write LogRecord's to a file from a background thread, in Common Log Format or JSON lines
+    def __init__(self, path:str, format:str = "clf", max_bytes:int = 0, backup_count:int = 5, sample_rate:float = 1.0, max_pending:int = 10_000, drop_when_full:bool = True):
+        """Sets up an access log, the file is opened and the writer thread started when the first record is logged
+
+        Notes
+        -----
+        - Rotating renames the log to path.1 (and path.1 to path.2 and so on, up to backup_count), then starts a new log
+        - Every process (i.e. each of Server.start_workers()) has it's own writer, they can share a file since it's opened
+          for appending, but should leave max_bytes as 0 and have the file rotated externally (i.e. with logrotate)
+
+        Parameters
+        ----------
+        path : str
+            The file to write to, it's appended to if it already exists
+
+        format : str, optional
+            Either "clf" (Common Log Format) or "json" (a JSON object per line), by default "clf"
+
+        max_bytes : int, optional
+            Rotate the log once it's this big, by default 0 which never rotates
+
+        backup_count : int, optional
+            The number of rotated logs to keep, by default 5
+
+        sample_rate : float, optional
+            The fraction (0-1) of records to write, picked at random, by default 1.0 which writes every record
+
+        max_pending : int, optional
+            The most records waiting to be written before new ones are dropped (or wait), by default 10_000
+
+        drop_when_full : bool, optional
+            Drop records when max_pending are waiting, instead of waiting for the writer to catch up, by default True
+
+        Raises
+        ------
+        ValueError
+            If the format isn't one of FORMATS, or a limit is out of range
+        """
+        if format not in FORMATS:
+            raise ValueError(f"Access log format {format} is not valid, use one of {', '.join(FORMATS)}")
+        if not 0 <= sample_rate <= 1:
+            raise ValueError(f"Access log sample rate {sample_rate} must be between 0 and 1")
+        if max_pending < 1 or max_bytes < 0 or backup_count < 0:
+            raise ValueError("Access log limits can not be negative (and max_pending must be at least 1)")
+        self.path = path
+        self.format = format
+        self.max_bytes = max_bytes
+        self.backup_count = backup_count
+        self.sample_rate = sample_rate
+        self.drop_when_full = drop_when_full
+        self.written = 0 # The number of records written
+        self.dropped = 0 # The number of records dropped because the queue was full (or the file couldn't be written)
+        self.sampled_out = 0 # The number of records skipped by sampling
+        self._queue = queue.Queue(max_pending)
+        self._thread = None
+        self._thread_lock = threading.Lock()
+        self._file = None
+        self._time_cache = (None, "") # (second, formatted) of the last Common Log Format time
+
+    def log(self, record:LogRecord) -> bool:
+        """Queues a record to be written, returns False if it was sampled out or dropped (safe to call from any thread)"""
+        if self.sample_rate < 1 and random.random() >= self.sample_rate:
+            self.sampled_out += 1
+            return False
+        if self._thread is None:
+            self._start()
+        try:
+            self._queue.put(record, block=not self.drop_when_full)
+        except queue.Full:
+            self.dropped += 1
+            return False
+        return True
+
+    def flush(self):
+        """Waits until every queued record has been written"""
+        if self._thread is not None:
+            self._queue.join()
+
+    def close(self):
+        """Writes every queued record, then stops the writer thread and closes the file (logging again starts them again)"""
+        with self._thread_lock:
+            thread = self._thread
+            if thread is None:
+                return
+            self._queue.put(_STOP)
+            thread.join()
+            self._thread = None
+
+    def stats(self) -> dict:
+        """Gets the number of records written, dropped, sampled out and waiting to be written"""
+        return {"written": self.written, "dropped": self.dropped, "sampled_out": self.sampled_out, "pending": self._queue.qsize()}
+
+    def format_record(self, record:LogRecord) -> str:
+        """Formats a record as a line (without the newline) in self.format"""
+        if self.format == "json":
+            return json.dumps({
+                "time": datetime.fromtimestamp(record.timestamp, timezone.utc).isoformat(timespec="milliseconds"),
+                "client": record.client,
+                "method": record.method,
+                "slug": record.slug,
+                "version": record.version,
+                "status": record.status,
+                "bytes": record.bytes_sent,
+                "latency_ms": round(record.latency * 1000, 3),
+            }, ensure_ascii=False)
+        second = int(record.timestamp)
+        if self._time_cache[0] != second:
+            self._time_cache = (second, time.strftime("%d/%b/%Y:%H:%M:%S %z", time.localtime(second)))
+        slug = record.slug.replace("\\", "\\\\").replace('"', '\\"')
+        return f'{record.client} - - [{self._time_cache[1]}] "{record.method} {slug} HTTP/{record.version}" {record.status} {record.bytes_sent or "-"}'
+
+    def _start(self):
+        # Starts the writer thread, unless another thread just did
+        with self._thread_lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._write_records, name="hhttpp-access-log", daemon=True)
+                self._thread.start()
+
+    def _write_records(self):
+        # Runs in the writer thread, writing everything that's queued in one batch until it's stopped
+        try:
+            while True:
+                batch = [self._queue.get()]
+                while batch[-1] is not _STOP:
+                    try:
+                        batch.append(self._queue.get_nowait())
+                    except queue.Empty:
+                        break
+                stopping = batch[-1] is _STOP
+                records = batch[:-1] if stopping else batch
+                if records:
+                    self._write("".join(self.format_record(record) + "\n" for record in records), len(records))
+                for _ in batch:
+                    self._queue.task_done()
+                if stopping:
+                    return
+        finally:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+
+    def _write(self, text:str, count:int):
+        # Appends lines to the file, rotating it once it's over max_bytes
+        try:
+            if self._file is None:
+                self._file = open(self.path, "a", encoding="utf-8", errors="backslashreplace")
+            self._file.write(text)
+            self._file.flush()
+            self.written += count
+            if self.max_bytes and self._file.tell() >= self.max_bytes:
+                self._rotate()
+        except OSError:
+            self.dropped += count
+
+    def _rotate(self):
+        # Moves path to path.1 (shifting older logs up, and removing the oldest), and starts a new file at path
+        self._file.close()
+        self._file = None
+        if self.backup_count:
+            for number in range(self.backup_count - 1, 0, -1):
+                if os.path.exists(f"{self.path}.{number}"):
+                    os.replace(f"{self.path}.{number}", f"{self.path}.{number + 1}")
+            os.replace(self.path, f"{self.path}.1")
+        else:
+            os.remove(self.path)
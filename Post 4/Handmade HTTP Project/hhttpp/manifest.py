@@ -0,0 +1,258 @@
+"""This module houses the manifest used by the Server to restart without re-checking every file it serves
+
+The manifest keeps everything the Server works out about each file (it's URL, size, modified time,
+MIME type, validators and precompressed copy) along with the modified time of every directory, in
+a compact binary file. Loading it only has to stat() each directory to find files that were added
+or removed since it was written, and files that were edited are noticed by their modified time the
+first time they're used, so a restart on an unchanged tree doesn't walk the tree or stat every file.
+
+The file is laid out as (all integers are little endian)
+- A header: b"HHMF", the version (uint16), flags (uint16, 1 for strong ETags), then the number of
+  directories (uint32), files (uint32) and MIME types (uint16), and the size of the strings (uint64)
+- The strings, UTF-8 encoded and separated by NUL's: the directory, the URL of every directory,
+  then the URL, ETag and Last-Modified of every file, then the MIME types
+- Arrays of int64's: the modified time of every directory, then the size, modified time (ns),
+  modified time (seconds), precompressed size (-1 for none) and precompressed modified time (ns)
+  of every file
+- An array of uint16's with the index of every file's MIME type, and a byte per MIME type that's 1 if it's binary
+
+Classes
+-------
+Manifest:
+    Used to represent what the Server knows about every file in a directory, in columns so it loads quickly
+
+References
+----------
+- array: https://docs.python.org/3/library/array.html
+- struct: https://docs.python.org/3/library/struct.html
+
+Examples
+--------
+Writing a manifest of a folder, and reading it back
+```
+from hhttpp.manifest import Manifest
+
+manifest = Manifest("/srv/example_site")
+manifest.add_directory("", 1_700_000_000_000_000_000)
+manifest.add_file("/index.html", 1097, 1_700_000_000_000_000_000, "text/html", False, ('W/"449-..."', "Tue, 14 Nov 2023 22:13:20 GMT", 1_700_000_000))
+manifest.write("site.manifest")
+
+manifest = Manifest.read("site.manifest") # None if it's missing or unreadable
+manifest.path("/index.html") # "/srv/example_site/index.html"
+```
+"""
+from __future__ import annotations
+import os
+import sys
+import struct
+import tempfile
+from array import array
+from dataclasses import dataclass, field
+from typing import Union, Dict, List, Tuple, Iterable
+
+from .watching import DirectoryState
+
+MAGIC = b"HHMF"
+VERSION = 1
+HEADER = struct.Struct("<4sHHIIHQ") # Magic, version, flags, directories, files, MIME types, size of the strings
+STRONG_ETAGS = 1 # Flag for manifests with strong ETags
+
+def join_strings(strings:Iterable[str]) -> bytes:
+    """Encodes strings as UTF-8 separated by NUL's (paths that aren't valid UTF-8 are kept as they are with surrogateescape)"""
+    return b"\0".join(text.encode("utf-8", "surrogateescape") for text in strings)
+
+def split_strings(data:bytes) -> List[str]:
+    """Decodes strings encoded with join_strings()"""
+    return data.decode("utf-8", "surrogateescape").split("\0")
+
+def int_array(typecode:str, data:bytes = b"") -> array:
+    """Makes an array of integers from little endian bytes, whatever the byte order of the machine"""
+    values = array(typecode)
+    values.frombytes(data)
+    if sys.byteorder == "big":
+        values.byteswap()
+    return values
+
+def int_array_bytes(values:array) -> bytes:
+    """Encodes an array of integers as little endian bytes, whatever the byte order of the machine"""
+    if sys.byteorder == "big":
+        values = array(values.typecode, values)
+        values.byteswap()
+    return values.tobytes()
+
+@dataclass
+class Manifest:
+    # Used to represent what the Server knows about every file in a directory, in columns so it loads quickly
+    directory: str # The absolute path of the directory, every file is in it at the path made from it's URL
+    strong_etags: bool = False # Whether the ETags are a hash of the content (strong), or made from the modified time and size (weak)
+    directory_urls: List[str] = field(default_factory=lambda:list()) # The URL of every directory ("" for the directory itself)
+    directory_modified: array = field(default_factory=lambda:array("q")) # The modified time (ns) of every directory, -1 to list it again on load
+    urls: List[str] = field(default_factory=lambda:list()) # The URL of every file
+    sizes: array = field(default_factory=lambda:array("q")) # The size of every file
+    modified: array = field(default_factory=lambda:array("q")) # The modified time (ns) of every file
+    etags: List[str] = field(default_factory=lambda:list()) # The ETag of every file
+    last_modified: List[str] = field(default_factory=lambda:list()) # The Last-Modified header of every file
+    modified_seconds: array = field(default_factory=lambda:array("q")) # The modified time (whole seconds) of every file
+    precompressed_sizes: array = field(default_factory=lambda:array("q")) # The size of the .gz copy of every file, -1 if there isn't one
+    precompressed_modified: array = field(default_factory=lambda:array("q")) # The modified time (ns) of the .gz copy of every file, -1 if there isn't one
+    mime_types: List[Tuple[str, bool]] = field(default_factory=lambda:list()) # Every distinct (MIME type, is binary)
+    mime_indexes: array = field(default_factory=lambda:array("H")) # The index in mime_types of every file's type
+
+    def __post_init__(self):
+        self._mime_lookup = {mime: index for index, mime in enumerate(self.mime_types)}
+
+    def __len__(self) -> int:
+        return len(self.urls)
+
+    def path(self, url:str) -> str:
+        """Gets the path of the file (or directory) for a URL, the same path RouteIndex.scan() finds it at"""
+        return self.directory.rstrip(os.sep) + url.replace("/", os.sep) if url else self.directory
+
+    def paths(self) -> List[str]:
+        """Gets the path of every file, in the same order as urls"""
+        prefix = self.directory.rstrip(os.sep)
+        if os.sep == "/":
+            return [prefix + url for url in self.urls]
+        return [prefix + url.replace("/", os.sep) for url in self.urls]
+
+    def add_directory(self, url:str, modified:Union[None, int]):
+        """Adds a directory with it's modified time in ns (None to always list it again on load)"""
+        self.directory_urls.append(url)
+        self.directory_modified.append(-1 if modified is None else modified)
+
+    def add_file(self, url:str, size:int, modified:int, mime_type:str, is_binary:bool, validators:Tuple[str, str, int], precompressed_signature:Union[None, Tuple[int, int]] = None):
+        """Adds a file
+
+        Parameters
+        ----------
+        url : str
+            The URL of the file (i.e. "/posts/first.html")
+
+        size : int
+            The size of the file in bytes
+
+        modified : int
+            The modified time of the file in ns
+
+        mime_type : str
+            The MIME type of the file (i.e. "text/html")
+
+        is_binary : bool
+            Whether the file is sent as binary
+
+        validators : Tuple[str, str, int]
+            The ETag, Last-Modified header and modified time in seconds, see caching.ValidatorCache.validators()
+
+        precompressed_signature : Union[None, Tuple[int, int]], optional
+            The modified time in ns and size of the .gz copy of the file if it has one (see caching.file_signature()),
+            so a copy that's changed since is noticed, by default None
+        """
+        mime = (mime_type, is_binary)
+        index = self._mime_lookup.get(mime)
+        if index is None:
+            index = self._mime_lookup[mime] = len(self.mime_types)
+            self.mime_types.append(mime)
+        self.urls.append(url)
+        self.sizes.append(size)
+        self.modified.append(modified)
+        self.etags.append(validators[0])
+        self.last_modified.append(validators[1])
+        self.modified_seconds.append(validators[2])
+        self.precompressed_sizes.append(-1 if precompressed_signature is None else precompressed_signature[1])
+        self.precompressed_modified.append(-1 if precompressed_signature is None else precompressed_signature[0])
+        self.mime_indexes.append(index)
+
+    def to_bytes(self) -> bytes:
+        """Serializes the manifest, see the module docstring for the layout"""
+        strings = join_strings([self.directory, *self.directory_urls, *self.urls, *self.etags, *self.last_modified, *(mime for mime, _ in self.mime_types)])
+        header = HEADER.pack(MAGIC, VERSION, STRONG_ETAGS if self.strong_etags else 0, len(self.directory_urls), len(self.urls), len(self.mime_types), len(strings))
+        binary_flags = bytes(1 if is_binary else 0 for _, is_binary in self.mime_types)
+        columns = (self.directory_modified, self.sizes, self.modified, self.modified_seconds, self.precompressed_sizes, self.precompressed_modified, self.mime_indexes)
+        return b"".join([header, strings, *(int_array_bytes(column) for column in columns), binary_flags])
+
+    @classmethod
+    def from_bytes(cls, data:bytes) -> Manifest:
+        """Reads a manifest serialized with to_bytes()
+
+        Raises
+        ------
+        ValueError
+            If the data isn't a manifest, is from another version, or is cut off
+        """
+        if len(data) < HEADER.size:
+            raise ValueError("Manifest is too short")
+        magic, version, flags, directory_count, file_count, mime_count, strings_size = HEADER.unpack_from(data)
+        if magic != MAGIC or version != VERSION:
+            raise ValueError(f"Not a version {VERSION} manifest")
+        expected_size = HEADER.size + strings_size + 8 * (directory_count + 5 * file_count) + 2 * file_count + mime_count
+        if len(data) != expected_size:
+            raise ValueError(f"Manifest should be {expected_size} bytes, but is {len(data)}")
+
+        offset = HEADER.size + strings_size
+        strings = split_strings(data[HEADER.size:offset])
+        if len(strings) != 1 + directory_count + 3 * file_count + mime_count:
+            raise ValueError("Manifest has the wrong number of strings")
+        columns = []
+        for typecode, count in (("q", directory_count), ("q", file_count), ("q", file_count), ("q", file_count), ("q", file_count), ("q", file_count), ("H", file_count)):
+            size = count * (8 if typecode == "q" else 2)
+            columns.append(int_array(typecode, data[offset:offset + size]))
+            offset += size
+        directory_modified, sizes, modified, modified_seconds, precompressed_sizes, precompressed_modified, mime_indexes = columns
+        if any(index >= mime_count for index in mime_indexes):
+            raise ValueError("Manifest has a file with an unknown MIME type")
+
+        files_start = 1 + directory_count
+        mime_names = strings[files_start + 3 * file_count:]
+        return cls(
+            directory=strings[0],
+            strong_etags=bool(flags & STRONG_ETAGS),
+            directory_urls=strings[1:files_start],
+            directory_modified=directory_modified,
+            urls=strings[files_start:files_start + file_count],
+            sizes=sizes,
+            modified=modified,
+            etags=strings[files_start + file_count:files_start + 2 * file_count],
+            last_modified=strings[files_start + 2 * file_count:files_start + 3 * file_count],
+            modified_seconds=modified_seconds,
+            precompressed_sizes=precompressed_sizes,
+            precompressed_modified=precompressed_modified,
+            mime_types=[(name, bool(is_binary)) for name, is_binary in zip(mime_names, data[offset:])],
+            mime_indexes=mime_indexes,
+        )
+
+    def write(self, path:str):
+        """Writes the manifest to a file, through a temporary file so it's never seen half written"""
+        temporary_file = tempfile.NamedTemporaryFile("wb", dir=os.path.dirname(os.path.abspath(path)), suffix=".tmp", delete=False)
+        try:
+            with temporary_file:
+                temporary_file.write(self.to_bytes())
+            os.replace(temporary_file.name, path)
+        except OSError:
+            os.remove(temporary_file.name)
+            raise
+
+    @classmethod
+    def read(cls, path:str) -> Union[None, Manifest]:
+        """Reads a manifest from a file, or returns None if it doesn't exist or can't be read"""
+        try:
+            with open(path, "rb") as manifest_file:
+                return cls.from_bytes(manifest_file.read())
+        except (OSError, ValueError):
+            return None
+
+    def directory_states(self) -> Dict[str, DirectoryState]:
+        """Gets the state of every directory by it's path, so a TreeWatcher can pick up from when the manifest was written"""
+        states = dict()
+        by_url = dict()
+        for url, modified in zip(self.directory_urls, self.directory_modified):
+            by_url[url] = states[self.path(url)] = DirectoryState(url, None if modified < 0 else modified)
+        for url in self.directory_urls:
+            parent = by_url.get(url.rpartition("/")[0]) if url else None
+            if parent is not None:
+                parent.subdirectories.add(url.rpartition("/")[2])
+        for url in self.urls:
+            directory_url, _, name = url.rpartition("/")
+            directory = by_url.get(directory_url)
+            if directory is not None:
+                directory.files.add(name)
+        return states
@@ -0,0 +1,331 @@
+"""This module houses the metrics the Server records about the requests it serves
+
+Every metric is split into a shard per thread. A thread only ever updates it's own shard (a plain dict
+of label values to numbers), so recording takes no locks and threads never wait on each other. Reading
+a metric adds up every shard, which is only done when the metrics are exported. Once a thread has exited
+it's shard is merged into one kept for every finished thread, so threads coming and going (i.e. pools
+being restarted) doesn't grow the metrics. Metrics are exported in the Prometheus text format, or as
+dicts for use from Python.
+
+Classes
+-------
+Metric:
+    Used as the base for metrics that are recorded in a shard per thread
+
+Counter:
+    Used to count things that only go up (i.e. requests served)
+
+Gauge:
+    Used to track values that go up and down (i.e. open connections)
+
+Histogram:
+    Used to count observations (i.e. latencies) in buckets, along with their sum
+
+CallbackMetric:
+    Used to export values that are already kept elsewhere (i.e. cache hits), read when they're exported
+
+MetricsRegistry:
+    Used to keep every metric, and export them together
+
+ServerMetrics:
+    Used to record the metrics of a Server
+
+References
+----------
+- Prometheus text format: https://prometheus.io/docs/instrumenting/exposition_formats/#text-based-format
+- Metric types: https://prometheus.io/docs/concepts/metric_types/
+- threading.local: https://docs.python.org/3/library/threading.html#thread-local-data
+
+Examples
+--------
+Counting requests by method, and timing them
+```
+from hhttpp.metrics import MetricsRegistry
+
+registry = MetricsRegistry()
+requests = registry.counter("requests_total", "Requests served", ("method",))
+latency = registry.histogram("request_duration_seconds", "Time taken to serve requests")
+
+requests.inc(("GET",))
+latency.observe(0.0012)
+
+requests.values() # {("GET",): 1}
+print(registry.render()) # requests_total{method="GET"} 1 ...
+```
+"""
+from __future__ import annotations
+import threading
+from abc import ABC, abstractmethod
+from bisect import bisect_left
+from typing import Any, Union, Dict, List, Tuple, Callable
+
+DEFAULT_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0) # Upper bounds (in seconds) for latency histograms
+
+Labels = Tuple[Any, ...] # The values of a metric's labels, in the same order as it's label names
+
+def format_labels(names:Tuple[str, ...], values:Labels, extra:str = "") -> str:
+    """Formats label names and values as they're written in the Prometheus text format (i.e. {method="GET",status="200"})"""
+    pairs = []
+    for name, value in zip(names, values):
+        value = str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+        pairs.append(f'{name}="{value}"')
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+def format_value(value:Union[int, float]) -> str:
+    """Formats a number as it's written in the Prometheus text format"""
+    if isinstance(value, float):
+        if value == float("inf"):
+            return "+Inf"
+        if value == float("-inf"):
+            return "-Inf"
+        if value.is_integer() and abs(value) < 1e15:
+            return str(int(value))
+        return repr(value)
+    return str(value)
+
+class Metric(ABC):
+    # Used as the base for metrics that are recorded in a shard per thread, subclasses define how shards are merged and read
+    kind = "untyped" # The Prometheus type of the metric
+
+    def __init__(self, name:str, help:str = "", labels:Tuple[str, ...] = ()):
+        self.name = name # The name it's exported as (i.e. "hhttpp_requests_total")
+        self.help = help # A description of what it measures
+        self.labels = tuple(labels) # The names of it's labels (i.e. ("method", "status"))
+        self._local = threading.local()
+        self._shards: Dict[threading.Thread, dict] = dict() # The shard of every running thread that's recorded a value
+        self._finished: dict = dict() # The shards of threads that have exited, merged so their counts aren't lost
+        self._lock = threading.Lock() # Only held while a thread adds it's shard, or the shards are listed
+
+    def _shard(self) -> dict:
+        # Gets the calling thread's shard, making it the first time the thread records a value
+        try:
+            return self._local.shard
+        except AttributeError:
+            shard = self._local.shard = dict()
+            with self._lock:
+                self._merge_finished()
+                self._shards[threading.current_thread()] = shard
+            return shard
+
+    def _merge_finished(self):
+        # Merges the shards of threads that have exited into self._finished, called with self._lock held
+        for thread in [thread for thread in self._shards if not thread.is_alive()]:
+            self._merge(self._finished, self._shards.pop(thread))
+
+    @abstractmethod
+    def _merge(self, total:dict, shard:dict):
+        # Adds the values in shard to total, replacing values instead of changing them since total can be being copied
+        ...
+
+    def _copies(self) -> List[dict]:
+        # Copies every shard, copying a dict is atomic so it's safe while other threads record
+        with self._lock:
+            self._merge_finished()
+            shards = [dict(self._finished), *self._shards.values()]
+        return [dict(shard) for shard in shards]
+
+    @abstractmethod
+    def values(self) -> Dict[Labels, Any]:
+        """Gets the current value for each set of label values that's been recorded"""
+        ...
+
+    def render(self) -> List[str]:
+        """Gets the lines of the metric in the Prometheus text format"""
+        lines = []
+        if self.help:
+            lines.append(f"# HELP {self.name} {self.help}")
+        lines.append(f"# TYPE {self.name} {self.kind}")
+        for labels, value in sorted(self.values().items(), key=lambda item: tuple(str(value) for value in item[0])):
+            lines.append(f"{self.name}{format_labels(self.labels, labels)} {format_value(value)}")
+        return lines
+
+class Counter(Metric):
+    # Used to count things that only go up (i.e. requests served)
+    kind = "counter"
+
+    def inc(self, labels:Labels = (), amount:Union[int, float] = 1):
+        """Adds to the count for a set of label values (in the same order as self.labels)"""
+        try:
+            shard = self._local.shard
+        except AttributeError:
+            shard = self._shard()
+        shard[labels] = shard.get(labels, 0) + amount
+
+    def _merge(self, total:dict, shard:dict):
+        for labels, value in shard.items():
+            total[labels] = total.get(labels, 0) + value
+
+    def values(self) -> Dict[Labels, Union[int, float]]:
+        totals = dict()
+        for shard in self._copies():
+            for labels, value in shard.items():
+                totals[labels] = totals.get(labels, 0) + value
+        return totals
+
+class Gauge(Counter):
+    # Used to track values that go up and down (i.e. open connections)
+    kind = "gauge"
+
+    def dec(self, labels:Labels = (), amount:Union[int, float] = 1):
+        """Subtracts from the value for a set of label values, which can be done from another thread than the one that added to it"""
+        self.inc(labels, -amount)
+
+class Histogram(Metric):
+    # Used to count observations (i.e. latencies) in buckets, along with their sum
+    kind = "histogram"
+
+    def __init__(self, name:str, help:str = "", labels:Tuple[str, ...] = (), buckets:Tuple[float, ...] = DEFAULT_BUCKETS):
+        super().__init__(name, help, labels)
+        self.buckets = tuple(sorted(buckets)) # The upper bound of each bucket, values over the last one are only in +Inf
+
+    def observe(self, value:float, labels:Labels = ()):
+        """Records a value for a set of label values"""
+        try:
+            shard = self._local.shard
+        except AttributeError:
+            shard = self._shard()
+        counts = shard.get(labels)
+        if counts is None:
+            counts = shard[labels] = [0] * (len(self.buckets) + 1) + [0.0] # A count per bucket (and +Inf), then the sum
+        counts[bisect_left(self.buckets, value)] += 1
+        counts[-1] += value
+
+    def _merge(self, total:dict, shard:dict):
+        for labels, counts in shard.items():
+            merged = total.get(labels)
+            total[labels] = list(counts) if merged is None else [a + b for a, b in zip(merged, counts)]
+
+    def values(self) -> Dict[Labels, Dict[str, Any]]:
+        """Gets the cumulative count of values in each bucket (by upper bound), the count and the sum, for each set of label values"""
+        merged = dict()
+        for shard in self._copies():
+            for labels, counts in shard.items():
+                counts = list(counts) # Another thread might be adding to it
+                total = merged.get(labels)
+                merged[labels] = counts if total is None else [a + b for a, b in zip(total, counts)]
+        results = dict()
+        for labels, counts in merged.items():
+            cumulative, running = dict(), 0
+            for bound, count in zip((*self.buckets, float("inf")), counts):
+                running += count
+                cumulative[bound] = running
+            results[labels] = {"buckets": cumulative, "count": running, "sum": counts[-1]}
+        return results
+
+    def quantile(self, fraction:float, labels:Labels = ()) -> Union[None, float]:
+        """Estimates a quantile (i.e. 0.99) as the upper bound of the bucket it falls in, None if nothing was recorded"""
+        value = self.values().get(labels)
+        if not value or not value["count"]:
+            return None
+        target = fraction * value["count"]
+        for bound, count in value["buckets"].items():
+            if count >= target:
+                return bound
+        return float("inf")
+
+    def render(self) -> List[str]:
+        lines = []
+        if self.help:
+            lines.append(f"# HELP {self.name} {self.help}")
+        lines.append(f"# TYPE {self.name} {self.kind}")
+        for labels, value in sorted(self.values().items(), key=lambda item: tuple(str(value) for value in item[0])):
+            for bound, count in value["buckets"].items():
+                bucket_labels = format_labels(self.labels, labels, f'le="{format_value(float(bound))}"')
+                lines.append(f"{self.name}_bucket{bucket_labels} {count}")
+            lines.append(f"{self.name}_sum{format_labels(self.labels, labels)} {format_value(float(value['sum']))}")
+            lines.append(f"{self.name}_count{format_labels(self.labels, labels)} {value['count']}")
+        return lines
+
+class CallbackMetric(Metric):
+    # Used to export values that are already kept elsewhere (i.e. cache hits), read when they're exported
+    def __init__(self, name:str, kind:str, help:str, labels:Tuple[str, ...], function:Callable[[], Dict[Labels, Union[int, float]]]):
+        super().__init__(name, help, labels)
+        self.kind = kind # "counter" or "gauge"
+        self.function = function # Returns the current value for each set of label values
+
+    def _merge(self, total:dict, shard:dict):
+        pass # Nothing is recorded in shards, the values are always read from self.function
+
+    def values(self) -> Dict[Labels, Union[int, float]]:
+        return self.function()
+
+class MetricsRegistry:
+    # Used to keep every metric, and export them together
+    def __init__(self):
+        self.metrics: Dict[str, Metric] = dict() # Every metric by it's name, in the order they were added
+        self._lock = threading.Lock()
+
+    def add(self, metric:Metric) -> Metric:
+        """Adds a metric, or returns the one with the same name if it's already added
+
+        Raises
+        ------
+        ValueError
+            If a different kind of metric already has the name
+        """
+        with self._lock:
+            existing = self.metrics.get(metric.name)
+            if existing is None:
+                self.metrics[metric.name] = metric
+                return metric
+        if type(existing) is not type(metric):
+            raise ValueError(f"Metric {metric.name} is already a {existing.kind}")
+        return existing
+
+    def counter(self, name:str, help:str = "", labels:Tuple[str, ...] = ()) -> Counter:
+        """Adds (or gets) a Counter"""
+        return self.add(Counter(name, help, labels))
+
+    def gauge(self, name:str, help:str = "", labels:Tuple[str, ...] = ()) -> Gauge:
+        """Adds (or gets) a Gauge"""
+        return self.add(Gauge(name, help, labels))
+
+    def histogram(self, name:str, help:str = "", labels:Tuple[str, ...] = (), buckets:Tuple[float, ...] = DEFAULT_BUCKETS) -> Histogram:
+        """Adds (or gets) a Histogram"""
+        return self.add(Histogram(name, help, labels, buckets))
+
+    def callback(self, name:str, kind:str, help:str, labels:Tuple[str, ...], function:Callable[[], Dict[Labels, Union[int, float]]]) -> CallbackMetric:
+        """Adds (or gets) a CallbackMetric, function is only called when the metrics are exported"""
+        return self.add(CallbackMetric(name, kind, help, labels, function))
+
+    def snapshot(self) -> Dict[str, Dict[Labels, Any]]:
+        """Gets the values of every metric by it's name, see each metric's values()"""
+        return {name: metric.values() for name, metric in list(self.metrics.items())}
+
+    def render(self) -> str:
+        """Exports every metric in the Prometheus text format"""
+        lines = []
+        for metric in list(self.metrics.values()):
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+class ServerMetrics:
+    # Used to record the metrics of a Server
+    def __init__(self, registry:Union[None, MetricsRegistry] = None):
+        self.registry = registry if registry is not None else MetricsRegistry() # Where the metrics are kept, other metrics can be added to it
+        self.requests = self.registry.counter("hhttpp_requests_total", "Requests responded to", ("method", "status"))
+        self.request_bytes = self.registry.counter("hhttpp_request_bytes_total", "Bytes received in request heads and (declared) bodies")
+        self.response_bytes = self.registry.counter("hhttpp_response_bytes_total", "Bytes sent in responses")
+        self.request_duration = self.registry.histogram("hhttpp_request_duration_seconds", "Time from a request being read until it's response was sent")
+        self.parse_duration = self.registry.histogram("hhttpp_parse_duration_seconds", "Time spent parsing each request")
+        self.file_read_duration = self.registry.histogram("hhttpp_file_read_duration_seconds", "Time spent getting the content of each file (from disk or the content cache)")
+        self.connections = self.registry.counter("hhttpp_connections_total", "Connections accepted")
+        self.active_connections = self.registry.gauge("hhttpp_connections_active", "Connections currently open")
+        self.keep_alive_connections = self.registry.gauge("hhttpp_connections_keep_alive", "Open connections waiting for their next request")
+        self.connection_errors = self.registry.counter("hhttpp_connection_errors_total", "Connections that ended with an error (i.e. reset by the client), by the type of error", ("error",))
+
+    def observe_response(self, method:str, status:int, bytes_sent:int, latency:float):
+        """Records a finished response"""
+        self.requests.inc((method, status))
+        self.response_bytes.inc((), bytes_sent)
+        self.request_duration.observe(latency)
+
+    def snapshot(self) -> Dict[str, Dict[Labels, Any]]:
+        """Gets the values of every metric by it's name, see MetricsRegistry.snapshot()"""
+        return self.registry.snapshot()
+
+    def render(self) -> str:
+        """Exports every metric in the Prometheus text format, see MetricsRegistry.render()"""
+        return self.registry.render()
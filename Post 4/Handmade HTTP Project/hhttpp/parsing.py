@@ -0,0 +1,485 @@
+"""This module houses the incremental HTTP request parser used by the serving engines
+
+The parser works on the raw bytes read from a connection, so requests can arrive in any number of
+pieces, and several (pipelined) requests can arrive in one read.
+
+Classes
+-------
+RequestParser:
+    Used to incrementally parse HTTP requests from the bytes read off a connection
+
+RequestBody:
+    Used to lazily read the body of a request, decoding Content-Length or chunked bodies
+
+BodyError:
+    Raised by RequestBody for bodies that are malformed or too large
+
+References
+----------
+- HTTP 1.1 message format: https://datatracker.ietf.org/doc/html/rfc9112#section-2
+- Request line: https://datatracker.ietf.org/doc/html/rfc9112#section-3
+- Message body length: https://datatracker.ietf.org/doc/html/rfc9112#section-6.3
+- Chunked transfer coding: https://datatracker.ietf.org/doc/html/rfc9112#section-7.1
+
+Examples
+--------
+Parsing a request that arrives in two pieces
+```
+from hhttpp.parsing import RequestParser
+
+parser = RequestParser()
+parser.feed(b"GET /index.html HTTP/1.1\\r\\nHo") # "incomplete"
+parser.feed(b"st: localhost\\r\\n\\r\\n")         # "complete"
+
+print(parser.method, parser.slug, parser.headers) # GET /index.html {'Host': 'localhost'}
+parser.reset() # Ready for the next request on the connection
+```
+
+Streaming a chunked body from a socket instead of buffering it
+```
+parser = RequestParser(stream_body=True)
+parser.feed(connection.recv(65536)) # "complete" as soon as the headers are read
+
+body = parser.take_body(lambda: connection.recv(65536))
+for piece in iter(lambda: body.read(65536), b""):
+    ...
+parser.reset()
+...
+parser.feed(body.leftover()) # Start on any pipelined request
+```
+"""
+from __future__ import annotations
+import sys
+import tempfile
+from dataclasses import dataclass, field
+from typing import Literal, Dict, Union, Callable, Awaitable, IO
+
+MAX_HEADER_SIZE = 65536 # The largest request line + headers that will be buffered (in bytes)
+MAX_CHUNK_LINE_SIZE = 4096 # The longest chunk size line (or trailer) allowed in a chunked body (in bytes)
+MAX_DISCARD_SIZE = 64 * 1024 # The most unread body that's skipped to keep a connection open, larger bodies close it instead
+
+ParserState = Literal["incomplete", "complete", "error"]
+
+class BodyError(ValueError):
+    # Raised for request bodies that are malformed or too large, so they can be told apart from errors in the server
+    pass
+
+@dataclass
+class RequestParser:
+    # Used to incrementally parse HTTP requests from the bytes read off a connection
+    max_header_size: int = MAX_HEADER_SIZE # The largest request line + headers allowed (in bytes)
+    state: ParserState = "incomplete"
+    error: str = "" # Why the request could not be parsed, when state is "error"
+    method: str = ""
+    slug: str = ""
+    version: str = ""
+    headers: Dict[str, str] = field(default_factory=dict) # Header names keep the case they were sent in
+    content_length: int = 0
+    chunked: bool = False # Whether the body is sent with Transfer-Encoding: chunked
+    body: bytes = b"" # The body, when it's buffered (stream_body is False)
+    stream_body: bool = False # If True requests are complete once the headers are read, and the body is read with take_body()
+
+    def __post_init__(self):
+        self._buffer = bytearray()
+        self._search_start = 0 # Where to continue looking for the end of the headers
+        self._body_start = -1 # Where the body starts in the buffer, -1 until the headers are parsed
+        self._has_content_length = False
+        self._body_end = 0 # Where the body ends in the buffer, once it's read
+        self._decoder = None # Decodes a buffered chunked body, keeping it's place between calls to feed()
+
+    def feed(self, data:bytes = b"", final:bool = False) -> ParserState:
+        """Adds data read from the connection, and parses as much of the request as possible
+
+        Parameters
+        ----------
+        data : bytes, optional
+            The newly read data, by default b"" (useful to parse data left over from the last request)
+
+        final : bool, optional
+            Whether data is the end of the input, if True a request without a blank line after the headers
+            is still parsed and anything after the headers is the body (this is how Server.parse_request() works), by default False
+
+        Returns
+        -------
+        ParserState
+            "incomplete" if more data is needed, "complete" once the request and it's body are read,
+            or "error" if the request is malformed (self.error has details)
+        """
+        if self.state != "incomplete":
+            if data:
+                self._buffer += data
+            return self.state
+        self._buffer += data
+
+        if self._body_start == -1:
+            # Find the blank line ending the headers (some clients only send \n line endings)
+            crlf_end = self._buffer.find(b"\n\r\n", self._search_start)
+            lf_end = self._buffer.find(b"\n\n", self._search_start)
+            if lf_end != -1 and (crlf_end == -1 or lf_end < crlf_end):
+                header_end, body_start = lf_end, lf_end + 2
+            elif crlf_end != -1:
+                header_end, body_start = crlf_end, crlf_end + 3
+            elif final:
+                header_end = body_start = len(self._buffer)
+            else:
+                if len(self._buffer) > self.max_header_size:
+                    return self._fail(f"Request headers are larger than {self.max_header_size} bytes")
+                self._search_start = max(0, len(self._buffer) - 2) # The terminator could be split between reads
+                return self.state
+            if header_end > self.max_header_size:
+                return self._fail(f"Request headers are larger than {self.max_header_size} bytes")
+            if not self._parse_head(bytes(self._buffer[:header_end])):
+                return self.state
+            self._body_start = body_start
+            if final and not (self._has_content_length or self.chunked):
+                self.content_length = len(self._buffer) - body_start
+            if self.stream_body:
+                self.state = "complete"
+                return self.state
+
+        if self.chunked:
+            # Decode what's been read since the last feed(), the body is done once the last chunk arrives
+            if self._decoder is None:
+                self._decoder = RequestBody(chunked=True, max_size=sys.maxsize)
+                self._decoder._buffer = self._buffer[self._body_start:]
+            else:
+                self._decoder._buffer += data
+            decoder = self._decoder
+            try:
+                body = decoder.read_buffered()
+            except BodyError as e:
+                return self._fail(str(e))
+            if body is None:
+                if final:
+                    return self._fail("Chunked request body ended before the last chunk")
+                return self.state
+            self.body = body
+            self._body_end = len(self._buffer) - len(decoder.leftover())
+        else:
+            self._body_end = self._body_start + self.content_length
+            if len(self._buffer) < self._body_end:
+                if final:
+                    return self._fail(f"Request body is shorter than it's Content-Length ({self.content_length})")
+                return self.state
+            self.body = bytes(self._buffer[self._body_start:self._body_end])
+        self.state = "complete"
+        return self.state
+
+    def _fail(self, error:str) -> ParserState:
+        # Moves the parser to the error state
+        self.state = "error"
+        self.error = error
+        return self.state
+
+    def _parse_head(self, head:bytes) -> bool:
+        # Parses the request line and headers in one pass, returns False (and fails) if they're malformed
+        request_line, _, header_text = head.decode(errors="replace").partition("\n")
+        request_line = request_line.rstrip("\r")
+        method, _, rest = request_line.partition(" ")
+        slug, _, version = rest.rpartition(" ")
+        if not (3 <= len(method) <= 6 and method.isalpha()):
+            self._fail(f"Invalid method in request line: {request_line}")
+            return False
+        if not slug.startswith("/"):
+            self._fail(f"Invalid path in request line: {request_line}")
+            return False
+        if version != "HTTP/1.1" and version != "HTTP/1.0":
+            self._fail(f"Invalid (or unsupported) HTTP version in request line: {request_line}")
+            return False
+
+        headers = dict()
+        content_length = "0"
+        transfer_encoding = ""
+        self._has_content_length = False
+        for line in header_text.split("\n"):
+            name, separator, value = line.partition(":")
+            if not separator: # Lines that aren't headers are ignored
+                continue
+            name, value = name.strip(), value.strip()
+            headers[name] = value
+            if len(name) == 14 and name.lower() == "content-length":
+                content_length = value
+                self._has_content_length = True
+            elif len(name) == 17 and name.lower() == "transfer-encoding":
+                transfer_encoding = value.lower()
+
+        # Chunked is the only transfer coding supported, and it overrides Content-Length
+        if transfer_encoding:
+            if transfer_encoding != "chunked":
+                self._fail(f"Unsupported Transfer-Encoding: {transfer_encoding}")
+                return False
+            self.chunked = True
+            content_length = "0"
+
+        if not content_length.isdigit():
+            self._fail(f"Invalid Content-Length: {content_length}")
+            return False
+
+        self.method, self.slug, self.version = method, slug, version[5:]
+        self.headers = headers
+        self.content_length = int(content_length)
+        return True
+
+    def head_size(self) -> int:
+        """Returns the size (in bytes) of the request line and headers, including the blank line ending them (0 until they're parsed)"""
+        return max(self._body_start, 0)
+
+    def reset(self):
+        """Gets ready to parse the next request, keeping any data after the current request (pipelined requests)
+
+        Notes
+        -----
+        - Call feed() afterwards (with no data) to parse a request that was already read
+        """
+        leftover = self._buffer[self._body_end:] if self.state == "complete" else bytearray()
+        self.state, self.error = "incomplete", ""
+        self.method = self.slug = self.version = ""
+        self.headers = dict()
+        self.content_length = 0
+        self.chunked = False
+        self.body = b""
+        self._buffer = leftover
+        self._search_start = 0
+        self._body_start = -1
+        self._body_end = 0
+        self._has_content_length = False
+        self._decoder = None
+
+    def take_body(self, source:Union[None, Callable[[], bytes]] = None, async_source:Union[None, Callable[[], Awaitable[bytes]]] = None,
+                  max_size:int = 16 * 1024 * 1024, spool_threshold:int = 1024 * 1024) -> RequestBody:
+        """Hands the body of a streamed request (stream_body=True) to a RequestBody
+
+        Notes
+        -----
+        - Call reset() afterwards, then once the body has been read (or discarded) feed() the body's
+          leftover() to parse the next request
+
+        Parameters
+        ----------
+        source : Union[None, Callable[[], bytes]], optional
+            Called to read more data from the connection (b"" when it's closed), by default None
+
+        async_source : Union[None, Callable[[], Awaitable[bytes]]], optional
+            The same as source, but awaited by the async methods of RequestBody, by default None
+
+        max_size : int, optional
+            The largest body allowed (in bytes), by default 16MB
+
+        spool_threshold : int, optional
+            Bodies larger than this (in bytes) are written to a temporary file by RequestBody.spool(), by default 1MB
+
+        Returns
+        -------
+        RequestBody
+            The body of the request
+        """
+        body = RequestBody(None if self.chunked else self.content_length, self.chunked, max_size, spool_threshold, source, async_source)
+        body._buffer = self._buffer[self._body_start:]
+        self._buffer = bytearray()
+        return body
+
+@dataclass
+class RequestBody:
+    # Used to lazily read the body of a request, decoding Content-Length or chunked bodies
+    content_length: Union[None, int] = 0 # The length of the body, None if it's chunked
+    chunked: bool = False
+    max_size: int = 16 * 1024 * 1024 # Reading more than this many bytes raises a BodyError
+    spool_threshold: int = 1024 * 1024 # Bodies larger than this are written to a temporary file by spool()
+    source: Union[None, Callable[[], bytes]] = None # Reads more data from the connection (b"" once it's closed)
+    async_source: Union[None, Callable[[], Awaitable[bytes]]] = None # Awaited to read more data by the async methods
+    bytes_read: int = 0 # The number of decoded body bytes returned so far
+    done: bool = False # Whether the whole body has been read
+
+    def __post_init__(self):
+        self._buffer = bytearray() # Data read from the connection but not decoded yet
+        self._buffered_pieces = [] # The body decoded by read_buffered() before it was all read
+        self._remaining = 0 if self.content_length is None else self.content_length # Bytes left in the body (or current chunk)
+        self._chunk_state = "size" # One of "size", "data", "data end", "trailers"
+        if not self.chunked and not self._remaining:
+            self.done = True
+
+    @classmethod
+    def from_bytes(cls, content:bytes) -> RequestBody:
+        """Creates a RequestBody for content that has already been read"""
+        body = cls(len(content), max_size=max(len(content), 1))
+        body._buffer = bytearray(content)
+        return body
+
+    def _take(self, size:int) -> bytes:
+        # Takes up to size bytes of the current body (or chunk) from the buffer
+        size = min(size, self._remaining, len(self._buffer))
+        piece = bytes(self._buffer[:size])
+        del self._buffer[:size]
+        self._remaining -= size
+        return piece
+
+    def _line(self) -> Union[None, bytes]:
+        # Takes a line from the buffer (without it's line ending), None if a full line isn't buffered
+        end = self._buffer.find(b"\n")
+        if end == -1:
+            if len(self._buffer) > MAX_CHUNK_LINE_SIZE:
+                raise BodyError(f"Chunk line is longer than {MAX_CHUNK_LINE_SIZE} bytes")
+            return None
+        line = bytes(self._buffer[:end]).strip()
+        del self._buffer[:end + 1]
+        return line
+
+    def _next_piece(self, size:int) -> Union[None, bytes]:
+        # Decodes up to size bytes of the body from the buffer. None if more data has to be read, b"" once the body is done
+        if self.done:
+            return b""
+        if not self.chunked:
+            if not self._buffer:
+                return None
+            piece = self._take(size)
+            self.done = self._remaining == 0
+            return self._count(piece)
+
+        while True:
+            if self._chunk_state == "data":
+                if not self._buffer:
+                    return None
+                piece = self._take(size)
+                if self._remaining == 0:
+                    self._chunk_state = "data end"
+                return self._count(piece)
+
+            line = self._line()
+            if line is None:
+                return None
+            if self._chunk_state == "size":
+                size_text = line.split(b";", 1)[0].strip() # Drop chunk extensions
+                try:
+                    self._remaining = int(size_text, 16)
+                except ValueError:
+                    raise BodyError(f"Invalid chunk size: {size_text!r}")
+                if self._remaining < 0:
+                    raise BodyError(f"Invalid chunk size: {size_text!r}")
+                self._chunk_state = "data" if self._remaining else "trailers"
+            elif self._chunk_state == "data end":
+                if line:
+                    raise BodyError("Chunk data is longer than it's size")
+                self._chunk_state = "size"
+            elif not line: # The blank line after the (ignored) trailers ends the body
+                self.done = True
+                return b""
+
+    def _count(self, piece:bytes) -> bytes:
+        # Tracks the size of the body read so far
+        self.bytes_read += len(piece)
+        if self.bytes_read > self.max_size:
+            raise BodyError(f"Request body is larger than {self.max_size} bytes")
+        return piece
+
+    def _more_data(self, data:bytes):
+        # Adds data read from the connection to the buffer
+        if not data:
+            raise ConnectionError("Connection closed before the request body was read")
+        self._buffer += data
+
+    def read(self, size:int = -1) -> bytes:
+        """Reads up to size bytes of the body, reading from the connection as needed
+
+        Parameters
+        ----------
+        size : int, optional
+            The most bytes to return, by default -1 (the rest of the body)
+
+        Returns
+        -------
+        bytes
+            The next part of the body, b"" once it has all been read
+
+        Raises
+        ------
+        BodyError
+            If the body is malformed, or larger than self.max_size
+
+        ConnectionError
+            If the connection is closed before the body is done
+        """
+        pieces = []
+        wanted = size if size >= 0 else self.max_size + 1
+        while wanted > 0 and not self.done:
+            piece = self._next_piece(min(wanted, 65536))
+            if piece is None:
+                if not self.source:
+                    raise ConnectionError("Request body is incomplete, and there is no connection to read more from")
+                self._more_data(self.source())
+                continue
+            pieces.append(piece)
+            wanted -= len(piece)
+        return b"".join(pieces)
+
+    async def aread(self, size:int = -1) -> bytes:
+        """The same as read(), but reads from the connection with self.async_source"""
+        pieces = []
+        wanted = size if size >= 0 else self.max_size + 1
+        while wanted > 0 and not self.done:
+            piece = self._next_piece(min(wanted, 65536))
+            if piece is None:
+                if not self.async_source:
+                    raise ConnectionError("Request body is incomplete, and there is no connection to read more from")
+                self._more_data(await self.async_source())
+                continue
+            pieces.append(piece)
+            wanted -= len(piece)
+        return b"".join(pieces)
+
+    def read_buffered(self) -> Union[None, bytes]:
+        """Decodes the whole body from the data already buffered, without reading from the connection
+
+        Notes
+        -----
+        - What's decoded is kept when the body isn't all buffered yet, so calling it again after adding
+          more data carries on from where it stopped instead of decoding the body again
+
+        Returns
+        -------
+        Union[None, bytes]
+            The body, or None if it has not all been read yet
+        """
+        while not self.done:
+            piece = self._next_piece(65536)
+            if piece is None:
+                return None
+            self._buffered_pieces.append(piece)
+        body = b"".join(self._buffered_pieces)
+        self._buffered_pieces = []
+        return body
+
+    def discard(self):
+        """Reads and throws away the rest of the body, so the next request on the connection can be read"""
+        while self.read(65536):
+            pass
+
+    async def adiscard(self):
+        """The same as discard(), but reads from the connection with self.async_source"""
+        while await self.aread(65536):
+            pass
+
+    def spool(self) -> IO[bytes]:
+        """Reads the rest of the body into a file object, kept in memory unless it's larger than self.spool_threshold
+
+        Returns
+        -------
+        IO[bytes]
+            The body, seeked to the start
+        """
+        spooled = tempfile.SpooledTemporaryFile(max_size=self.spool_threshold)
+        for piece in iter(lambda: self.read(65536), b""):
+            spooled.write(piece)
+        spooled.seek(0)
+        return spooled
+
+    def remaining(self) -> Union[None, int]:
+        """The number of body bytes left to read, None if it's unknown (chunked)"""
+        if self.done:
+            return 0
+        if self.chunked:
+            return None
+        return self._remaining
+
+    def leftover(self) -> bytes:
+        """The data read past the end of the body (the start of the next request), only valid once done"""
+        return bytes(self._buffer)
@@ -0,0 +1,534 @@
+"""This module houses the index used by the Server to find the file for a request's slug
+
+Every file is kept in a hash map by it's URL, so most lookups are a single dictionary access.
+Directory indexes (index.html) and .html aliases (/about for /about.html) are kept in a trie
+with a node per directory, so they're resolved per directory in as many steps as there are
+segments in the slug.
+
+Every slug the index can resolve is also kept in a small Bloom filter, so slugs that don't exist
+(i.e. from scanners trying random paths) are ruled out before walking the trie.
+
+For folders too big to index on startup, LazyRouteIndex finds files on disk when they're requested
+instead, and remembers a bounded number of recent lookups.
+
+Classes
+-------
+BloomFilter:
+    Used to quickly rule out slugs that aren't in a RouteIndex, in a couple of bytes per slug
+
+RouteNode:
+    Used to represent one directory in a RouteIndex
+
+RouteIndex:
+    Used to look up the file for a URL, with directory indexes and .html aliases resolved per directory
+
+LazyRouteIndex:
+    Used to look up the file for a URL on disk when it's requested, instead of indexing every file up front
+
+References
+----------
+- Tries: https://en.wikipedia.org/wiki/Trie
+- Bloom filters: https://en.wikipedia.org/wiki/Bloom_filter
+- os.scandir(): https://docs.python.org/3/library/os.html#os.scandir
+
+Examples
+--------
+Indexing a folder and looking up some URL's
+```
+from hhttpp.routing import RouteIndex
+
+routes = RouteIndex.scan("example_site")
+
+routes.lookup("/pico.min.css") # "example_site/pico.min.css"
+routes.lookup("/")             # "example_site/index.html"
+routes.lookup("/faq")          # "example_site/faq.html"
+routes.lookup("/missing")      # None
+```
+"""
+from __future__ import annotations
+import os
+import stat
+import time
+import threading
+from collections import OrderedDict
+from collections.abc import Mapping
+from dataclasses import dataclass, field
+from typing import Union, Dict, List, Tuple, Iterator
+
+def list_directory(directory:str) -> Tuple[List[str], List[str]]:
+    """Lists the files and subdirectories in one directory
+
+    Notes
+    -----
+    - Like glob("**/*.*") only files with an extension are included, and hidden files and folders are skipped
+    - .gz copies of other files in the directory (i.e. pico.min.css.gz next to pico.min.css, made by
+      Server.precompress_files()) are skipped, since they're only sent in place of the file they're a copy of
+
+    Parameters
+    ----------
+    directory : str
+        The directory to list
+
+    Returns
+    -------
+    Tuple[List[str], List[str]]
+        The names of the files, and the names of the subdirectories (both empty if the directory can't be read)
+    """
+    files, subdirectories = [], []
+    try:
+        entries = os.scandir(directory)
+    except OSError:
+        return files, subdirectories # Removed while scanning, or not readable
+    with entries:
+        for entry in entries:
+            if entry.name.startswith("."):
+                continue
+            try:
+                is_directory = entry.is_dir()
+            except OSError:
+                continue
+            if is_directory:
+                subdirectories.append(entry.name)
+            elif "." in entry.name:
+                files.append(entry.name)
+    if any(name.endswith(".gz") for name in files):
+        names = set(files)
+        files = [name for name in files if not (name.endswith(".gz") and name[:-3] in names)]
+    return files, subdirectories
+
+def scan_files(directory:str, url_prefix:str = "") -> Iterator[Tuple[str, str]]:
+    """Finds every file in a directory and it's subdirectories (see list_directory()), along with the URL for it
+
+    Parameters
+    ----------
+    directory : str
+        The directory to search
+
+    url_prefix : str, optional
+        The URL of the directory (i.e. "/posts"), by default "" for the root
+
+    Yields
+    ------
+    Tuple[str, str]
+        The URL and path of each file
+    """
+    pending = [(directory, url_prefix)]
+    while pending:
+        current_directory, current_url = pending.pop()
+        files, subdirectories = list_directory(current_directory)
+        for name in subdirectories:
+            pending.append((os.path.join(current_directory, name), f"{current_url}/{name}"))
+        for name in files:
+            yield f"{current_url}/{name}", os.path.join(current_directory, name)
+
+@dataclass
+class BloomFilter:
+    # Used to quickly rule out slugs that aren't in a RouteIndex, in a couple of bytes per slug
+    capacity: int = 1024 # The number of items the filter is sized for, past this false positives become more common
+    bits_per_item: int = 16 # With 2 probes per item this gives at most about 1.4% false positives at capacity
+    count: int = 0 # The number of items added
+
+    def __post_init__(self):
+        # A power of 2 number of bits, so probes are picked with a mask instead of a slower modulo
+        self.size = 1 << max(6, (self.capacity * self.bits_per_item - 1).bit_length())
+        self.mask = self.size - 1
+        self.bits = bytearray(self.size >> 3)
+
+    def add(self, item:str):
+        """Adds an item, after this `item in filter` is always True"""
+        # Two probes from the low and high halves of one hash keep lookups cheap in python
+        hashed = hash(item)
+        first, second = hashed & self.mask, (hashed >> 32) & self.mask
+        self.bits[first >> 3] |= 1 << (first & 7)
+        self.bits[second >> 3] |= 1 << (second & 7)
+        self.count += 1
+
+    def __contains__(self, item:str) -> bool:
+        # False means the item was definitely never added, True means it probably was
+        hashed = hash(item)
+        bits, mask = self.bits, self.mask
+        first, second = hashed & mask, (hashed >> 32) & mask
+        return bits[first >> 3] >> (first & 7) & bits[second >> 3] >> (second & 7) & 1 == 1
+
+    def full(self) -> bool:
+        """Whether more items than the capacity have been added"""
+        return self.count > self.capacity
+
+    def copy(self) -> BloomFilter:
+        """Copies the filter"""
+        copied = BloomFilter(1, self.bits_per_item, self.count)
+        copied.capacity, copied.size, copied.mask, copied.bits = self.capacity, self.size, self.mask, bytearray(self.bits)
+        return copied
+
+@dataclass
+class RouteNode:
+    # Used to represent one directory in a RouteIndex
+    index: Union[None, str] = None # The path to the directory's index.html
+    pages: Dict[str, str] = field(default_factory=lambda:dict()) # The .html files in the directory by their alias (name without .html)
+    children: Dict[str, RouteNode] = field(default_factory=lambda:dict()) # The subdirectories that have .html files by name
+
+    def copy(self) -> RouteNode:
+        """Copies the node and all of it's children"""
+        return RouteNode(self.index, dict(self.pages), {name: child.copy() for name, child in self.children.items()})
+
+@dataclass(eq=False)
+class RouteIndex(Mapping):
+    # Used to look up the file for a URL, with directory indexes and .html aliases resolved per directory
+    files: Dict[str, str] = field(default_factory=lambda:dict()) # The path to every file by it's URL
+    root: RouteNode = field(default_factory=RouteNode) # The trie of directories with .html files in them
+    known: Union[None, BloomFilter] = None # Every slug lookup() can resolve, so other slugs are ruled out without walking the trie
+    removed: int = 0 # Files removed since known was built (they stay in the filter until it's rebuilt)
+
+    def __post_init__(self):
+        if self.known is None:
+            self.rebuild_filter()
+
+    @staticmethod
+    def _slugs(url:str) -> List[str]:
+        # Every slug that lookup() resolves to the file at url
+        if not url.endswith(".html"):
+            return [url]
+        alias = url[:-5]
+        slugs = [url, alias, alias + "/"]
+        if url.endswith("/index.html"):
+            directory_url = url[:-len("/index.html")]
+            slugs.append(directory_url + "/")
+            if directory_url:
+                slugs.append(directory_url)
+        return slugs
+
+    def rebuild_filter(self):
+        """Rebuilds the Bloom filter of known slugs from scratch, sized for twice the current files so it can grow"""
+        slugs = [slug for url in self.files for slug in self._slugs(url)]
+        known = BloomFilter(max(1024, 2 * len(slugs)))
+        bits, mask = known.bits, known.mask
+        for hashed in map(hash, slugs): # Same as known.add(), without a call per slug
+            first, second = hashed & mask, (hashed >> 32) & mask
+            bits[first >> 3] |= 1 << (first & 7)
+            bits[second >> 3] |= 1 << (second & 7)
+        known.count = len(slugs)
+        self.known = known
+        self.removed = 0
+
+    @classmethod
+    def scan(cls, directory:str, file_list:Union[None, List[str]] = None) -> RouteIndex:
+        """Makes an index of every file in a directory
+
+        Parameters
+        ----------
+        directory : str
+            The directory to index
+
+        file_list : Union[None, List[str]], optional
+            If provided the paths found are appended to it, by default None
+
+        Returns
+        -------
+        RouteIndex
+            The index of the directory
+        """
+        index = cls(known=BloomFilter(1)) # Replaced once every file is added, instead of growing it as they are
+        for url, path in scan_files(directory):
+            index._add_route(url, path)
+            if file_list is not None:
+                file_list.append(path)
+        index.rebuild_filter()
+        return index
+
+    @classmethod
+    def from_files(cls, directory:str, file_list:List[str]) -> RouteIndex:
+        """Makes an index of the given files, with URL's relative to directory"""
+        index = cls(known=BloomFilter(1)) # Replaced once every file is added, instead of growing it as they are
+        for path in file_list:
+            index._add_route("/" + os.path.relpath(path, directory).replace(os.sep, "/"), path)
+        index.rebuild_filter()
+        return index
+
+    @classmethod
+    def from_urls(cls, urls:Dict[str, str]) -> RouteIndex:
+        """Makes an index from the path of every file by it's URL (i.e. from TreeWatcher.snapshot())"""
+        index = cls(known=BloomFilter(1)) # Replaced once every file is added, instead of growing it as they are
+        for url, path in urls.items():
+            index._add_route(url, path)
+        index.rebuild_filter()
+        return index
+
+    def copy(self) -> RouteIndex:
+        """Makes a copy that can be changed without affecting lookups on this index"""
+        return RouteIndex(dict(self.files), self.root.copy(), self.known.copy(), self.removed)
+
+    def _node(self, directory_url:str, create:bool = False) -> Union[None, RouteNode]:
+        # Walks the trie to the node for a directory URL (i.e. "/posts", or "" for the root)
+        node = self.root
+        if not directory_url:
+            return node
+        for segment in directory_url.split("/")[1:]:
+            child = node.children.get(segment)
+            if child is None:
+                if not create:
+                    return None
+                child = node.children[segment] = RouteNode()
+            node = child
+        return node
+
+    def _add_route(self, url:str, path:str):
+        # Adds a file and it's alias and directory index to the trie, without updating the filter
+        self.files[url] = path
+        if url.endswith(".html"):
+            directory_url, _, name = url.rpartition("/")
+            node = self._node(directory_url, create=True)
+            node.pages[name[:-5]] = path
+            if name == "index.html":
+                node.index = path
+
+    def add(self, url:str, path:str):
+        """Adds (or replaces) the file for a URL, along with it's alias and directory index if it's a .html file
+
+        Parameters
+        ----------
+        url : str
+            The URL of the file (i.e. "/posts/binturongs.html")
+
+        path : str
+            The path to the file
+        """
+        self._add_route(url, path)
+        if self.known.full():
+            self.rebuild_filter()
+        else:
+            for slug in self._slugs(url):
+                self.known.add(slug)
+
+    def remove(self, url:str) -> Union[None, str]:
+        """Removes the file for a URL, along with it's alias and directory index
+
+        Parameters
+        ----------
+        url : str
+            The URL of the file
+
+        Returns
+        -------
+        Union[None, str]
+            The path that was removed, or None if the URL wasn't in the index
+        """
+        path = self.files.pop(url, None)
+        if path is not None and url.endswith(".html"):
+            directory_url, _, name = url.rpartition("/")
+            node = self._node(directory_url)
+            if node is not None:
+                node.pages.pop(name[:-5], None)
+                if name == "index.html":
+                    node.index = None
+        if path is not None:
+            # Bloom filters can't remove items, so it's rebuilt once enough stale slugs build up
+            self.removed += 1
+            if self.removed > max(1024, len(self.files) // 4):
+                self.rebuild_filter()
+        return path
+
+    def lookup(self, slug:str) -> Union[None, str]:
+        """Finds the file for a slug
+
+        Notes
+        -----
+        - Exact file URL's are checked first (i.e. "/faq.html")
+        - Slugs without a trailing slash then try the .html alias ("/faq"), then the directory index ("/posts")
+        - Slugs with a trailing slash try the directory index ("/posts/"), then the .html alias ("/faq/")
+
+        Parameters
+        ----------
+        slug : str
+            The slug from the request
+
+        Returns
+        -------
+        Union[None, str]
+            The path to the file, or None if there isn't one
+        """
+        path = self.files.get(slug)
+        if path is not None:
+            return path
+        if slug not in self.known:
+            return None
+        directory_url, _, name = slug.rpartition("/")
+        node = self._node(directory_url)
+        if name:
+            if node is None:
+                return None
+            path = node.pages.get(name)
+            if path is None:
+                child = node.children.get(name)
+                path = child.index if child else None
+            return path
+        if node is not None and node.index:
+            return node.index
+        parent_url, _, directory_name = directory_url.rpartition("/")
+        parent = self._node(parent_url) if directory_name else None
+        return parent.pages.get(directory_name) if parent else None
+
+    def __getitem__(self, slug:str) -> str:
+        path = self.lookup(slug)
+        if path is None:
+            raise KeyError(slug)
+        return path
+
+    def __contains__(self, slug:object) -> bool:
+        return isinstance(slug, str) and self.lookup(slug) is not None
+
+    def get(self, slug:str, default:Union[None, str] = None) -> Union[None, str]:
+        path = self.lookup(slug)
+        return default if path is None else path
+
+    def __iter__(self) -> Iterator[str]:
+        # Only file URL's are listed, aliases and directory indexes are resolved by lookup()
+        return iter(self.files)
+
+    def __len__(self) -> int:
+        return len(self.files)
+
+def _is_file(path:str) -> bool:
+    # Whether path is a regular file (following symlinks), with one stat() call
+    try:
+        return stat.S_ISREG(os.stat(path).st_mode)
+    except (OSError, ValueError):
+        return False
+
+@dataclass(eq=False)
+class LazyRouteIndex(Mapping):
+    # Used to look up the file for a URL on disk when it's requested, instead of indexing every file up front
+    directory: str # The directory files are served from
+    max_entries: int = 10_000 # The number of found files to remember
+    check_interval: float = 1.0 # Seconds a remembered lookup is used for before it's checked on disk again
+    max_slug_length: int = 1024 # Lookups for slugs longer than this are not remembered
+    max_missing: int = 10_000 # The number of slugs with no file to remember, kept apart so floods of them can't push out found files
+    hits: int = 0 # Number of lookups answered from memory
+    misses: int = 0 # Number of lookups that went to disk
+    entries: Dict[str, list] = field(default_factory=OrderedDict) # slug: [path, time to check it again]
+    missing: Dict[str, float] = field(default_factory=OrderedDict) # slug: time to check it again
+
+    def __post_init__(self):
+        self.entries = OrderedDict(self.entries)
+        self.missing = OrderedDict(self.missing)
+        self._lock = threading.Lock()
+
+    def resolve(self, slug:str) -> Union[None, str]:
+        """Finds the file for a slug on disk, with the same rules as RouteIndex.lookup()
+
+        Notes
+        -----
+        - Slugs with "." or ".." segments, empty segments, hidden files or folders, backslashes or null
+          bytes never match, so nothing outside of self.directory can be reached
+
+        Parameters
+        ----------
+        slug : str
+            The slug from the request
+
+        Returns
+        -------
+        Union[None, str]
+            The path to the file, or None if there isn't one
+        """
+        if not slug.startswith("/") or "\\" in slug or "\0" in slug or (os.name == "nt" and ":" in slug):
+            return None
+        *directories, name = slug[1:].split("/")
+        for segment in directories:
+            if not segment or segment.startswith("."): # Also stops "." and ".."
+                return None
+        if name.startswith("."):
+            return None
+        directory = os.path.join(self.directory, *directories)
+        if name:
+            path = os.path.join(directory, name)
+            if "." in name and _is_file(path):
+                if name.endswith(".gz") and _is_file(path[:-3]):
+                    return None # A .gz copy of another file, see list_directory()
+                return path
+            for candidate in (path + ".html", os.path.join(path, "index.html")):
+                if _is_file(candidate):
+                    return candidate
+            return None
+        index = os.path.join(directory, "index.html")
+        if _is_file(index):
+            return index
+        if directories and _is_file(directory + ".html"):
+            return directory + ".html"
+        return None
+
+    def lookup(self, slug:str) -> Union[None, str]:
+        """Finds the file for a slug, remembering the result (even if there's no file) for check_interval seconds
+
+        Parameters
+        ----------
+        slug : str
+            The slug from the request
+
+        Returns
+        -------
+        Union[None, str]
+            The path to the file, or None if there isn't one
+        """
+        now = time.monotonic()
+        with self._lock:
+            entry = self.entries.get(slug)
+            if entry is not None and entry[1] > now:
+                self.entries.move_to_end(slug)
+                self.hits += 1
+                return entry[0]
+            if self.missing.get(slug, 0) > now:
+                self.hits += 1
+                return None
+            self.misses += 1
+        path = self.resolve(slug)
+        if len(slug) <= self.max_slug_length:
+            with self._lock:
+                if path is None:
+                    self.entries.pop(slug, None)
+                    self.missing[slug] = now + self.check_interval
+                    self.missing.move_to_end(slug)
+                    while len(self.missing) > self.max_missing:
+                        self.missing.popitem(last=False)
+                else:
+                    self.missing.pop(slug, None)
+                    self.entries[slug] = [path, now + self.check_interval]
+                    self.entries.move_to_end(slug)
+                    while len(self.entries) > self.max_entries:
+                        self.entries.popitem(last=False)
+        return path
+
+    def invalidate(self, slug:Union[None, str] = None):
+        """Forgets a remembered lookup, or every lookup if no slug is given"""
+        with self._lock:
+            if slug is None:
+                self.entries.clear()
+                self.missing.clear()
+            else:
+                self.entries.pop(slug, None)
+                self.missing.pop(slug, None)
+
+    def stats(self) -> Dict[str, int]:
+        """Returns the hit and miss counters, and the number of found and missing slugs remembered"""
+        with self._lock:
+            return {"hits": self.hits, "misses": self.misses, "entries": len(self.entries), "missing": len(self.missing)}
+
+    def __getitem__(self, slug:str) -> str:
+        path = self.lookup(slug)
+        if path is None:
+            raise KeyError(slug)
+        return path
+
+    def __contains__(self, slug:object) -> bool:
+        return isinstance(slug, str) and self.lookup(slug) is not None
+
+    def get(self, slug:str, default:Union[None, str] = None) -> Union[None, str]:
+        path = self.lookup(slug)
+        return default if path is None else path
+
+    def __iter__(self) -> Iterator[str]:
+        # Only the remembered slugs that were found are listed
+        with self._lock:
+            return iter(list(self.entries))
+
+    def __len__(self) -> int:
+        return len(self.entries)
@@ -0,0 +1,159 @@
+"""This module houses the tracing used to see where the time goes while the Server handles a request
+
+When a Server has a Tracer every request it serves gets a Span, which is marked with a monotonic
+(time.perf_counter()) timestamp as each stage finishes; the connection being accepted, the request
+being received, parsed and routed, it's MIME type found, it's file read, the response generated,
+serialized and sent. Hooks registered on the Tracer are called with each Span before the response
+is generated (pre hooks) and once it's been sent (post hooks), to export them or keep slow ones.
+
+Without a Tracer no spans are made, and each stage only costs checking that the request has no span.
+
+Classes
+-------
+Span:
+    Used to represent the timeline of one request, as the time each stage finished
+
+Tracer:
+    Used to make a Span for each request, and call the hooks registered for them
+
+SlowRequestLog:
+    Used as a post hook that writes every span slower than a threshold to a file
+
+References
+----------
+- time.perf_counter(): https://docs.python.org/3/library/time.html#time.perf_counter
+- Spans: https://opentelemetry.io/docs/concepts/signals/traces/#spans
+
+Examples
+--------
+Printing the slowest stage of every request, and keeping requests over 50ms in slow.jsonl
+```
+from hhttpp import Server
+from hhttpp.tracing import Tracer, SlowRequestLog
+
+tracer = Tracer()
+tracer.add_hook(post=lambda span: print(span.slug, max(span.durations().items(), key=lambda item: item[1])))
+tracer.add_hook(post=SlowRequestLog("slow.jsonl", threshold=0.05))
+
+Server(tracer=tracer).start_server()
+```
+"""
+from __future__ import annotations
+import json
+import time
+import random
+import threading
+from typing import Any, Union, Dict, List, Tuple, Callable
+
+Hook = Callable[["Span"], None]
+
+class Span:
+    # Used to represent the timeline of one request, as the time each stage finished
+    __slots__ = ("method", "slug", "marks", "status", "bytes_sent", "attributes")
+
+    def __init__(self, method:str, slug:str, marks:Union[None, List[Tuple[str, float]]] = None):
+        self.method = method # The method of the request (i.e. "GET")
+        self.slug = slug # The slug that was requested (i.e. "/index.html")
+        self.marks: List[Tuple[str, float]] = marks if marks is not None else [] # (stage, time.perf_counter() it finished) in order
+        self.status = 0 # The status code of the response, once it's sent
+        self.bytes_sent = 0 # The bytes sent for the response, once it's sent
+        self.attributes: Dict[str, Any] = dict() # Anything hooks want to keep with the span (i.e. a trace ID)
+
+    def mark(self, stage:str):
+        """Records that a stage has just finished"""
+        self.marks.append((stage, time.perf_counter()))
+
+    def durations(self) -> Dict[str, float]:
+        """Gets the seconds each stage took (from the end of the stage before it), the first stage is when the span starts so it's left out"""
+        return {stage: finished - self.marks[index][1] for index, (stage, finished) in enumerate(self.marks[1:])}
+
+    def duration(self) -> float:
+        """Gets the seconds from the first stage to the last"""
+        return self.marks[-1][1] - self.marks[0][1] if self.marks else 0.0
+
+    def to_dict(self) -> Dict[str, Any]:
+        """Gets the span as a dict that can be written as JSON, with durations in milliseconds"""
+        return {
+            "method": self.method,
+            "slug": self.slug,
+            "status": self.status,
+            "bytes_sent": self.bytes_sent,
+            "total_ms": round(self.duration() * 1000, 3),
+            "stages_ms": {stage: round(duration * 1000, 3) for stage, duration in self.durations().items()},
+            **self.attributes,
+        }
+
+    def __repr__(self) -> str:
+        stages = ", ".join(f"{stage}={duration * 1000:.3f}ms" for stage, duration in self.durations().items())
+        return f"Span({self.method} {self.slug} {self.status}, {self.duration() * 1000:.3f}ms: {stages})"
+
+class Tracer:
+    # Used to make a Span for each request, and call the hooks registered for them
+    def __init__(self, sample_rate:float = 1.0):
+        """Sets up a tracer with no hooks
+
+        Parameters
+        ----------
+        sample_rate : float, optional
+            The fraction (0-1) of requests to make spans for, picked at random, by default 1.0 which traces every request
+
+        Raises
+        ------
+        ValueError
+            If sample_rate isn't between 0 and 1
+        """
+        if not 0 <= sample_rate <= 1:
+            raise ValueError(f"Tracing sample rate {sample_rate} must be between 0 and 1")
+        self.sample_rate = sample_rate
+        self.pre_hooks: List[Hook] = [] # Called with each span once the request is parsed, before the response is generated
+        self.post_hooks: List[Hook] = [] # Called with each span once the response is sent
+
+    def add_hook(self, pre:Union[None, Hook] = None, post:Union[None, Hook] = None):
+        """Registers hooks to call with each span, before the response is generated (pre) and once it's sent (post)
+
+        Notes
+        -----
+        - Hooks are called in the thread serving the request, so slow hooks slow down responses
+        - Errors raised by hooks are printed, and don't stop the request being served
+        """
+        if pre is not None:
+            self.pre_hooks.append(pre)
+        if post is not None:
+            self.post_hooks.append(post)
+
+    def start(self, method:str, slug:str, marks:List[Tuple[str, float]]) -> Union[None, Span]:
+        """Makes the span for a request (or None if it's sampled out) with the stages it's already been through, and calls the pre hooks"""
+        if self.sample_rate < 1 and random.random() >= self.sample_rate:
+            return None
+        span = Span(method, slug, marks)
+        self._call(self.pre_hooks, span)
+        return span
+
+    def finish(self, span:Span, status:int, bytes_sent:int):
+        """Marks a span as sent, and calls the post hooks"""
+        span.mark("sent")
+        span.status = status
+        span.bytes_sent = bytes_sent
+        self._call(self.post_hooks, span)
+
+    def _call(self, hooks:List[Hook], span:Span):
+        # Calls each hook, printing errors instead of raising them
+        for hook in hooks:
+            try:
+                hook(span)
+            except Exception as e:
+                print(f"Error in tracing hook {hook}: {e}")
+
+class SlowRequestLog:
+    # Used as a post hook that writes every span slower than a threshold to a file
+    def __init__(self, path:str, threshold:float = 0.1):
+        self.path = path # The file to append spans to, as a JSON object per line
+        self.threshold = threshold # Spans that take at least this many seconds are written
+        self._lock = threading.Lock()
+
+    def __call__(self, span:Span):
+        if span.duration() < self.threshold:
+            return
+        line = json.dumps(span.to_dict(), ensure_ascii=False) + "\n"
+        with self._lock, open(self.path, "a", encoding="utf-8") as slow_file:
+            slow_file.write(line)
@@ -0,0 +1,147 @@
+"""This module houses the watcher used by the Server to notice files being added, removed or renamed
+
+The watcher polls the modified time of every directory, which changes whenever an entry in it is
+added, removed or renamed. Only directories that changed are listed again, and only new directories
+are scanned, so each poll costs one stat() per directory when nothing has changed.
+
+Classes
+-------
+DirectoryState:
+    Used to represent what was in a directory the last time it was listed
+
+TreeWatcher:
+    Used to find the files added to, or removed from, a directory and it's subdirectories
+
+References
+----------
+- Directory modification times: https://man7.org/linux/man-pages/man7/inode.7.html
+
+Examples
+--------
+Printing changes to a folder every second
+```
+import time
+from hhttpp.watching import TreeWatcher
+
+watcher = TreeWatcher("example_site")
+watcher.snapshot()
+while True:
+    time.sleep(1)
+    for change, url, path in watcher.poll():
+        print(change, url, path) # i.e. added /posts/new-post.html example_site/posts/new-post.html
+```
+"""
+from __future__ import annotations
+import os
+import time
+from dataclasses import dataclass, field
+from typing import Union, Dict, List, Set, Tuple
+
+from .routing import list_directory
+
+Change = Tuple[str, str, str] # ("added" or "removed", URL, path)
+
+RECENT_CHANGE_NS = 2_000_000_000 # Directories modified this recently are listed again on the next poll
+
+@dataclass
+class DirectoryState:
+    # Used to represent what was in a directory the last time it was listed
+    url: str # The URL of the directory (i.e. "/posts", or "" for the root)
+    modified: Union[None, int] # The directory's modified time in ns when it was listed (None to always list it again)
+    files: Set[str] = field(default_factory=lambda:set()) # The names of the files in the directory
+    subdirectories: Set[str] = field(default_factory=lambda:set()) # The names of the directories in the directory
+
+@dataclass
+class TreeWatcher:
+    # Used to find the files added to, or removed from, a directory and it's subdirectories
+    directory: str # The directory to watch
+    directories: Dict[str, DirectoryState] = field(default_factory=lambda:dict()) # The state of every directory by path
+
+    def _list(self, path:str, url:str) -> DirectoryState:
+        # Lists a directory, and keeps it's state
+        try:
+            modified = os.stat(path).st_mtime_ns
+        except OSError:
+            modified = None
+        files, subdirectories = list_directory(path)
+        if modified is not None and time.time_ns() - modified < RECENT_CHANGE_NS:
+            # Some file systems only store modified times to the second, so changes right after
+            # listing might not change it, listing again next time makes sure they're not missed
+            modified = None
+        state = self.directories[path] = DirectoryState(url, modified, set(files), set(subdirectories))
+        return state
+
+    def _scan(self, path:str, url:str, changes:List[Change]):
+        # Lists a new directory and all of it's subdirectories, with every file in them as added
+        pending = [(path, url)]
+        while pending:
+            current_path, current_url = pending.pop()
+            state = self._list(current_path, current_url)
+            for name in state.files:
+                changes.append(("added", f"{current_url}/{name}", os.path.join(current_path, name)))
+            for name in state.subdirectories:
+                pending.append((os.path.join(current_path, name), f"{current_url}/{name}"))
+
+    def _forget(self, path:str, changes:List[Change]):
+        # Forgets a removed directory and all of it's subdirectories, with every file in them as removed
+        pending = [path]
+        while pending:
+            current_path = pending.pop()
+            state = self.directories.pop(current_path, None)
+            if state is None:
+                continue
+            for name in state.files:
+                changes.append(("removed", f"{state.url}/{name}", os.path.join(current_path, name)))
+            for name in state.subdirectories:
+                pending.append(os.path.join(current_path, name))
+
+    def snapshot(self) -> Dict[str, str]:
+        """Lists the whole tree, forgetting any earlier state
+
+        Returns
+        -------
+        Dict[str, str]
+            The path of every file by it's URL
+        """
+        self.directories = dict()
+        changes = []
+        self._scan(self.directory, "", changes)
+        return {url: path for _, url, path in changes}
+
+    def poll(self) -> List[Change]:
+        """Finds the changes since the last poll (or snapshot)
+
+        Notes
+        -----
+        - Files that are renamed show up as removed, then added with their new URL
+        - Files that are only edited are not changes, the caches notice those by their modified time
+
+        Returns
+        -------
+        List[Change]
+            ("added" or "removed", URL, path) for every file
+        """
+        changes = []
+        for path, state in list(self.directories.items()):
+            if self.directories.get(path) is not state:
+                continue # Forgot with it's parent during this poll
+            try:
+                modified = os.stat(path).st_mtime_ns
+            except OSError:
+                if path == self.directory:
+                    continue # Leave everything in place if the root is briefly missing (i.e. being replaced)
+                self._forget(path, changes)
+                continue
+            if modified == state.modified:
+                continue
+
+            new_state = self._list(path, state.url)
+            for name in new_state.files - state.files:
+                changes.append(("added", f"{state.url}/{name}", os.path.join(path, name)))
+            for name in state.files - new_state.files:
+                changes.append(("removed", f"{state.url}/{name}", os.path.join(path, name)))
+            for name in state.subdirectories - new_state.subdirectories:
+                self._forget(os.path.join(path, name), changes)
+            for name in new_state.subdirectories - state.subdirectories:
+                self._scan(os.path.join(path, name), f"{state.url}/{name}", changes)
+        return changes
@@ -0,0 +1,72 @@
+# Tests for the load generator in hhttpp.bench
+import io
+import os
+import json
+import socket
+import pytest
+from hhttpp.bench import BenchResult, parse_url_mix, url_mix, read_response, run_clients, bench_server, percentile_name
+from hhttpp.classes import Server
+from helpers import serve_in_background
+
+EXAMPLE_SITE_PATH = os.path.join(os.path.dirname(__file__), "example_site")
+
+def test_url_mix():
+    assert parse_url_mix("/:5, /faq,/img/logo.png:0.5,") == [("/", 5.0), ("/faq", 1.0), ("/img/logo.png", 0.5)]
+    for bad_mix in ("", "faq", "/faq:0", "/faq:lots"):
+        with pytest.raises(ValueError):
+            parse_url_mix(bad_mix)
+
+    # Every file in the folder is in the mix once
+    mix = url_mix(EXAMPLE_SITE_PATH)
+    assert ("/index.html", 1.0) in mix and ("/faq.html", 1.0) in mix
+    assert len(mix) == len({url for url, _ in mix})
+
+def test_read_response():
+    stream = io.BytesIO(b"HTTP/1.1 200 OK\r\nContent-Length: 5\r\n\r\nhello" + b"HTTP/1.1 200 OK\r\nTransfer-Encoding: chunked\r\nConnection: close\r\n\r\n3\r\nabc\r\n0\r\n\r\n")
+    assert read_response(stream) == (200, 43, False)
+    assert read_response(stream) == (200, 79, True)
+    with pytest.raises(ValueError):
+        read_response(stream) # Nothing left
+    with pytest.raises(ValueError):
+        read_response(io.BytesIO(b"HTTP/1.1 200 OK\r\nContent-Length: 10\r\n\r\nhello"))
+
+def test_bench_result():
+    result = BenchResult("127.0.0.1:80", clients=2, keep_alive=True, duration=2.0, requests=1000, bytes_received=4 * 1024 * 1024,
+        statuses={200: 990, 404: 10}, latencies=[(number + 1) / 1000 for number in range(1000)])
+    assert [percentile_name(fraction) for fraction in (0.5, 0.9, 0.99, 0.999)] == ["p50", "p90", "p99", "p999"]
+    assert result.latency(0.5) == 0.5 and result.latency(0.999) == 0.999 and result.latency(1) == 1.0
+    assert result.requests_per_second() == 500 and result.megabytes_per_second() == 2 and result.error_responses() == 10
+    results = json.loads(json.dumps(result.to_dict()))
+    assert results["latency_ms"] == {"mean": 500.5, "p50": 500.0, "p90": 900.0, "p99": 990.0, "p999": 999.0, "max": 1000.0}
+    assert results["statuses"] == {"200": 990, "404": 10}
+    assert "Requests/sec: 500.0" in result.summary()
+    assert BenchResult("127.0.0.1:80", clients=1, keep_alive=True, duration=0).to_dict()["latency_ms"]["p99"] == 0.0
+
+@pytest.mark.parametrize("keep_alive", [True, False])
+def test_run_clients(keep_alive):
+    server = Server(EXAMPLE_SITE_PATH, port=0, threads=4)
+    thread = serve_in_background(server)
+    try:
+        result = run_clients("127.0.0.1", server.port, [("/", 3), ("/faq", 1), ("/missing", 1)], clients=4, requests=200, keep_alive=keep_alive, seed=1)
+    finally:
+        server.stop()
+        thread.join(5)
+    assert result.requests == 200 and result.errors == 0
+    assert set(result.statuses) == {200, 404} and result.error_responses() == result.statuses[404]
+    assert result.latencies == sorted(result.latencies) and len(result.latencies) == 200
+    assert result.bytes_received > 200 * len(b"HTTP/1.1 200 OK\r\n")
+
+def test_run_clients_errors():
+    # Nothing is listening, so every request fails
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as port_finder:
+        port_finder.bind(("127.0.0.1", 0))
+        port = port_finder.getsockname()[1]
+    result = run_clients("127.0.0.1", port, [("/", 1)], clients=2, requests=10, timeout=1)
+    assert result.requests == 0 and result.errors == 10
+
+@pytest.mark.parametrize("engine", ["sockets", "asyncio"])
+def test_bench_server(engine):
+    settings = {"proxy_directory": EXAMPLE_SITE_PATH, "threads": 4, "response_cache_max_bytes": 1024 * 1024}
+    result = bench_server(settings, url_mix(EXAMPLE_SITE_PATH), engine, clients=2, requests=50)
+    assert result.requests == 50 and result.errors == 0 and result.statuses == {200: 50}
+    assert result.settings == {"engine": engine, "workers": 1, **settings}
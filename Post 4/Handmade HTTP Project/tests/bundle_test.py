@@ -0,0 +1,107 @@
+# Tests for serving from a single file bundle with hhttpp.bundle
+import os
+import gzip
+import socket
+import shutil
+import threading
+import pytest
+from hhttpp.bundle import Bundle, build_bundle
+from hhttpp.routing import scan_files
+from hhttpp.classes import Server, Request, send_buffers
+from helpers import serve_in_background, read_response
+
+EXAMPLE_SITE_PATH = os.path.join(os.path.dirname(__file__), "example_site")
+
+def test_build_bundle(tmp_path):
+    path = str(tmp_path / "site.hhb")
+    assert build_bundle(EXAMPLE_SITE_PATH, path) == len(list(scan_files(EXAMPLE_SITE_PATH)))
+    bundle = Bundle.open(path)
+    for url, file_path in scan_files(EXAMPLE_SITE_PATH):
+        index = bundle.index[url]
+        with open(file_path, "rb") as bundled_file:
+            content = bundled_file.read()
+        assert bytes(bundle.content(index)) == content
+        assert bundle.etags[index].startswith('"') and bundle.modified[index] == int(os.path.getmtime(file_path))
+        if bundle.gzip_sizes[index] >= 0:
+            assert gzip.decompress(bundle.content(index, gzipped=True)) == content
+            assert bundle.gzip_sizes[index] < bundle.sizes[index]
+    index = bundle.index["/pico.min.css"]
+    assert bundle.gzip_sizes[index] > 0 and bundle.mime_types[bundle.mime_indexes[index]] == ("text/css", False)
+    assert bundle.gzip_sizes[bundle.index["/img/low-poly-ice-caps.jpg"]] == -1 # Images aren't compressed
+
+    # Without gzipped copies, and bundling into the folder being bundled
+    site = tmp_path / "site"
+    shutil.copytree(EXAMPLE_SITE_PATH, site)
+    inside = str(site / "site.hhb")
+    build_bundle(str(site), inside, gzip=False)
+    build_bundle(str(site), inside, gzip=False) # The old bundle isn't bundled
+    bundle = Bundle.open(inside)
+    assert "/site.hhb" not in bundle.index
+    assert all(size == -1 for size in bundle.gzip_sizes)
+
+    # An empty folder makes an empty bundle
+    (tmp_path / "empty_site").mkdir()
+    empty = str(tmp_path / "empty.hhb")
+    assert build_bundle(str(tmp_path / "empty_site"), empty) == 0
+    assert len(Bundle.open(empty)) == 0
+    assert Server(bundle=empty).generate_response(Request("schulichignite.com", "/")).status.value == 404
+
+    # Anything that isn't a whole bundle is refused
+    data = open(path, "rb").read()
+    for name, broken in (("empty", b""), ("short", data[:10]), ("magic", b"NOPE" + data[4:]), ("cut", data[:-1])):
+        (tmp_path / name).write_bytes(broken)
+        with pytest.raises(ValueError):
+            Bundle.open(str(tmp_path / name))
+
+def test_server_bundle(tmp_path):
+    path = str(tmp_path / "site.hhb")
+    build_bundle(EXAMPLE_SITE_PATH, path)
+    s = Server(bundle=path)
+    files = Server(proxy_directory=EXAMPLE_SITE_PATH)
+
+    # The same URL's (with aliases and indexes) and content as serving the folder
+    for slug in ("/", "/faq", "/posts/binturongs", "/pico.min.css", "/img/low-poly-ice-caps.jpg"):
+        resp = s.generate_response(Request("schulichignite.com", slug))
+        assert resp.status.value == 200
+        assert isinstance(resp.content, memoryview)
+        assert resp.body_bytes() == files.generate_response(Request("schulichignite.com", slug)).body_bytes()
+        assert resp.headers["Content-Type"] == files.generate_response(Request("schulichignite.com", slug)).headers["Content-Type"]
+    assert s.generate_response(Request("schulichignite.com", "/missing")).status.value == 404
+    assert s.generate_response(Request("schulichignite.com", "/", "POST")).status.value == 403
+
+    # Conditional requests, gzipped copies and ranges
+    css = s.generate_response(Request("schulichignite.com", "/pico.min.css"))
+    etag = css.headers["ETag"]
+    assert s.generate_response(Request("schulichignite.com", "/pico.min.css", headers={"if-none-match": etag})).status.value == 304
+    zipped = s.generate_response(Request("schulichignite.com", "/pico.min.css", headers={"accept-encoding": "gzip"}))
+    assert zipped.headers["Content-Encoding"] == "gzip" and zipped.headers["ETag"] == etag[:-1] + '-gzip"'
+    assert gzip.decompress(zipped.body_bytes()) == css.body_bytes()
+    partial = s.generate_response(Request("schulichignite.com", "/pico.min.css", headers={"range": "bytes=0-9", "accept-encoding": "gzip"}))
+    assert partial.status.value == 206 and partial.body_bytes() == css.body_bytes()[:10]
+
+    # Over a connection
+    s = Server(bundle=path, port=0, threads=2)
+    thread = serve_in_background(s)
+    try:
+        with socket.create_connection(("127.0.0.1", s.port), timeout=5) as client, client.makefile("rb") as stream:
+            for slug in ("/", "/img/low-poly-ice-caps.jpg", "/faq"):
+                client.sendall(f"GET {slug} HTTP/1.1\r\nHost: localhost\r\n\r\n".encode())
+                status_line, headers, body = read_response(stream)
+                assert status_line == "HTTP/1.1 200 Ok"
+                assert body == files.generate_response(Request("schulichignite.com", slug)).body_bytes()
+    finally:
+        s.stop()
+        thread.join(5)
+
+def test_send_buffers():
+    sender, receiver = socket.socketpair()
+    with sender, receiver:
+        data = os.urandom(1024 * 1024)
+        receiver.settimeout(5)
+        received = bytearray()
+        thread = threading.Thread(target=send_buffers, args=(sender, [b"head", b"", memoryview(data), b"tail"]))
+        thread.start()
+        while len(received) < len(data) + 8:
+            received += receiver.recv(65536)
+        thread.join()
+        assert received == b"head" + data + b"tail"
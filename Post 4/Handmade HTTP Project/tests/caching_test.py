@@ -0,0 +1,112 @@
+# Tests for the caches in hhttpp.caching
+import os
+import time
+from hhttpp.caching import ContentCache, ValidatorCache
+from hhttpp.classes import Server, Request
+
+EXAMPLE_SITE_PATH = os.path.join(os.path.dirname(__file__), "example_site")
+
+def write_file(path, content:bytes):
+    with open(path, "wb") as output_file:
+        output_file.write(content)
+
+def test_content_cache(tmp_path):
+    for name in "abcd":
+        write_file(tmp_path / f"{name}.txt", name.encode() * 40)
+    write_file(tmp_path / "big.txt", b"x" * 200)
+    cache = ContentCache(max_bytes=100, max_entry_size=50, check_interval=0)
+
+    # Misses read from disk, hits come from memory
+    assert cache.read(str(tmp_path / "a.txt")) == b"a" * 40
+    assert cache.read(str(tmp_path / "a.txt")) == b"a" * 40
+    assert cache.stats() == {"hits": 1, "misses": 1, "evictions": 0, "entries": 1, "bytes": 40}
+
+    # Files over the entry limit are never cached
+    assert cache.read(str(tmp_path / "big.txt")) is None
+    assert cache.stats()["entries"] == 1
+
+    # The least recently used file is evicted when over max_bytes
+    cache.read(str(tmp_path / "b.txt"))
+    cache.read(str(tmp_path / "a.txt"))
+    cache.read(str(tmp_path / "c.txt"))
+    assert list(cache.entries) == [str(tmp_path / "a.txt"), str(tmp_path / "c.txt")]
+    assert cache.evictions == 1
+    assert cache.size == 80
+
+    # Changes on disk are picked up
+    write_file(tmp_path / "a.txt", b"changed")
+    os.utime(tmp_path / "a.txt", ns=(time.time_ns(), time.time_ns() + 1_000_000_000))
+    assert cache.read(str(tmp_path / "a.txt")) == b"changed"
+
+    cache.invalidate()
+    assert cache.stats()["entries"] == 0
+    assert cache.size == 0
+
+def test_server_content_cache():
+    s = Server(proxy_directory=EXAMPLE_SITE_PATH, cache_max_bytes=1024 * 1024)
+    with open(s.urls["/"], "rb") as index_file:
+        index = index_file.read()
+    for _ in range(3):
+        resp = s.generate_response(Request("schulichignite.com", "/"))
+        assert resp.body_bytes() == index
+        assert resp.file_path is None
+    assert s.cache_stats()["hits"] == 2
+    assert s.cache_stats()["misses"] == 1
+
+    # Files too big for the cache are still sent from disk
+    resp = s.generate_response(Request("schulichignite.com", "/img/low-poly-ice-caps.jpg", received=time.perf_counter()))
+    assert resp.file_path is not None
+    assert s.cache_stats()["entries"] == 1
+
+    # The cache is disabled by default
+    assert Server(proxy_directory=EXAMPLE_SITE_PATH).cache_stats()["hits"] == 0
+
+def test_response_cache(tmp_path):
+    write_file(tmp_path / "index.html", b"<h1>Hi</h1>")
+    s = Server(proxy_directory=str(tmp_path), response_cache_max_bytes=1024 * 1024)
+    request = Request("schulichignite.com", "/")
+
+    # The first request is generated and cached, the next comes straight from the cache
+    assert s.cached_response(request) is None
+    prepared = s.prepare_response(request, s.generate_response(request))
+    assert s.cached_response(request) is prepared
+    assert prepared.body == b"<h1>Hi</h1>"
+    head = prepared.head_bytes(keep_alive=True)
+    assert head.startswith(b"HTTP/1.1 200 Ok\r\n")
+    assert b"Content-Length: 11\r\n" in head
+    assert head.endswith(b"Connection: keep-alive\r\n\r\n")
+
+    # Changing the file drops the cached response
+    s.response_cache.check_interval = 0
+    write_file(tmp_path / "index.html", b"<h1>Hello</h1>")
+    assert s.cached_response(request) is None
+
+    # Only successful GET's are cached
+    missing = Request("schulichignite.com", "/missing")
+    s.prepare_response(missing, s.generate_response(missing))
+    assert s.response_cache.get(s._cache_key(missing)) is None
+    assert s.cached_response(missing) is s._not_found # Misses get the 404 prepared on startup instead
+
+def test_validator_cache(tmp_path):
+    path = str(tmp_path / "page.html")
+    write_file(path, b"<h1>hello</h1>")
+    os.utime(path, (1_600_000_000, 1_600_000_000))
+    weak = ValidatorCache(check_interval=0)
+    etag, last_modified, modified = weak.validators(path)
+    assert etag.startswith('W/"e-')
+    assert last_modified == "Sun, 13 Sep 2020 12:26:40 GMT"
+    assert modified == 1_600_000_000
+    assert weak.validators(path) == (etag, last_modified, modified)
+    assert weak.hits == 1
+
+    # Strong ETags only change when the content does
+    strong = ValidatorCache(check_interval=0, strong=True)
+    strong_etag = strong.validators(path)[0]
+    assert not strong_etag.startswith("W/")
+    os.utime(path, (1_600_000_100, 1_600_000_100))
+    assert strong.validators(path)[0] == strong_etag
+    assert weak.validators(path)[0] != etag
+    write_file(path, b"<h1>bye!!</h1>")
+    assert strong.validators(path)[0] != strong_etag
+
+    assert weak.validators(str(tmp_path / "missing.html")) is None
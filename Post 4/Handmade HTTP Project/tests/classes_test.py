@@ -1,6 +1,15 @@
 # Primary testing file
-from pytest import raises
+from pytest import raises, mark
+import sys
+import time
+import signal
+import socket
+import struct
+import asyncio
+import subprocess
+import threading
 from hhttpp.classes import *
+from helpers import serve_in_background, fetch, read_response
 
 EXAMPLE_SITE_PATH = os.path.join(os.path.dirname(__file__), "example_site")
 
@@ -339,4 +348,558 @@ def test_server():
     ### Incorrect headers
     raw_request = "GET / HTTP/1.1\nHost; schulichignite.com"
     assert len(s.parse_request(raw_request).headers) == 2
-    
\ No newline at end of file
+    
+def test_sendfile_responses():
+    image_path = os.path.join(EXAMPLE_SITE_PATH, "img", "low-poly-ice-caps.jpg")
+    with open(image_path, "rb") as image_file:
+        image = image_file.read()
+    request = Request("schulichignite.com", "/img/low-poly-ice-caps.jpg", received=time.perf_counter())
+
+    ## Files are left on disk for requests read from a connection by default
+    resp = Server(proxy_directory=EXAMPLE_SITE_PATH).generate_response(request)
+    assert resp.content == b""
+    assert resp.file_size == len(image)
+    assert os.path.samefile(resp.file_path, image_path)
+    assert resp.body_bytes() == image
+
+    ## Files are read into memory when sendfile is disabled
+    resp = Server(proxy_directory=EXAMPLE_SITE_PATH, use_sendfile=False).generate_response(request)
+    assert resp.content == image
+    assert resp.file_path is None
+    assert resp.body_bytes() == image
+
+    ## And when generate_response() is called directly, so the content is there for callers to read
+    resp = Server(proxy_directory=EXAMPLE_SITE_PATH).generate_response(Request("schulichignite.com", "/img/low-poly-ice-caps.jpg"))
+    assert resp.content == image and resp.file_path is None
+    text = Server(proxy_directory=EXAMPLE_SITE_PATH).generate_response(Request("schulichignite.com", "/faq.html"))
+    with open(os.path.join(EXAMPLE_SITE_PATH, "faq.html"), encoding="UTF-8") as faq_file:
+        assert str(text).endswith(faq_file.read())
+
+def test_threaded_server():
+    s = Server(proxy_directory=EXAMPLE_SITE_PATH, port=0, threads=4, backlog=64)
+    thread = serve_in_background(s)
+    try:
+        # A client that connects but never sends should not stall the others
+        idle_client = socket.create_connection(("127.0.0.1", s.port))
+
+        results = []
+        clients = [threading.Thread(target=lambda: results.append(fetch(s.port, "/posts"))) for _ in range(12)]
+        for client in clients:
+            client.start()
+        for client in clients:
+            client.join(10)
+        assert len(results) == 12
+        assert all(result.startswith(b"HTTP/1.1 200 Ok") for result in results)
+        idle_client.close()
+    finally:
+        s.stop()
+        thread.join(5)
+    assert not thread.is_alive()
+
+@mark.parametrize("threads", [0, 2])
+def test_client_resets(tmp_path, capsys, threads):
+    # Clients that reset the connection in the middle of a response only end their own connection
+    (tmp_path / "index.html").write_bytes(b"<html></html>")
+    (tmp_path / "big.bin").write_bytes(b"\0" * 16 * 1024 * 1024)
+    s = Server(proxy_directory=str(tmp_path), port=0, threads=threads, metrics_enabled=True)
+    thread = serve_in_background(s)
+    try:
+        for _ in range(3):
+            client = socket.create_connection(("127.0.0.1", s.port), timeout=5)
+            client.setsockopt(socket.SOL_SOCKET, socket.SO_LINGER, struct.pack("ii", 1, 0)) # Closing sends a reset
+            client.sendall(b"GET /big.bin HTTP/1.1\r\nHost: localhost\r\n\r\n")
+            client.recv(1024)
+            client.close()
+        assert fetch(s.port, "/").startswith(b"HTTP/1.1 200 Ok")
+        assert thread.is_alive()
+    finally:
+        s.stop()
+        thread.join(5)
+    # The errors are counted, not printed
+    assert sum(s.metrics.connection_errors.values().values()) == 3
+    assert "Error while handling connection" not in capsys.readouterr().out
+
+@mark.parametrize("engine", ["sockets", "asyncio"])
+def test_server_errors(tmp_path, capsys, engine):
+    # Errors in the server get a 500 and are logged, instead of being counted like a client's mistake
+    for name in ("index.html", "removed.html"):
+        (tmp_path / name).write_text(f"<html>{name}</html>")
+    (tmp_path / "cached.html").write_bytes(b" " * 512 * 1024) # Too big to keep in memory, so it's cached response is sent from the file
+    s = Server(proxy_directory=str(tmp_path), port=0, threads=2, metrics_enabled=True, response_cache_max_bytes=1024 * 1024)
+    if engine == "sockets":
+        thread = serve_in_background(s)
+    else:
+        thread = threading.Thread(target=lambda: asyncio.run(s.serve_async()), daemon=True)
+        thread.start()
+        assert s.listening.wait(5)
+    try:
+        assert fetch(s.port, "/cached").startswith(b"HTTP/1.1 200 Ok")
+        os.remove(tmp_path / "cached.html") # The cached response still points at it, so it fails while sending
+        os.remove(tmp_path / "removed.html") # Fails while generating the response
+        for slug in ("/cached", "/removed"):
+            response = fetch(s.port, slug)
+            assert response.startswith(b"HTTP/1.1 500 Internal Server Error") and b"Connection: close" in response
+        assert fetch(s.port, "/").startswith(b"HTTP/1.1 200 Ok")
+    finally:
+        s.stop()
+        thread.join(5)
+    assert [(record.slug, record.status) for record in s.logs] == [("/cached", 200), ("/cached", 500), ("/removed", 500), ("/", 200)]
+    assert sum(s.metrics.connection_errors.values().values()) == 0
+    output = capsys.readouterr().out
+    assert "Error while responding to GET /cached" in output and "Error while responding to GET /removed" in output
+
+def test_keep_alive():
+    s = Server(proxy_directory=EXAMPLE_SITE_PATH, port=0, threads=2, keep_alive_timeout=0.5, max_keep_alive_requests=3)
+    thread = serve_in_background(s)
+    try:
+        with socket.create_connection(("127.0.0.1", s.port), timeout=5) as client:
+            stream = client.makefile("rb")
+            # Pipelined requests are answered in order, and the connection closes after the max requests
+            slugs = ["/", "/pico.min.css", "/js/particles.min.js"]
+            client.sendall("".join(f"GET {slug} HTTP/1.1\r\nHost: localhost\r\n\r\n" for slug in slugs).encode())
+            for index, slug in enumerate(slugs):
+                status_line, headers, body = read_response(stream)
+                assert status_line == "HTTP/1.1 200 Ok"
+                assert headers["connection"] == ("close" if index == 2 else "keep-alive")
+                with open(s.urls[slug], "rb") as served_file:
+                    assert body == served_file.read()
+            assert stream.read() == b""
+
+        # Malformed requests get a 400 and the connection is closed
+        with socket.create_connection(("127.0.0.1", s.port), timeout=5) as client:
+            stream = client.makefile("rb")
+            client.sendall(b"G3T / HTTP/1.1\r\nHost: localhost\r\n\r\n")
+            assert read_response(stream)[0] == "HTTP/1.1 400 Bad Request"
+            assert stream.read() == b""
+
+        # Bodies are skipped (even chunked ones) so the next request on the connection works
+        with socket.create_connection(("127.0.0.1", s.port), timeout=5) as client:
+            stream = client.makefile("rb")
+            client.sendall(b"POST / HTTP/1.1\r\nContent-Length: 5\r\n\r\nhello")
+            client.sendall(b"POST / HTTP/1.1\r\nTransfer-Encoding: chunked\r\n\r\n5\r\nhello\r\n0\r\n\r\n")
+            client.sendall(b"GET / HTTP/1.1\r\nHost: localhost\r\n\r\n")
+            assert read_response(stream)[0] == "HTTP/1.1 403 Forbidden"
+            status_line, headers, _ = read_response(stream)
+            assert status_line == "HTTP/1.1 403 Forbidden"
+            assert headers["connection"] == "close" # Chunked bodies that weren't read close the connection
+
+        # Bodies over max_body_size are refused
+        with socket.create_connection(("127.0.0.1", s.port), timeout=5) as client:
+            stream = client.makefile("rb")
+            client.sendall(f"POST / HTTP/1.1\r\nContent-Length: {s.max_body_size + 1}\r\n\r\n".encode())
+            assert read_response(stream)[0] == "HTTP/1.1 413 Payload Too Large"
+
+        # Connection: close is honoured
+        with socket.create_connection(("127.0.0.1", s.port), timeout=5) as client:
+            stream = client.makefile("rb")
+            client.sendall(b"GET / HTTP/1.1\r\nHost: localhost\r\nConnection: close\r\n\r\n")
+            assert read_response(stream)[1]["connection"] == "close"
+            assert stream.read() == b""
+
+        # HTTP/1.0 clients can opt in to keep-alive, and idle connections are closed after the timeout
+        with socket.create_connection(("127.0.0.1", s.port), timeout=5) as client:
+            stream = client.makefile("rb")
+            client.sendall(b"GET / HTTP/1.0\r\nHost: localhost\r\nConnection: keep-alive\r\n\r\n")
+            assert read_response(stream)[1]["connection"] == "keep-alive"
+            start = time.monotonic()
+            assert stream.read() == b""
+            assert time.monotonic() - start < 3
+    finally:
+        s.stop()
+        thread.join(5)
+
+def test_keep_alive_without_threads():
+    # Connections handled in the accept loop are closed after one response, so an idle one can't stall other clients
+    s = Server(proxy_directory=EXAMPLE_SITE_PATH, port=0, threads=0)
+    thread = serve_in_background(s)
+    try:
+        with socket.create_connection(("127.0.0.1", s.port), timeout=5) as idle_client:
+            stream = idle_client.makefile("rb")
+            idle_client.sendall(b"GET / HTTP/1.1\r\nHost: localhost\r\n\r\n")
+            assert read_response(stream)[1]["connection"] == "close"
+            start = time.monotonic()
+            assert fetch(s.port, "/faq").startswith(b"HTTP/1.1 200 Ok")
+            assert time.monotonic() - start < 1
+    finally:
+        s.stop()
+        thread.join(5)
+
+def test_async_server():
+    s = Server(proxy_directory=EXAMPLE_SITE_PATH, port=0, response_cache_max_bytes=1024 * 1024)
+    thread = threading.Thread(target=lambda: asyncio.run(s.serve_async()), daemon=True)
+    thread.start()
+    assert s.listening.wait(5)
+    try:
+        # Lots of idle connections are held without blocking anyone else
+        idle_clients = [socket.create_connection(("127.0.0.1", s.port)) for _ in range(200)]
+
+        # Several requests on one kept-alive connection
+        with socket.create_connection(("127.0.0.1", s.port), timeout=5) as client:
+            stream = client.makefile("rb")
+            for slug in ("/", "/pico.min.css", "/img/low-poly-ice-caps.jpg", "/", "/img/low-poly-ice-caps.jpg"):
+                client.sendall(f"GET {slug} HTTP/1.1\r\nHost: localhost\r\n\r\n".encode())
+                status_line, headers, body = read_response(stream)
+                assert status_line == "HTTP/1.1 200 Ok"
+                assert headers["connection"] == "keep-alive"
+                with open(s.urls[slug], "rb") as served_file:
+                    assert body == served_file.read()
+
+        # Unread bodies are skipped before the next request
+        with socket.create_connection(("127.0.0.1", s.port), timeout=5) as client:
+            stream = client.makefile("rb")
+            client.sendall(b"PUT / HTTP/1.1\r\nContent-Length: 5\r\n\r\nhelloGET / HTTP/1.1\r\n\r\n")
+            assert read_response(stream)[0] == "HTTP/1.1 403 Forbidden"
+            assert read_response(stream)[0] == "HTTP/1.1 200 Ok"
+
+        assert fetch(s.port, "/not-a-page").startswith(b"HTTP/1.1 404 Not Found")
+        for idle_client in idle_clients:
+            idle_client.close()
+    finally:
+        s.stop()
+        thread.join(5)
+    assert not thread.is_alive()
+
+def test_conditional_requests():
+    s = Server(proxy_directory=EXAMPLE_SITE_PATH)
+    resp = s.generate_response(Request("schulichignite.com", "/pico.min.css"))
+    assert resp.status.value == 200
+    etag, last_modified = resp.headers["ETag"], resp.headers["Last-Modified"]
+
+    # Matching validators get a 304 with no body
+    for headers in ({"If-None-Match": etag}, {"If-None-Match": f'"other", {etag}'}, {"if-none-match": "*"}, {"If-Modified-Since": last_modified}):
+        resp = s.generate_response(Request("schulichignite.com", "/pico.min.css", headers=headers))
+        assert resp.status.value == 304
+        assert resp.headers["ETag"] == etag
+        assert resp.file_path is None and resp.body_bytes() == b""
+        assert b"Content-Length" not in s.prepare_response(None, resp).head
+
+    # Anything else gets the full response
+    for headers in ({"If-None-Match": '"other"'}, {"If-Modified-Since": "Thu, 01 Jan 1970 00:00:00 GMT"}, {"If-Modified-Since": "not a date"}, {"If-None-Match": '"other"', "If-Modified-Since": last_modified}):
+        assert s.generate_response(Request("schulichignite.com", "/pico.min.css", headers=headers)).status.value == 200
+    assert s.generate_response(Request("schulichignite.com", "/not-a-page", headers={"If-None-Match": "*"})).status.value == 404
+
+    # Over the wire, with cached responses answering conditional requests too
+    for response_cache_max_bytes in (0, 1024 * 1024):
+        s = Server(proxy_directory=EXAMPLE_SITE_PATH, port=0, threads=2, response_cache_max_bytes=response_cache_max_bytes)
+        thread = serve_in_background(s)
+        try:
+            with socket.create_connection(("127.0.0.1", s.port), timeout=5) as client, client.makefile("rb") as stream:
+                for _ in range(2):
+                    client.sendall(b"GET / HTTP/1.1\r\n\r\n")
+                    status_line, headers, body = read_response(stream)
+                    assert status_line == "HTTP/1.1 200 Ok" and body
+                    client.sendall(f"GET / HTTP/1.1\r\nIf-None-Match: {headers['etag']}\r\n\r\n".encode())
+                    status_line, not_modified_headers, body = read_response(stream)
+                    assert status_line == "HTTP/1.1 304 Not Modified"
+                    assert not_modified_headers["etag"] == headers["etag"]
+                    assert body == b""
+                    client.sendall(f"GET / HTTP/1.1\r\nIf-Modified-Since: {headers['last-modified']}\r\n\r\n".encode())
+                    assert read_response(stream)[0] == "HTTP/1.1 304 Not Modified"
+        finally:
+            s.stop()
+            thread.join(5)
+
+def test_parse_range():
+    assert parse_range("bytes=0-499", 1000) == [(0, 499)]
+    assert parse_range("bytes=500-", 1000) == [(500, 999)]
+    assert parse_range("bytes=-200", 1000) == [(800, 999)]
+    assert parse_range("bytes=-2000", 1000) == [(0, 999)]
+    assert parse_range("bytes=900-5000, 0-0", 1000) == [(900, 999), (0, 0)]
+    assert parse_range("bytes=1000-, -0", 1000) == [] # Not satisfiable
+    for invalid in ("items=0-1", "bytes=", "bytes=5-1", "bytes=a-b", "bytes=-", "bytes=1", ",".join(["bytes=0-1"] * 17)):
+        assert parse_range(invalid, 1000) is None
+
+def test_range_requests():
+    slug = "/img/low-poly-ice-caps.jpg"
+    for received in (time.perf_counter(), None): # Sent from disk, or from memory
+        s = Server(proxy_directory=EXAMPLE_SITE_PATH)
+        with open(s.urls[slug], "rb") as image_file:
+            image = image_file.read()
+        full = s.generate_response(Request("schulichignite.com", slug, received=received))
+        assert full.headers["Accept-Ranges"] == "bytes"
+
+        resp = s.generate_response(Request("schulichignite.com", slug, headers={"Range": "bytes=100-199"}, received=received))
+        assert resp.status.value == 206
+        assert resp.headers["Content-Range"] == f"bytes 100-199/{len(image)}"
+        assert resp.body_bytes() == image[100:200]
+
+        resp = s.generate_response(Request("schulichignite.com", slug, headers={"Range": "bytes=0-9,-10"}, received=received))
+        assert resp.status.value == 206
+        boundary = resp.headers["Content-Type"].split("boundary=")[1]
+        body = resp.body_bytes()
+        assert len(body) == resp.content_length
+        assert body == (
+            f"--{boundary}\r\nContent-Type: image/jpeg\r\nContent-Range: bytes 0-9/{len(image)}\r\n\r\n".encode() + image[:10] +
+            f"\r\n--{boundary}\r\nContent-Type: image/jpeg\r\nContent-Range: bytes {len(image) - 10}-{len(image) - 1}/{len(image)}\r\n\r\n".encode() + image[-10:] +
+            f"\r\n--{boundary}--\r\n".encode()
+        )
+
+        resp = s.generate_response(Request("schulichignite.com", slug, headers={"Range": f"bytes={len(image)}-"}))
+        assert resp.status.value == 416
+        assert resp.headers["Content-Range"] == f"bytes */{len(image)}"
+
+        # If-Range only allows ranges of the same version of the file
+        assert s.generate_response(Request("schulichignite.com", slug, headers={"Range": "bytes=0-1", "If-Range": full.headers["Last-Modified"]})).status.value == 206
+        assert s.generate_response(Request("schulichignite.com", slug, headers={"Range": "bytes=0-1", "If-Range": "Thu, 01 Jan 1970 00:00:00 GMT"})).status.value == 200
+        assert s.generate_response(Request("schulichignite.com", slug, headers={"Range": "bytes=0-1", "If-Range": full.headers["ETag"]})).status.value == 200 # Weak ETag
+
+    # Strong ETags can be used with If-Range
+    s = Server(proxy_directory=EXAMPLE_SITE_PATH, strong_etags=True)
+    etag = s.generate_response(Request("schulichignite.com", slug)).headers["ETag"]
+    assert s.generate_response(Request("schulichignite.com", slug, headers={"Range": "bytes=0-1", "If-Range": etag})).status.value == 206
+
+    # Over the wire with sendfile() from an offset, and the response cache skipped
+    s = Server(proxy_directory=EXAMPLE_SITE_PATH, port=0, threads=2, response_cache_max_bytes=1024 * 1024)
+    thread = serve_in_background(s)
+    try:
+        with socket.create_connection(("127.0.0.1", s.port), timeout=5) as client, client.makefile("rb") as stream:
+            for headers in ("", "Range: bytes=5000-5999\r\n", "Range: bytes=0-1,3-4\r\n"):
+                client.sendall(f"GET {slug} HTTP/1.1\r\n{headers}\r\n".encode())
+                status_line, response_headers, body = read_response(stream)
+                if not headers:
+                    assert status_line == "HTTP/1.1 200 Ok" and body == image
+                elif "," not in headers:
+                    assert status_line == "HTTP/1.1 206 Partial Content" and body == image[5000:6000]
+                else:
+                    assert response_headers["content-type"].startswith("multipart/byteranges")
+                    assert image[:2] in body and image[3:5] in body
+    finally:
+        s.stop()
+        thread.join(5)
+
+def test_compression():
+    import gzip
+    import zlib
+    s = Server(proxy_directory=EXAMPLE_SITE_PATH, compress_level=6)
+    with open(s.urls["/pico.min.css"], "rb") as css_file:
+        css = css_file.read()
+
+    # Files on disk are compressed as they're sent
+    plain = s.generate_response(Request("schulichignite.com", "/pico.min.css"))
+    assert plain.headers["Vary"] == "Accept-Encoding" and "Content-Encoding" not in plain.headers
+    resp = s.generate_response(Request("schulichignite.com", "/pico.min.css", headers={"Accept-Encoding": "gzip, deflate"}, received=time.perf_counter()))
+    assert resp.headers["Content-Encoding"] == "gzip" and resp.is_streamed()
+    assert resp.headers["ETag"] != plain.headers["ETag"]
+    assert gzip.decompress(resp.body_bytes()) == css
+
+    # The compressed ETag gets a 304 from the compressed representation only
+    headers = {"Accept-Encoding": "gzip", "If-None-Match": resp.headers["ETag"]}
+    assert s.generate_response(Request("schulichignite.com", "/pico.min.css", headers=headers)).status.value == 304
+    assert s.generate_response(Request("schulichignite.com", "/pico.min.css", headers={"If-None-Match": resp.headers["ETag"]})).status.value == 200
+
+    # Small files, other types, ranges and disabled compression are sent as they are
+    for slug, headers, server in (
+        ("/styles.css", {"Accept-Encoding": "gzip"}, s),
+        ("/img/low-poly-ice-caps.jpg", {"Accept-Encoding": "gzip"}, s),
+        ("/pico.min.css", {"Accept-Encoding": "gzip", "Range": "bytes=0-9"}, s),
+        ("/pico.min.css", {"Accept-Encoding": "gzip"}, Server(proxy_directory=EXAMPLE_SITE_PATH)),
+    ):
+        assert "Content-Encoding" not in server.generate_response(Request("schulichignite.com", slug, headers=headers)).headers
+
+    # Content in memory is compressed at once
+    s = Server(proxy_directory=EXAMPLE_SITE_PATH, compress_level=1, use_sendfile=False)
+    resp = s.generate_response(Request("schulichignite.com", "/pico.min.css", headers={"Accept-Encoding": "deflate"}))
+    assert not resp.is_streamed()
+    assert zlib.decompress(resp.body_bytes()) == css
+
+    # Over the wire, with compressed responses from memory cached per encoding
+    for engine in ("sockets", "asyncio"):
+        s = Server(proxy_directory=EXAMPLE_SITE_PATH, port=0, threads=2, compress_level=6, cache_max_bytes=1024 * 1024, cache_max_entry_size=16 * 1024, response_cache_max_bytes=1024 * 1024)
+        if engine == "sockets":
+            thread = serve_in_background(s)
+        else:
+            thread = threading.Thread(target=lambda: asyncio.run(s.serve_async()), daemon=True)
+            thread.start()
+            assert s.listening.wait(5)
+        try:
+            with socket.create_connection(("127.0.0.1", s.port), timeout=5) as client, client.makefile("rb") as stream:
+                for accept_encoding in ("gzip", "", "deflate", "gzip", ""):
+                    client.sendall(f"GET /js/particles.min.js HTTP/1.1\r\nAccept-Encoding: {accept_encoding}\r\n\r\n".encode())
+                    status_line, headers, body = read_response(stream)
+                    assert headers["vary"] == "Accept-Encoding"
+                    with open(s.urls["/js/particles.min.js"], "rb") as js_file:
+                        js = js_file.read()
+                    if accept_encoding == "gzip":
+                        assert gzip.decompress(body) == js
+                    elif accept_encoding == "deflate":
+                        assert zlib.decompress(body) == js
+                    else:
+                        assert "content-encoding" not in headers and body == js
+                # Large files are compressed as they're sent with chunked encoding
+                client.sendall(b"GET /pico.min.css HTTP/1.1\r\nAccept-Encoding: gzip\r\n\r\n")
+                status_line, headers, body = read_response(stream)
+                assert headers["transfer-encoding"] == "chunked"
+                assert gzip.decompress(body) == css
+            assert s.response_cache.stats()["entries"] == 3
+        finally:
+            s.stop()
+            thread.join(5)
+
+def test_precompressed_files(tmp_path):
+    import gzip
+    import shutil
+    site = tmp_path / "site"
+    shutil.copytree(EXAMPLE_SITE_PATH, site)
+    s = Server(proxy_directory=str(site), precompress=True, precompress_workers=4)
+    assert sorted(os.path.basename(path) for path in s.precompressed) == ["ant-consciousness.html", "binturongs.html", "faq.html", "index.html", "particles.min.js", "pelicans-in-calgary.html", "pico.min.css", "posts.html", "themeSwitcher.js"]
+    assert (site / "pico.min.css.gz").exists()
+    assert not (site / "styles.css.gz").exists() # Under compress_min_size
+
+    # The .gz copy is sent as it is to clients that accept gzip
+    resp = s.generate_response(Request("schulichignite.com", "/pico.min.css", headers={"Accept-Encoding": "gzip"}, received=time.perf_counter()))
+    assert resp.headers["Content-Encoding"] == "gzip"
+    assert resp.file_path.endswith("pico.min.css.gz")
+    assert gzip.decompress(resp.body_bytes()) == (site / "pico.min.css").read_bytes()
+    resp = s.generate_response(Request("schulichignite.com", "/pico.min.css", headers={"Accept-Encoding": "gzip"}))
+    assert resp.file_path is None and gzip.decompress(resp.content) == (site / "pico.min.css").read_bytes()
+    assert "Content-Encoding" not in s.generate_response(Request("schulichignite.com", "/pico.min.css", headers={"Accept-Encoding": "deflate"})).headers
+    assert s.generate_response(Request("schulichignite.com", "/pico.min.css")).headers["Vary"] == "Accept-Encoding"
+
+    # Existing copies are picked up on startup
+    modified = os.stat(site / "pico.min.css.gz").st_mtime_ns
+    restarted = Server(proxy_directory=str(site), precompress=True)
+    assert restarted.precompressed[s.urls["/pico.min.css"]][0].endswith("pico.min.css.gz")
+    assert os.stat(site / "pico.min.css.gz").st_mtime_ns == modified
+
+    # The copies aren't URL's of their own
+    for server in (s, restarted, Server(proxy_directory=str(site), lazy=True)):
+        assert server.generate_response(Request("schulichignite.com", "/pico.min.css.gz")).status.value == 404
+
+    # Copies that were changed or removed aren't sent, the file is sent as it is instead
+    faq = (site / "faq.html").read_bytes()
+    (site / "faq.html.gz").write_bytes(b"garbage")
+    s.port = 0
+    thread = serve_in_background(s)
+    try:
+        for remove in (False, True):
+            if remove:
+                os.remove(site / "faq.html.gz")
+            resp = s.generate_response(Request("schulichignite.com", "/faq.html", headers={"Accept-Encoding": "gzip"}, received=time.perf_counter()))
+            assert "Content-Encoding" not in resp.headers and resp.body_bytes() == faq
+            with socket.create_connection(("127.0.0.1", s.port), timeout=5) as client:
+                client.sendall(b"GET /faq.html HTTP/1.1\r\nAccept-Encoding: gzip\r\n\r\n")
+                _, headers, body = read_response(client.makefile("rb"))
+            assert "content-encoding" not in headers and body == faq
+    finally:
+        s.stop()
+        thread.join(5)
+
+    # Changed files aren't sent from their old copy
+    with open(site / "pico.min.css", "a") as css_file:
+        css_file.write("/* changed */")
+    resp = s.generate_response(Request("schulichignite.com", "/pico.min.css", headers={"Accept-Encoding": "gzip"}))
+    assert "Content-Encoding" not in resp.headers
+    s.compress_level = 6 # Falls back to compressing as it's sent
+    resp = s.generate_response(Request("schulichignite.com", "/pico.min.css", headers={"Accept-Encoding": "gzip"}, received=time.perf_counter()))
+    assert resp.is_streamed() and gzip.decompress(resp.body_bytes()) == (site / "pico.min.css").read_bytes()
+
+class StreamingServer(Server):
+    """Serves the example site, plus generated content from /stream and /sized"""
+    def generate_response(self, request: Request) -> Response:
+        if request.slug == "/stream":
+            return Response(StatusCode(200, "Ok"), MIMEType("text/plain"), {}, (f"line {number}\n" for number in range(1000)))
+        if request.slug == "/sized":
+            return Response(StatusCode(200, "Ok"), MIMEType("text/plain"), {}, iter([b"hello ", "world"]), content_length=11)
+        return super().generate_response(request)
+
+def check_streamed_responses(port: int, keep_alive: bool = True):
+    """Checks the /stream and /sized responses of a running StreamingServer, keep_alive is whether it keeps connections open"""
+    expected = "".join(f"line {number}\n" for number in range(1000)).encode()
+    with socket.create_connection(("127.0.0.1", port), timeout=5) as client:
+        stream = client.makefile("rb")
+        client.sendall(b"GET /stream HTTP/1.1\r\n\r\nGET /sized HTTP/1.1\r\n\r\nGET / HTTP/1.1\r\n\r\n")
+        status_line, headers, body = read_response(stream)
+        assert headers["transfer-encoding"] == "chunked" and "content-length" not in headers
+        assert headers["connection"] == ("keep-alive" if keep_alive else "close")
+        assert body == expected
+        if not keep_alive: # The pipelined requests are dropped, so they're sent again on their own connection
+            assert stream.read() == b""
+            client.close()
+            client = socket.create_connection(("127.0.0.1", port), timeout=5)
+            stream = client.makefile("rb")
+            client.sendall(b"GET /sized HTTP/1.1\r\n\r\n")
+        status_line, headers, body = read_response(stream)
+        assert headers["content-length"] == "11" and "transfer-encoding" not in headers
+        assert body == b"hello world"
+        if keep_alive:
+            assert read_response(stream)[0] == "HTTP/1.1 200 Ok"
+        client.close()
+
+    # HTTP/1.0 doesn't support chunked, so the end is marked by closing the connection
+    with socket.create_connection(("127.0.0.1", port), timeout=5) as client:
+        client.sendall(b"GET /stream HTTP/1.0\r\nConnection: keep-alive\r\n\r\n")
+        stream = client.makefile("rb")
+        status_line, headers, _ = read_response(stream)
+        assert headers["connection"] == "close" and "transfer-encoding" not in headers
+        assert stream.read() == expected
+
+def test_streamed_responses():
+    resp = Response(StatusCode(200, "Ok"), MIMEType("text/plain"), {}, (piece for piece in ("a", b"b", "c")))
+    assert resp.is_streamed()
+    assert resp.body_bytes() == b"abc"
+    assert not Response(StatusCode(200, "Ok"), MIMEType("text/plain"), {}, "abc").is_streamed()
+
+    # Blocking and threaded socket engines
+    for threads in (0, 2):
+        s = StreamingServer(proxy_directory=EXAMPLE_SITE_PATH, port=0, threads=threads)
+        thread = serve_in_background(s)
+        try:
+            check_streamed_responses(s.port, keep_alive=threads > 0)
+        finally:
+            s.stop()
+            thread.join(5)
+
+    # asyncio engine
+    s = StreamingServer(proxy_directory=EXAMPLE_SITE_PATH, port=0)
+    thread = threading.Thread(target=lambda: asyncio.run(s.serve_async()), daemon=True)
+    thread.start()
+    assert s.listening.wait(5)
+    try:
+        check_streamed_responses(s.port)
+    finally:
+        s.stop()
+        thread.join(5)
+
+@mark.skipif(not (hasattr(os, "fork") and hasattr(socket, "SO_REUSEPORT")), reason="Needs os.fork() and SO_REUSEPORT")
+def test_worker_processes():
+    # Find a free port for the workers to share
+    with socket.socket() as port_finder:
+        port_finder.bind(("127.0.0.1", 0))
+        port = port_finder.getsockname()[1]
+
+    supervisor = subprocess.Popen(
+        [sys.executable, "-u", "-c", f"from hhttpp.classes import Server; Server({EXAMPLE_SITE_PATH!r}, port={port}).start_workers(2)"],
+        stdout=subprocess.PIPE, text=True
+    )
+    try:
+        worker_pids = []
+        for line in supervisor.stdout:
+            started = re.search(r"Started worker (\d+)", line)
+            if started:
+                worker_pids.append(int(started.group(1)))
+            if len(worker_pids) == 2:
+                break
+
+        # Wait for the workers to start listening
+        for _ in range(100):
+            try:
+                assert fetch(port).startswith(b"HTTP/1.1 200 Ok")
+                break
+            except ConnectionRefusedError:
+                time.sleep(0.05)
+        for _ in range(10):
+            assert fetch(port, "/styles.css").startswith(b"HTTP/1.1 200 Ok")
+
+        # Crashed workers are replaced
+        os.kill(worker_pids[0], signal.SIGKILL)
+        for line in supervisor.stdout:
+            if "Started worker" in line:
+                break
+        assert fetch(port).startswith(b"HTTP/1.1 200 Ok")
+
+        # SIGTERM stops the supervisor and workers
+        supervisor.send_signal(signal.SIGTERM)
+        assert supervisor.wait(10) == 0
+    finally:
+        supervisor.kill()
+        supervisor.stdout.close()
@@ -0,0 +1,56 @@
+# Tests for the compression helpers in hhttpp.compression
+import os
+import zlib
+import gzip
+from hhttpp.compression import choose_encoding, compress, compress_stream, read_file_pieces, precompress_file
+
+def test_choose_encoding():
+    assert choose_encoding("") is None
+    assert choose_encoding("gzip, deflate, br") == "gzip"
+    assert choose_encoding("deflate") == "deflate"
+    assert choose_encoding("gzip;q=0.5, deflate") == "deflate"
+    assert choose_encoding("GZIP;Q=0.8, deflate;q=0.8") == "gzip" # Ties go to gzip
+    assert choose_encoding("gzip;q=0") is None
+    assert choose_encoding("br, identity") is None
+    assert choose_encoding("*") == "gzip"
+    assert choose_encoding("*, gzip;q=0") == "deflate"
+    assert choose_encoding("gzip;q=oops") is None
+    assert choose_encoding("gzip, deflate", available=("deflate",)) == "deflate"
+    assert choose_encoding("gzip", available=()) is None
+
+def test_compress(tmp_path):
+    data = b"hello world " * 10_000
+    assert gzip.decompress(compress(data, "gzip")) == data
+    assert zlib.decompress(compress(data, "deflate", 1)) == data
+
+    # Streamed content is compressed piece by piece
+    pieces = list(compress_stream((data[start:start + 1000] for start in range(0, len(data), 1000)), "gzip"))
+    assert gzip.decompress(b"".join(pieces)) == data
+    assert zlib.decompress(b"".join(compress_stream(["text", b" and bytes"], "deflate"))) == b"text and bytes"
+
+    path = tmp_path / "data.txt"
+    path.write_bytes(data)
+    assert b"".join(read_file_pieces(str(path), piece_size=4096)) == data
+    assert b"".join(read_file_pieces(str(path), 5000, piece_size=4096)) == data[:5000]
+
+def test_precompress_file(tmp_path):
+    path = tmp_path / "page.html"
+    path.write_bytes(b"<p>hello</p>" * 1000)
+    sidecar_path, size, signature, sidecar_signature = precompress_file(str(path))
+    assert sidecar_path == str(path) + ".gz"
+    assert size == os.path.getsize(sidecar_path)
+    assert signature == (os.stat(path).st_mtime_ns, os.path.getsize(path))
+    assert sidecar_signature == (os.stat(sidecar_path).st_mtime_ns, size)
+    assert gzip.decompress((tmp_path / "page.html.gz").read_bytes()) == path.read_bytes()
+    assert sorted(file.name for file in tmp_path.iterdir()) == ["page.html", "page.html.gz"] # No temporary files left behind
+
+    # Current copies are reused, out of date ones are remade
+    modified = os.stat(sidecar_path).st_mtime_ns
+    assert precompress_file(str(path))[0] == sidecar_path
+    assert os.stat(sidecar_path).st_mtime_ns == modified
+    path.write_bytes(b"<p>changed</p>" * 1000)
+    os.utime(path, ns=(modified + 1_000_000_000, modified + 1_000_000_000))
+    precompress_file(str(path))
+    assert gzip.decompress((tmp_path / "page.html.gz").read_bytes()) == path.read_bytes()
+
+    assert precompress_file(str(tmp_path / "missing.html")) is None
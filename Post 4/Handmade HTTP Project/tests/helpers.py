@@ -0,0 +1,47 @@
+# Helpers shared by the tests that run a Server and talk to it over sockets
+import socket
+import threading
+from typing import Dict, Tuple
+from hhttpp.classes import Server
+
+def serve_in_background(server: Server) -> threading.Thread:
+    """Starts a server on a daemon thread and waits until it's listening"""
+    thread = threading.Thread(target=server.start_server, daemon=True)
+    thread.start()
+    assert server.listening.wait(5)
+    return thread
+
+def fetch(port: int, slug: str = "/") -> bytes:
+    """Sends a GET request for slug and returns the full raw response"""
+    with socket.create_connection(("127.0.0.1", port), timeout=5) as client:
+        client.sendall(f"GET {slug} HTTP/1.1\r\nHost: localhost\r\nConnection: close\r\n\r\n".encode())
+        chunks = []
+        while True:
+            chunk = client.recv(65536)
+            if not chunk:
+                break
+            chunks.append(chunk)
+    return b"".join(chunks)
+
+def read_response(stream) -> Tuple[str, Dict[str, str], bytes]:
+    """Reads one response from a file object made with socket.makefile("rb"), returns the status line, headers and body"""
+    status_line = stream.readline().decode().strip()
+    headers = dict()
+    while True:
+        line = stream.readline().decode().strip()
+        if not line:
+            break
+        header, value = line.split(":", 1)
+        headers[header.strip().lower()] = value.strip()
+    if headers.get("transfer-encoding") == "chunked":
+        body = b""
+        while True:
+            size = int(stream.readline().strip(), 16)
+            if size == 0:
+                stream.readline()
+                break
+            body += stream.read(size)
+            stream.readline()
+    else:
+        body = stream.read(int(headers.get("content-length", 0)))
+    return status_line, headers, body
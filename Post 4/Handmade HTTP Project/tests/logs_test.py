@@ -0,0 +1,155 @@
+# Tests for the request log in hhttpp.logs
+import os
+import json
+import socket
+import asyncio
+import threading
+import pytest
+from hhttpp.logs import LogRecord, RequestLog, AccessLog
+from hhttpp.classes import Server, Request
+from helpers import serve_in_background, fetch
+
+EXAMPLE_SITE_PATH = os.path.join(os.path.dirname(__file__), "example_site")
+
+def record(number:int) -> LogRecord:
+    return LogRecord(1_700_000_000.0 + number, "GET", f"/{number}", 200, number, 0.001)
+
+def test_request_log():
+    log = RequestLog(4)
+    assert len(log) == 0 and log.recent() == [] and log.recent(2) == []
+    for number in range(3):
+        log.append(record(number))
+    assert [entry.slug for entry in log] == ["/0", "/1", "/2"]
+
+    # Once it's full the oldest records are overwritten
+    for number in range(3, 10):
+        log.append(record(number))
+    assert len(log) == 4 and log.total == 10
+    assert [entry.slug for entry in log] == ["/6", "/7", "/8", "/9"]
+    assert [entry.slug for entry in log.recent(3)] == ["/7", "/8", "/9"]
+    assert [entry.slug for entry in log.recent(100)] == ["/6", "/7", "/8", "/9"]
+    assert log.recent(0) == []
+    log.clear()
+    assert len(log) == 0 and log.total == 0
+
+    with pytest.raises(ValueError):
+        RequestLog(0)
+
+def test_request_log_threads():
+    log = RequestLog(1000)
+    def append_many(thread_number):
+        for number in range(5000):
+            log.append(record(thread_number * 5000 + number))
+    threads = [threading.Thread(target=append_many, args=(thread_number,)) for thread_number in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert log.total == 40_000 and len(log) == 1000
+    assert len(set(log.recent())) == 1000 # No slot was written twice by racing appends
+
+def test_server_logs():
+    # Responses made directly are logged with the size of their body, and only the newest are kept
+    s = Server(proxy_directory=EXAMPLE_SITE_PATH, log_limit=3)
+    for slug in ("/", "/faq", "/missing", "/posts/binturongs"):
+        resp = s.generate_response(Request("schulichignite.com", slug))
+    newest = s.logs.recent(1)[0]
+    assert [entry.slug for entry in s.logs] == ["/faq", "/missing", "/posts/binturongs"]
+    assert newest.method == "GET" and newest.status == 200 and newest.bytes_sent == len(resp.body_bytes())
+    assert [entry.status for entry in s.logs][1] == 404
+    assert all(entry.latency >= 0 for entry in s.logs)
+
+    # Responses sent over a connection are logged once with the bytes sent (including cached responses)
+    for engine in ("sockets", "asyncio"):
+        s = Server(proxy_directory=EXAMPLE_SITE_PATH, port=0, threads=2, response_cache_max_bytes=1024 * 1024)
+        if engine == "sockets":
+            thread = serve_in_background(s)
+        else:
+            thread = threading.Thread(target=asyncio.run, args=(s.serve_async(),), daemon=True)
+            thread.start()
+            assert s.listening.wait(5)
+        try:
+            raw = [fetch(s.port, slug) for slug in ("/faq", "/faq", "/missing", "/img/low-poly-ice-caps.jpg")]
+        finally:
+            s.stop()
+            thread.join(5)
+        assert [(entry.slug, entry.status) for entry in s.logs] == [("/faq", 200), ("/faq", 200), ("/missing", 404), ("/img/low-poly-ice-caps.jpg", 200)]
+        assert [entry.bytes_sent for entry in s.logs] == [len(response) for response in raw]
+
+def test_access_log(tmp_path):
+    path = str(tmp_path / "access.log")
+    log = AccessLog(path)
+    log.log(LogRecord(1_700_000_000.5, "GET", '/say "hi"', 200, 1097, 0.0015, "127.0.0.1", "1.1"))
+    log.log(LogRecord(1_700_000_001.0, "POST", "/form", 403, 0, 0.0002))
+    log.flush()
+    lines = open(path).read().splitlines()
+    assert len(lines) == 2
+    assert lines[0].startswith("127.0.0.1 - - [") and lines[0].endswith('] "GET /say \\"hi\\" HTTP/1.1" 200 1097')
+    assert lines[1].startswith("- - - [") and lines[1].endswith('"POST /form HTTP/1.1" 403 -')
+    log.close()
+    log.close() # Closing twice does nothing
+    assert log.stats() == {"written": 2, "dropped": 0, "sampled_out": 0, "pending": 0}
+
+    # JSON lines, appended to an existing file after being closed
+    json_path = str(tmp_path / "access.jsonl")
+    log = AccessLog(json_path, format="json")
+    for number in range(3):
+        log.log(record(number))
+        log.close()
+    entries = [json.loads(line) for line in open(json_path)]
+    assert [entry["slug"] for entry in entries] == ["/0", "/1", "/2"]
+    assert entries[0] == {"time": "2023-11-14T22:13:20.000+00:00", "client": "-", "method": "GET", "slug": "/0", "version": "1.1", "status": 200, "bytes": 0, "latency_ms": 1.0}
+
+    # Rotated by size, keeping backup_count old logs
+    rotating_path = str(tmp_path / "rotating.log")
+    log = AccessLog(rotating_path, max_bytes=200, backup_count=2)
+    for number in range(19):
+        log.log(record(number))
+        log.flush()
+    log.close()
+    assert sorted(os.listdir(tmp_path)) == ["access.jsonl", "access.log", "rotating.log", "rotating.log.1", "rotating.log.2"]
+    assert all(os.path.getsize(tmp_path / name) >= 200 for name in ("rotating.log.1", "rotating.log.2"))
+    newest = [open(tmp_path / name).read().splitlines() for name in ("rotating.log", "rotating.log.1")]
+    assert newest[0][-1].endswith('"GET /18 HTTP/1.1" 200 18')
+    assert int(newest[1][-1].rpartition(" ")[2]) == int(newest[0][0].rpartition(" ")[2]) - 1 # Nothing was lost between files
+
+    # Sampled, and dropped instead of waiting when the queue is full
+    log = AccessLog(str(tmp_path / "sampled.log"), sample_rate=0)
+    assert not log.log(record(1)) and log.sampled_out == 1
+    log = AccessLog(str(tmp_path / "full.log"), max_pending=1)
+    blocked = threading.Lock()
+    blocked.acquire()
+    log._write = lambda text, count: blocked.acquire() # Keeps the writer stuck on the first batch
+    log.log(record(1))
+    while log.stats()["pending"]: # Wait for the writer to take the first record
+        pass
+    assert log.log(record(2)) # Fills the queue
+    assert not log.log(record(3)) and log.dropped == 1
+    blocked.release()
+
+    for bad_settings in ({"format": "xml"}, {"sample_rate": 2}, {"max_pending": 0}):
+        with pytest.raises(ValueError):
+            AccessLog(path, **bad_settings)
+
+def send_raw(port:int, data:bytes) -> bytes:
+    # Sends data as it is, and reads until the server closes the connection
+    with socket.create_connection(("127.0.0.1", port), timeout=5) as client:
+        client.sendall(data)
+        return client.makefile("rb").read()
+
+def test_server_access_log(tmp_path, capsys):
+    path = str(tmp_path / "access.log")
+    s = Server(proxy_directory=EXAMPLE_SITE_PATH, port=0, threads=2, access_log_path=path, access_log_format="json")
+    thread = serve_in_background(s)
+    try:
+        raw = [fetch(s.port, slug) for slug in ("/", "/missing")]
+        # Requests refused before they're parsed are logged too (with "-" for what couldn't be parsed), instead of printed
+        raw.append(send_raw(s.port, b"G3T / HTTP/1.1\r\nHost: localhost\r\n\r\n"))
+        raw.append(send_raw(s.port, f"POST /upload HTTP/1.1\r\nContent-Length: {s.max_body_size + 1}\r\n\r\n".encode()))
+    finally:
+        s.stop()
+        thread.join(5)
+    entries = [json.loads(line) for line in open(path)] # Written by the time the server has stopped
+    assert [(entry["slug"], entry["status"], entry["client"]) for entry in entries] == [("/", 200, "127.0.0.1"), ("/missing", 404, "127.0.0.1"), ("-", 400, "127.0.0.1"), ("/upload", 413, "127.0.0.1")]
+    assert [entry["bytes"] for entry in entries] == [len(response) for response in raw]
+    assert "Bad request" not in capsys.readouterr().out
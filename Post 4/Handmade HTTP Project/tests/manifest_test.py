@@ -0,0 +1,111 @@
+# Tests for the persisted site manifest in hhttpp.manifest
+import os
+import shutil
+import pytest
+from hhttpp.manifest import Manifest
+from hhttpp.routing import RouteIndex
+from hhttpp.watching import TreeWatcher
+from hhttpp.classes import Server, Request
+
+EXAMPLE_SITE_PATH = os.path.join(os.path.dirname(__file__), "example_site")
+
+def make_manifest(directory:str) -> Manifest:
+    manifest = Manifest(directory, strong_etags=True)
+    manifest.add_directory("", 1_700_000_000_000_000_000)
+    manifest.add_directory("/posts", None)
+    manifest.add_file("/index.html", 1097, 1_700_000_000_123_456_789, "text/html", False, ('"abc"', "Tue, 14 Nov 2023 22:13:20 GMT", 1_700_000_000), (1_700_000_000_223_456_789, 400))
+    manifest.add_file("/logo.png", 2048, 1_600_000_000_000_000_000, "image/png", True, ('"def"', "Sun, 13 Sep 2020 12:26:40 GMT", 1_600_000_000))
+    manifest.add_file("/posts/ünïcode.html", 10, 1, "text/html", False, ('"ghi"', "Thu, 01 Jan 1970 00:00:00 GMT", 0))
+    return manifest
+
+def test_manifest_round_trip(tmp_path):
+    manifest = make_manifest(str(tmp_path))
+    assert manifest.mime_types == [("text/html", False), ("image/png", True)]
+    loaded = Manifest.from_bytes(manifest.to_bytes())
+    assert loaded == manifest
+    assert len(loaded) == 3
+    assert list(loaded.precompressed_sizes) == [400, -1, -1]
+    assert list(loaded.precompressed_modified) == [1_700_000_000_223_456_789, -1, -1]
+    assert loaded.paths() == [str(tmp_path / "index.html"), str(tmp_path / "logo.png"), str(tmp_path / "posts" / "ünïcode.html")]
+
+    # Directories are turned back into the state a TreeWatcher keeps
+    states = loaded.directory_states()
+    assert states[str(tmp_path)].files == {"index.html", "logo.png"} and states[str(tmp_path)].subdirectories == {"posts"}
+    assert states[str(tmp_path / "posts")].files == {"ünïcode.html"} and states[str(tmp_path / "posts")].modified is None
+
+    # Written files are read back, and anything unreadable is ignored
+    path = str(tmp_path / "site.manifest")
+    manifest.write(path)
+    assert Manifest.read(path) == manifest
+    assert Manifest.read(str(tmp_path / "missing.manifest")) is None
+    data = manifest.to_bytes()
+    for broken in (data[:-1], data + b"\0", b"HHMF", b"NOPE" + data[4:], data[:4] + b"\x63\x00" + data[6:]):
+        with pytest.raises(ValueError):
+            Manifest.from_bytes(broken)
+        (tmp_path / "broken.manifest").write_bytes(broken)
+        assert Manifest.read(str(tmp_path / "broken.manifest")) is None
+
+def test_server_manifest(tmp_path, monkeypatch):
+    site = tmp_path / "site"
+    shutil.copytree(EXAMPLE_SITE_PATH, site)
+    manifest_path = str(tmp_path / "site.manifest")
+
+    # The first start scans the folder and writes the manifest
+    cold = Server(proxy_directory=str(site), manifest=manifest_path, strong_etags=True)
+    assert os.path.exists(manifest_path)
+    manifest = Manifest.read(manifest_path)
+    assert sorted(manifest.urls) == sorted(cold.urls.files) and manifest.strong_etags
+    faq = Request("schulichignite.com", "/faq")
+    etag = cold.generate_response(faq).headers["ETag"]
+
+    # Restarts load it without walking the folder, or hashing files for their ETags
+    def fail(*args, **kwargs):
+        raise AssertionError("Should be loaded from the manifest")
+    with monkeypatch.context() as patch:
+        patch.setattr(RouteIndex, "scan", fail)
+        patch.setattr(TreeWatcher, "snapshot", fail)
+        patch.setattr("hashlib.blake2b", fail)
+        warm = Server(proxy_directory=str(site), manifest=manifest_path, strong_etags=True)
+        assert warm.urls.files == cold.urls.files and sorted(warm.file_list) == sorted(cold.file_list)
+        assert warm.generate_response(faq).headers["ETag"] == etag
+        assert warm.generate_response(faq).body_bytes() == cold.generate_response(faq).body_bytes()
+        assert warm.generate_response(Request("schulichignite.com", "/pico.min.css")).headers["Content-Type"] == "text/css"
+
+    # Files edited since it was written get new validators when they're used
+    faq_path = site / "faq.html"
+    faq_path.write_text("<h1>Edited</h1>")
+    os.utime(faq_path, ns=(1_600_000_000_000_000_000, 1_600_000_000_000_000_000))
+    edited = Server(proxy_directory=str(site), manifest=manifest_path, strong_etags=True)
+    assert edited.generate_response(faq).headers["ETag"] != etag
+
+    # Files added or removed since it was written are picked up, and the manifest is written again
+    (site / "new.html").write_text("<h1>New</h1>")
+    (site / "posts" / "binturongs.html").unlink()
+    changed = Server(proxy_directory=str(site), manifest=manifest_path, strong_etags=True)
+    assert changed.urls.get("/new") == str(site / "new.html") and changed.urls.get("/posts/binturongs") is None
+    manifest = Manifest.read(manifest_path)
+    assert "/new.html" in manifest.urls and "/posts/binturongs.html" not in manifest.urls
+
+    # A manifest with the other kind of ETags isn't used
+    weak = Server(proxy_directory=str(site), manifest=manifest_path)
+    assert weak.generate_response(faq).headers["ETag"].startswith("W/")
+    assert not Manifest.read(manifest_path).strong_etags
+
+def test_server_manifest_precompressed(tmp_path):
+    site = tmp_path / "site"
+    shutil.copytree(EXAMPLE_SITE_PATH, site)
+    manifest_path = str(tmp_path / "site.manifest")
+    cold = Server(proxy_directory=str(site), manifest=manifest_path, precompress=True)
+    warm = Server(proxy_directory=str(site), manifest=manifest_path, precompress=True)
+    assert warm.precompressed == cold.precompressed and warm.precompressed
+    request = Request("schulichignite.com", "/faq", headers={"accept-encoding": "gzip"})
+    assert warm.generate_response(request).headers["Content-Encoding"] == "gzip"
+
+    # Copies changed or removed while the server was stopped aren't sent
+    faq = (site / "faq.html").read_bytes()
+    (site / "faq.html.gz").write_bytes(b"garbage")
+    os.remove(site / "pico.min.css.gz")
+    restarted = Server(proxy_directory=str(site), manifest=manifest_path, precompress=True)
+    for slug, content in (("/faq", faq), ("/pico.min.css", (site / "pico.min.css").read_bytes())):
+        resp = restarted.generate_response(Request("schulichignite.com", slug, headers={"accept-encoding": "gzip"}))
+        assert "Content-Encoding" not in resp.headers and resp.body_bytes() == content
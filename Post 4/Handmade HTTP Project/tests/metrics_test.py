@@ -0,0 +1,134 @@
+# Tests for the metrics in hhttpp.metrics
+import os
+import time
+import socket
+import threading
+import pytest
+from hhttpp.metrics import Metric, MetricsRegistry, Histogram, format_labels
+from hhttpp.classes import Server, Request
+from helpers import serve_in_background, fetch, read_response
+
+EXAMPLE_SITE_PATH = os.path.join(os.path.dirname(__file__), "example_site")
+
+def test_metrics():
+    registry = MetricsRegistry()
+    requests = registry.counter("requests_total", "Requests served", ("method", "status"))
+    connections = registry.gauge("connections", "Open connections")
+    latency = registry.histogram("latency_seconds", "Time taken", buckets=(0.1, 1.0))
+
+    # Every thread records in it's own shard, and they're added together when read
+    def record():
+        for _ in range(10_000):
+            requests.inc(("GET", 200))
+        requests.inc(("POST", 403), 2)
+        connections.inc()
+    threads = [threading.Thread(target=record) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    connections.dec(amount=3)
+    assert requests.values() == {("GET", 200): 80_000, ("POST", 403): 16}
+    assert connections.values() == {(): 5}
+
+    for value in (0.05, 0.1, 0.5, 5):
+        latency.observe(value)
+    assert latency.values() == {(): {"buckets": {0.1: 2, 1.0: 3, float("inf"): 4}, "count": 4, "sum": 5.65}}
+    assert latency.quantile(0.5) == 0.1 and latency.quantile(0.99) == float("inf")
+    assert Histogram("empty").quantile(0.5) is None
+
+    # The same name gets the same metric, unless it's a different kind
+    assert registry.counter("requests_total") is requests
+    with pytest.raises(ValueError):
+        registry.gauge("requests_total")
+
+    registry.callback("cache_hits_total", "counter", "Cache hits", ("cache",), lambda: {("content",): 3})
+    assert registry.snapshot()["cache_hits_total"] == {("content",): 3}
+    hits = registry.metrics["cache_hits_total"]
+    thread = threading.Thread(target=hits._shard)
+    thread.start()
+    thread.join()
+    assert hits._copies() == [dict()] # The exited thread's shard is merged, there's just nothing in it
+    with pytest.raises(TypeError):
+        Metric("untyped") # Only subclasses that merge and read their shards can be made
+    assert registry.render().splitlines() == [
+        "# HELP requests_total Requests served",
+        "# TYPE requests_total counter",
+        'requests_total{method="GET",status="200"} 80000',
+        'requests_total{method="POST",status="403"} 16',
+        "# HELP connections Open connections",
+        "# TYPE connections gauge",
+        "connections 5",
+        "# HELP latency_seconds Time taken",
+        "# TYPE latency_seconds histogram",
+        'latency_seconds_bucket{le="0.1"} 2',
+        'latency_seconds_bucket{le="1"} 3',
+        'latency_seconds_bucket{le="+Inf"} 4',
+        "latency_seconds_sum 5.65",
+        "latency_seconds_count 4",
+        "# HELP cache_hits_total Cache hits",
+        "# TYPE cache_hits_total counter",
+        'cache_hits_total{cache="content"} 3',
+    ]
+    assert format_labels(("slug",), ('/say "hi"\\\n',)) == '{slug="/say \\"hi\\"\\\\\\n"}'
+
+def test_metrics_thread_churn():
+    # Shards of threads that have exited are merged, so threads coming and going don't grow the metric
+    requests = MetricsRegistry().counter("requests_total")
+    latency = Histogram("latency_seconds", buckets=(0.1, 1.0))
+    def record():
+        requests.inc()
+        latency.observe(0.5)
+    for _ in range(50):
+        thread = threading.Thread(target=record)
+        thread.start()
+        thread.join()
+    assert len(requests._shards) <= 1 and len(latency._shards) <= 1
+    assert requests.values() == {(): 50}
+    assert latency.values() == {(): {"buckets": {0.1: 0, 1.0: 50, float("inf"): 50}, "count": 50, "sum": 25.0}}
+    assert not requests._shards and not latency._shards
+
+def test_server_metrics():
+    # Disabled by default, so the URL is just another missing file
+    s = Server(proxy_directory=EXAMPLE_SITE_PATH)
+    assert s.metrics is None
+    assert s.generate_response(Request("schulichignite.com", "/__metrics")).status.value == 404
+
+    s = Server(proxy_directory=EXAMPLE_SITE_PATH, port=0, threads=2, metrics_enabled=True, cache_max_bytes=1024 * 1024, response_cache_max_bytes=1024 * 1024)
+    thread = serve_in_background(s)
+    try:
+        raw = [fetch(s.port, slug) for slug in ("/", "/", "/faq", "/missing")]
+
+        # Connections kept alive are counted while they wait for their next request
+        with socket.create_connection(("127.0.0.1", s.port), timeout=5) as client, client.makefile("rb") as stream:
+            client.sendall(b"GET /faq HTTP/1.1\r\nHost: localhost\r\n\r\n")
+            read_response(stream)
+            deadline = time.time() + 5
+            connections = lambda: (s.metrics.active_connections.values().get(()), s.metrics.keep_alive_connections.values().get(()))
+            while connections() != (1, 1) and time.time() < deadline: # Earlier connections might still be closing
+                time.sleep(0.01)
+            assert connections() == (1, 1)
+            client.sendall(b"POST /faq HTTP/1.1\r\nHost: localhost\r\nContent-Length: 2\r\nConnection: close\r\n\r\nhi")
+            read_response(stream)
+            assert stream.read() == b"" # Responses are recorded after they're sent, so wait for the server to close the connection
+        exported = fetch(s.port, "/__metrics")
+    finally:
+        s.stop()
+        thread.join(5)
+
+    head, _, body = exported.partition(b"\r\n\r\n")
+    assert b" 200 " in head.split(b"\r\n")[0] and b"Content-Type: text/plain; version=0.0.4" in head
+    lines = body.decode().splitlines()
+    assert 'hhttpp_requests_total{method="GET",status="200"} 4' in lines
+    assert 'hhttpp_requests_total{method="GET",status="404"} 1' in lines
+    assert 'hhttpp_requests_total{method="POST",status="403"} 1' in lines
+    assert "hhttpp_connections_total 6" in lines
+    assert 'hhttpp_cache_hits_total{cache="response"} 2' in lines # The second / and /faq
+    assert "hhttpp_request_duration_seconds_count 6" in lines # The metrics request is counted once it's sent
+    assert "hhttpp_parse_duration_seconds_count 7" in lines
+
+    snapshot = s.metrics.snapshot()
+    assert snapshot["hhttpp_connections_active"] == {(): 0} and snapshot["hhttpp_connections_keep_alive"] == {(): 0}
+    assert snapshot["hhttpp_response_bytes_total"][()] >= sum(len(response) for response in raw)
+    assert snapshot["hhttpp_request_bytes_total"][()] > 6 * len(b"GET / HTTP/1.1\r\n")
+    assert snapshot["hhttpp_file_read_duration_seconds"][()]["count"] >= 1
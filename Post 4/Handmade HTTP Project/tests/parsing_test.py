@@ -0,0 +1,135 @@
+# Tests for the incremental request parser in hhttpp.parsing
+from pytest import raises
+from hhttpp.parsing import RequestParser, RequestBody, BodyError, MAX_HEADER_SIZE
+
+def test_request_parser():
+    # Requests can arrive one byte at a time
+    raw_request = b"POST /form HTTP/1.1\r\nHost: localhost\r\nContent-Length: 5\r\nX-Empty:\r\n\r\nhello"
+    parser = RequestParser()
+    for index in range(len(raw_request) - 1):
+        assert parser.feed(raw_request[index:index + 1]) == "incomplete"
+    assert parser.feed(raw_request[-1:]) == "complete"
+    assert parser.method == "POST"
+    assert parser.slug == "/form"
+    assert parser.version == "1.1"
+    assert parser.headers == {"Host": "localhost", "Content-Length": "5", "X-Empty": ""}
+    assert parser.body == b"hello"
+
+    # Bare \n line endings are accepted
+    parser = RequestParser()
+    assert parser.feed(b"GET / HTTP/1.0\nHost: localhost\n\n") == "complete"
+    assert parser.version == "1.0"
+
+def test_pipelined_requests():
+    parser = RequestParser()
+    assert parser.feed(b"GET /a HTTP/1.1\r\n\r\nGET /b HTTP/1.1\r\nContent-Length: 2\r\n\r\nhiGET /c HT") == "complete"
+    assert parser.slug == "/a"
+    parser.reset()
+    assert parser.feed() == "complete"
+    assert parser.slug == "/b"
+    assert parser.body == b"hi"
+    parser.reset()
+    assert parser.feed() == "incomplete"
+    assert parser.feed(b"TP/1.1\r\n\r\n") == "complete"
+    assert parser.slug == "/c"
+
+def test_final_input():
+    # The whole input is the request, anything after the headers is the body
+    parser = RequestParser()
+    assert parser.feed(b"GET / HTTP/1.1\nHost: localhost", final=True) == "complete"
+    assert parser.headers == {"Host": "localhost"}
+    parser = RequestParser()
+    assert parser.feed(b"PUT / HTTP/1.1\nHost: localhost\n\n{'a': 1}", final=True) == "complete"
+    assert parser.body == b"{'a': 1}"
+    parser = RequestParser()
+    assert parser.feed(b"PUT / HTTP/1.1\nContent-Length: 10\n\n{'a': 1}", final=True) == "error"
+
+def test_parser_errors():
+    for raw_request in (b"G2ET / HTTP/1.1\r\n\r\n", b"REMOVEPLZ / HTTP/1.1\r\n\r\n", b"GET / HTTP/9\r\n\r\n",
+                        b"GET / 1.1\r\n\r\n", b"GET / /\r\n\r\n", b"GET index.html HTTP/1.1\r\n\r\n",
+                        b"POST / HTTP/1.1\r\nContent-Length: lots\r\n\r\n", b"GET / HTTP/2.0\r\n\r\n", b"GET / HTTP/1.2\r\n\r\n"):
+        parser = RequestParser()
+        assert parser.feed(raw_request) == "error"
+        assert parser.error
+
+    # Headers that never end are cut off
+    parser = RequestParser()
+    assert parser.feed(b"GET / HTTP/1.1\r\nHost: " + b"a" * MAX_HEADER_SIZE) == "error"
+
+def reader(*pieces:bytes):
+    """Returns a source that hands out pieces one at a time, like reads from a connection"""
+    pieces = list(pieces)
+    return lambda: pieces.pop(0) if pieces else b""
+
+def test_streamed_body():
+    parser = RequestParser(stream_body=True)
+    assert parser.feed(b"POST / HTTP/1.1\r\nContent-Length: 10\r\n\r\n0123") == "complete"
+    body = parser.take_body(reader(b"456", b"789GET / HTTP/1.1\r\n\r\n"))
+    parser.reset()
+    assert body.remaining() == 10
+    assert body.read(2) == b"01"
+    assert body.read() == b"23456789"
+    assert body.done
+    assert body.read() == b""
+
+    # Data after the body is the next request
+    assert parser.feed(body.leftover()) == "complete"
+    assert parser.slug == "/"
+
+def test_chunked_body():
+    raw_body = b"4\r\nWiki\r\n7;name=value\r\npedia i\r\nB\r\nn \r\nchunks.\r\n0\r\nExpires: never\r\n\r\nGET"
+    expected = b"Wikipedia in \r\nchunks."
+
+    ## Streamed, arriving a few bytes at a time
+    parser = RequestParser(stream_body=True)
+    assert parser.feed(b"POST / HTTP/1.1\r\nTransfer-Encoding: chunked\r\n\r\n") == "complete"
+    assert parser.chunked
+    body = parser.take_body(reader(*[raw_body[index:index + 3] for index in range(0, len(raw_body), 3)]))
+    assert body.remaining() is None
+    assert body.read() == expected
+    assert b"GET".startswith(body.leftover()) # Only what's been read past the body so far
+
+    ## Buffered
+    parser = RequestParser()
+    assert parser.feed(b"POST / HTTP/1.1\r\nTransfer-Encoding: chunked\r\n\r\n" + raw_body[:20]) == "incomplete"
+    assert parser.feed(raw_body[20:]) == "complete"
+    assert parser.body == expected
+
+    ## Buffered, arriving a byte at a time (each feed() carries on decoding from where the last one stopped)
+    parser = RequestParser()
+    assert parser.feed(b"POST / HTTP/1.1\r\nTransfer-Encoding: chunked\r\n\r\n") == "incomplete"
+    states = [parser.feed(raw_body[index:index + 1]) for index in range(len(raw_body))]
+    assert states.index("complete") == raw_body.index(b"\r\n\r\nGET") + 3
+    assert parser.body == expected
+    parser.reset()
+    assert parser.feed(b" / HTTP/1.1\r\n\r\n") == "complete" and parser.method == "GET"
+
+    ## Errors
+    for bad_body in (b"zz\r\nhi\r\n0\r\n\r\n", b"2\r\nhello\r\n0\r\n\r\n"):
+        body = RequestBody(None, chunked=True, source=reader(bad_body))
+        with raises(BodyError):
+            body.read()
+    assert RequestParser().feed(b"POST / HTTP/1.1\r\nTransfer-Encoding: gzip\r\n\r\n") == "error"
+
+def test_body_limits():
+    # Bodies over max_size are refused
+    body = RequestBody(None, chunked=True, max_size=4, source=reader(b"5\r\nhello\r\n0\r\n\r\n"))
+    with raises(BodyError):
+        body.read()
+
+    # Large bodies are spooled to disk instead of memory
+    body = RequestBody(100_000, spool_threshold=1000, source=reader(*[b"x" * 10_000] * 10))
+    spooled = body.spool()
+    assert spooled._rolled
+    assert spooled.read() == b"x" * 100_000
+
+    # Closing the connection early is an error
+    body = RequestBody(10, source=reader(b"12345"))
+    with raises(ConnectionError):
+        body.read()
+
+    # Bodies nobody reads are skipped without keeping them
+    body = RequestBody(30_000, source=reader(*[b"y" * 1000] * 30))
+    body.discard()
+    assert body.done
+    assert body.bytes_read == 30_000
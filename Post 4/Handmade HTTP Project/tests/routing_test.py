@@ -0,0 +1,173 @@
+# Tests for the URL index in hhttpp.routing
+import os
+import time
+from hhttpp.routing import BloomFilter, RouteIndex, LazyRouteIndex, scan_files
+from hhttpp.classes import Server, Request
+
+EXAMPLE_SITE_PATH = os.path.join(os.path.dirname(__file__), "example_site")
+
+def make_files(root, *names):
+    for name in names:
+        path = root / name
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_text(name)
+
+def test_scan_files(tmp_path):
+    make_files(tmp_path, "index.html", "index.html.gz", "LICENSE", ".hidden.txt", ".git/config.txt", "docs/guide.html", "docs/deep/er/page.txt", "backup.tar.gz")
+    found = dict(scan_files(str(tmp_path)))
+    assert found == {
+        "/index.html": str(tmp_path / "index.html"), # The .gz copy next to it isn't a URL of it's own
+        "/backup.tar.gz": str(tmp_path / "backup.tar.gz"),
+        "/docs/guide.html": str(tmp_path / "docs" / "guide.html"),
+        "/docs/deep/er/page.txt": str(tmp_path / "docs" / "deep" / "er" / "page.txt"),
+    }
+
+def test_route_index(tmp_path):
+    make_files(tmp_path, "index.html", "about.html", "style.css", "posts.html", "posts/first.html", "docs/index.html", "docs/api/index.html", "docs/api/v1.html")
+    file_list = []
+    routes = RouteIndex.scan(str(tmp_path), file_list)
+    assert sorted(file_list) == sorted(routes.files.values())
+    assert len(routes) == 8
+
+    # Exact files, aliases and directory indexes
+    assert routes.lookup("/style.css") == str(tmp_path / "style.css")
+    assert routes.lookup("/") == routes.lookup("/index.html") == str(tmp_path / "index.html")
+    assert routes.lookup("/about") == routes.lookup("/about/") == str(tmp_path / "about.html")
+    assert routes.lookup("/posts") == routes.lookup("/posts/") == str(tmp_path / "posts.html") # The folder has no index
+    assert routes.lookup("/posts/first") == str(tmp_path / "posts" / "first.html")
+    assert routes.lookup("/docs") == routes.lookup("/docs/") == str(tmp_path / "docs" / "index.html")
+    assert routes.lookup("/docs/api/") == str(tmp_path / "docs" / "api" / "index.html")
+    assert routes.lookup("/docs/api/v1") == str(tmp_path / "docs" / "api" / "v1.html")
+
+    # Nested indexes don't replace the homepage
+    assert routes["/"] != routes["/docs/"]
+
+    for missing in ("/missing", "/style", "//", "/docs//", "/docs/api/v2", "/nope/index.html"):
+        assert routes.lookup(missing) is None
+        assert missing not in routes
+        assert routes.get(missing, "default") == "default"
+
+    # Files can be added and removed
+    routes.add("/docs/api/v2.html", "v2.html")
+    assert routes.lookup("/docs/api/v2") == "v2.html"
+    assert routes.remove("/docs/index.html") == str(tmp_path / "docs" / "index.html")
+    assert routes.lookup("/docs/") is None
+    assert routes.remove("/docs/index.html") is None
+    assert "/docs/index.html" not in list(routes)
+
+def test_bloom_filter():
+    known = BloomFilter(1000)
+    for number in range(1000):
+        known.add(f"/page{number}")
+    assert all(f"/page{number}" in known for number in range(1000)) # Never any false negatives
+    false_positives = sum(f"/missing{number}" in known for number in range(10_000))
+    assert false_positives < 300 # About 1.4% at capacity
+    assert not known.full()
+    known.add("/one-more")
+    assert known.full()
+    copied = known.copy()
+    copied.add("/only-in-copy")
+    assert "/only-in-copy" in copied and copied.count == known.count + 1
+
+def test_route_index_filter(tmp_path):
+    make_files(tmp_path, "index.html", "about.html", "style.css", "docs/index.html")
+    routes = RouteIndex.scan(str(tmp_path))
+
+    # Every slug that resolves is in the filter, so it never hides a file
+    for slug in ("/", "/index.html", "/about", "/about/", "/about.html", "/style.css", "/docs", "/docs/", "/docs/index.html"):
+        assert slug in routes.known and routes.lookup(slug) is not None, slug
+    assert "/missing" not in routes.known
+
+    # Added files are resolvable straight away, even once the filter has to grow
+    for number in range(3000):
+        routes.add(f"/posts/post{number}.html", f"post{number}.html")
+    assert routes.known.capacity > 1024
+    assert all(routes.lookup(f"/posts/post{number}") == f"post{number}.html" for number in range(3000))
+
+    # Removed files are dropped from the filter once enough of them build up
+    for number in range(3000):
+        routes.remove(f"/posts/post{number}.html")
+    assert routes.removed < 3000 and routes.known.count < 3000
+    assert routes.lookup("/posts/post0") is None
+    assert routes.copy().lookup("/about") == str(tmp_path / "about.html")
+
+def test_server_routes():
+    s = Server(proxy_directory=EXAMPLE_SITE_PATH)
+    assert isinstance(s.urls, RouteIndex)
+    assert s.urls["/"] == s.urls["/index.html"]
+    assert s.urls["/faq"] == s.urls["/faq.html"]
+    assert s.urls["/posts/binturongs"].endswith("binturongs.html")
+    assert s.generate_response(Request("schulichignite.com", "/posts/binturongs")).status.value == 200
+
+    # URL's can also be given directly
+    s = Server(proxy_directory=EXAMPLE_SITE_PATH, urls={"/home": os.path.join(EXAMPLE_SITE_PATH, "index.html")})
+    assert s.generate_response(Request("schulichignite.com", "/home")).status.value == 200
+    assert s.generate_response(Request("schulichignite.com", "/")).status.value == 404
+
+    # Misses get the 404 prepared on startup, without generating a response
+    s = Server(proxy_directory=EXAMPLE_SITE_PATH)
+    assert s.cached_response(Request("schulichignite.com", "/wp-login.php")) is s._not_found
+    assert s._not_found.head.startswith(b"HTTP/1.1 404 Not Found")
+    assert s.cached_response(Request("schulichignite.com", "/wp-login.php", "POST")) is None
+    assert s.cached_response(Request("schulichignite.com", "/faq")) is not s._not_found
+    assert Server(proxy_directory=EXAMPLE_SITE_PATH, error_on_4xx=True).cached_response(Request("schulichignite.com", "/wp-login.php")) is None
+
+def test_lazy_route_index(tmp_path):
+    make_files(tmp_path, "site/index.html", "site/about.html", "site/style.css", "site/style.css.gz", "site/docs/index.html", "site/.secret.txt", "site/LICENSE", "outside.txt")
+    root = tmp_path / "site"
+    lazy = LazyRouteIndex(str(root), max_entries=4, check_interval=60)
+    eager = RouteIndex.scan(str(root))
+
+    # The same rules as RouteIndex
+    for slug in ("/", "/index.html", "/about", "/about/", "/style.css", "/docs", "/docs/", "/missing", "/LICENSE", "/style", "//", "/docs//", "/style.css.gz"):
+        assert lazy.resolve(slug) == eager.lookup(slug), slug
+
+    # Nothing outside the folder (or hidden) can be reached
+    for slug in ("/../outside.txt", "/docs/../../outside.txt", "/./index.html", "/.secret.txt", "/..", "/docs/..", "\\..\\outside.txt", "/..\\outside.txt", "/index.html\0", "outside.txt"):
+        assert lazy.resolve(slug) is None, slug
+
+    # Lookups are remembered, found or not, up to max_entries and max_missing
+    assert lazy.lookup("/about") == str(root / "about.html")
+    assert lazy.lookup("/about") == str(root / "about.html")
+    assert lazy.lookup("/missing") is None
+    assert lazy.lookup("/missing") is None
+    assert lazy.stats() == {"hits": 2, "misses": 2, "entries": 1, "missing": 1}
+    for slug in ("/", "/style.css", "/docs", "/docs/"):
+        lazy.lookup(slug)
+    assert list(lazy.entries) == ["/", "/style.css", "/docs", "/docs/"]
+    assert list(lazy) == list(lazy.entries) and len(lazy) == 4 # Only found files are listed
+
+    # Floods of missing slugs don't push out found files
+    lazy = LazyRouteIndex(str(root), max_entries=4, max_missing=3, check_interval=60)
+    lazy.lookup("/about")
+    for number in range(100):
+        assert lazy.lookup(f"/missing{number}") is None
+    assert list(lazy.entries) == ["/about"]
+    assert list(lazy.missing) == ["/missing97", "/missing98", "/missing99"]
+    lazy.lookup("/x" * 1000) # Too long to remember
+    assert "/x" * 1000 not in lazy.missing
+
+    # Remembered lookups are checked again after check_interval
+    lazy = LazyRouteIndex(str(root), check_interval=0.05)
+    assert lazy.lookup("/new") is None
+    (root / "new.html").write_text("new")
+    assert lazy.lookup("/new") is None
+    time.sleep(0.06)
+    assert lazy.lookup("/new") == str(root / "new.html")
+    assert "/new" in lazy and lazy["/new"] == str(root / "new.html")
+
+def test_server_lazy_routes():
+    s = Server(proxy_directory=EXAMPLE_SITE_PATH, lazy=True)
+    assert isinstance(s.urls, LazyRouteIndex)
+    assert s.file_list == [] # Nothing is indexed on startup
+    assert s.generate_response(Request("schulichignite.com", "/posts/binturongs")).status.value == 200
+    assert s.generate_response(Request("schulichignite.com", "/")).body_bytes() == open(os.path.join(EXAMPLE_SITE_PATH, "index.html"), "rb").read()
+    assert s.generate_response(Request("schulichignite.com", "/../routing_test.py")).status.value == 404
+
+    # Requests from a connection look their slug up once, and responses from the cache don't look it up at all
+    s = Server(proxy_directory=EXAMPLE_SITE_PATH, lazy=True, response_cache_max_bytes=1024 * 1024)
+    for _ in range(3):
+        request = Request("schulichignite.com", "/faq", received=time.perf_counter())
+        prepared = s.cached_response(request) or s._respond(request)
+        assert prepared.status() == 200
+    assert s.urls.stats()["hits"] + s.urls.stats()["misses"] == 1
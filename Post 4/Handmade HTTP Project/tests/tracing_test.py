@@ -0,0 +1,86 @@
+# Tests for per request tracing in hhttpp.tracing
+import os
+import json
+import time
+import socket
+import asyncio
+import threading
+import pytest
+from hhttpp.tracing import Span, Tracer, SlowRequestLog
+from hhttpp.classes import Server, Request
+from helpers import serve_in_background, fetch, read_response
+
+EXAMPLE_SITE_PATH = os.path.join(os.path.dirname(__file__), "example_site")
+
+def test_span(tmp_path):
+    span = Span("GET", "/faq", [("started", 10.0), ("received", 10.001), ("parsed", 10.0015)])
+    span.status, span.bytes_sent = 200, 1097
+    assert span.durations() == pytest.approx({"received": 0.001, "parsed": 0.0005})
+    assert span.duration() == pytest.approx(0.0015)
+    span.attributes["trace_id"] = "abc"
+    assert span.to_dict() == {"method": "GET", "slug": "/faq", "status": 200, "bytes_sent": 1097, "total_ms": 1.5,
+        "stages_ms": {"received": 1.0, "parsed": 0.5}, "trace_id": "abc"}
+    assert Span("GET", "/").duration() == 0.0 and Span("GET", "/").durations() == {}
+
+    # Only spans over the threshold are written
+    path = str(tmp_path / "slow.jsonl")
+    slow = SlowRequestLog(path, threshold=0.001)
+    slow(span)
+    slow(Span("GET", "/fast", [("started", 1.0), ("sent", 1.0005)]))
+    assert [json.loads(line)["slug"] for line in open(path)] == ["/faq"]
+
+    # Hooks are called in order, sampled out requests get no span, and errors in hooks don't stop the request
+    calls = []
+    tracer = Tracer()
+    tracer.add_hook(pre=lambda span: calls.append(("pre", span.slug)), post=lambda span: calls.append(("post", span.status)))
+    tracer.add_hook(post=lambda span: 1 / 0)
+    span = tracer.start("GET", "/", [("started", 1.0)])
+    tracer.finish(span, 404, 10)
+    assert calls == [("pre", "/"), ("post", 404)] and span.marks[-1][0] == "sent" and span.bytes_sent == 10
+    assert Tracer(sample_rate=0).start("GET", "/", []) is None
+    with pytest.raises(ValueError):
+        Tracer(sample_rate=1.5)
+
+def test_server_tracing():
+    # Without a tracer requests never get a span
+    s = Server(proxy_directory=EXAMPLE_SITE_PATH)
+    request = Request("schulichignite.com", "/faq")
+    s.generate_response(request)
+    assert request.span is None
+
+    generated = ["accepted", "started", "received", "parsed", "routed", "mime", "validators", "read", "generated", "serialized", "sent"]
+    for engine in ("sockets", "asyncio"):
+        spans = []
+        started = []
+        tracer = Tracer()
+        tracer.add_hook(pre=lambda span: started.append([stage for stage, _ in span.marks]), post=spans.append)
+        s = Server(proxy_directory=EXAMPLE_SITE_PATH, port=0, threads=2, response_cache_max_bytes=1024 * 1024, tracer=tracer)
+        if engine == "sockets":
+            thread = serve_in_background(s)
+        else:
+            thread = threading.Thread(target=asyncio.run, args=(s.serve_async(),), daemon=True)
+            thread.start()
+            assert s.listening.wait(5)
+        try:
+            with socket.create_connection(("127.0.0.1", s.port), timeout=5) as client, client.makefile("rb") as stream:
+                for _ in range(2):
+                    client.sendall(b"GET /faq HTTP/1.1\r\nHost: localhost\r\n\r\n")
+                    read_response(stream)
+            deadline = time.time() + 5
+            while len(spans) < 2 and time.time() < deadline: # Spans are finished once the response is sent, so the last might not be yet
+                time.sleep(0.01)
+            fetch(s.port, "/missing")
+        finally:
+            s.stop()
+            thread.join(5)
+
+        # Stages are marked in order as they finish, and pre hooks see the stages before the response is made
+        assert started[0] == ["accepted", "started", "received", "parsed"] and started[1] == ["started", "received", "parsed"]
+        assert [stage for stage, _ in spans[0].marks] == generated
+        assert [stage for stage, _ in spans[1].marks] == ["started", "received", "parsed", "cached", "sent"] # From the response cache, on the same connection
+        assert [stage for stage, _ in spans[2].marks] == ["accepted", "started", "received", "parsed", "cached", "sent"] # The prepared 404
+        for span in spans:
+            times = [finished for _, finished in span.marks]
+            assert times == sorted(times)
+        assert [(span.slug, span.status) for span in spans] == [("/faq", 200), ("/faq", 200), ("/missing", 404)]
+        assert spans[0].bytes_sent == s.logs.recent()[0].bytes_sent
@@ -0,0 +1,85 @@
+# Tests for the file tree watcher in hhttpp.watching
+import os
+import time
+import shutil
+from hhttpp.watching import TreeWatcher
+from hhttpp.classes import Server, Request
+
+def write_file(path, content:str = "content"):
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_text(content)
+
+def test_tree_watcher(tmp_path):
+    write_file(tmp_path / "index.html")
+    write_file(tmp_path / "posts" / "first.html")
+    watcher = TreeWatcher(str(tmp_path))
+    assert watcher.snapshot() == {"/index.html": str(tmp_path / "index.html"), "/posts/first.html": str(tmp_path / "posts" / "first.html")}
+    assert watcher.poll() == []
+
+    # Added, removed and renamed files
+    write_file(tmp_path / "posts" / "second.html")
+    (tmp_path / "index.html").rename(tmp_path / "home.html")
+    assert sorted(watcher.poll()) == [
+        ("added", "/home.html", str(tmp_path / "home.html")),
+        ("added", "/posts/second.html", str(tmp_path / "posts" / "second.html")),
+        ("removed", "/index.html", str(tmp_path / "index.html")),
+    ]
+    assert watcher.poll() == []
+
+    # Whole subtrees being added and removed
+    write_file(tmp_path / "docs" / "api" / "v1.html")
+    write_file(tmp_path / "docs" / "style.css")
+    write_file(tmp_path / "docs" / "LICENSE") # No extension, so it's not served
+    assert sorted(watcher.poll()) == [
+        ("added", "/docs/api/v1.html", str(tmp_path / "docs" / "api" / "v1.html")),
+        ("added", "/docs/style.css", str(tmp_path / "docs" / "style.css")),
+    ]
+    shutil.rmtree(tmp_path / "docs")
+    assert sorted(watcher.poll()) == [
+        ("removed", "/docs/api/v1.html", str(tmp_path / "docs" / "api" / "v1.html")),
+        ("removed", "/docs/style.css", str(tmp_path / "docs" / "style.css")),
+    ]
+    assert str(tmp_path / "docs" / "api") not in watcher.directories
+
+def wait_for(condition, timeout:float = 5) -> bool:
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if condition():
+            return True
+        time.sleep(0.02)
+    return False
+
+def test_server_watching(tmp_path):
+    write_file(tmp_path / "index.html", "home")
+    write_file(tmp_path / "posts.html", "posts")
+    s = Server(proxy_directory=str(tmp_path), watch_interval=0.05, cache_max_bytes=1024 * 1024, response_cache_max_bytes=1024 * 1024)
+    old_urls = s.urls
+    served = lambda slug: s.generate_response(Request("schulichignite.com", slug))
+    assert served("/posts").body_bytes() == b"posts"
+    s.prepare_response(Request("schulichignite.com", "/posts/"), served("/posts/")) # Put in the response cache
+    assert s.cached_response(Request("schulichignite.com", "/posts/"))
+
+    # A file made before watching started is caught up on
+    write_file(tmp_path / "early.html", "early")
+    s.start_watching()
+    try:
+        assert wait_for(lambda: "/early" in s.urls)
+
+        # New folders and files
+        write_file(tmp_path / "posts" / "index.html", "post index")
+        assert wait_for(lambda: "/posts/index.html" in s.urls)
+        assert served("/posts/").body_bytes() == b"post index"
+        assert s.cached_response(Request("schulichignite.com", "/posts/")) is None # Cleared since /posts/ changed
+
+        # Removed files
+        os.remove(tmp_path / "posts.html")
+        assert wait_for(lambda: "/posts.html" not in s.urls)
+        assert served("/posts").body_bytes() == b"post index"
+        assert served("/posts.html").status.value == 404
+        assert str(tmp_path / "posts.html") not in s.content_cache.entries
+    finally:
+        s.stop_watching()
+    assert not s._watcher_thread
+
+    # The table is replaced, not changed while it's in use
+    assert "/early" not in old_urls